@@ -5,7 +5,7 @@ from pathlib import Path
 
 from petri_net import New, SelectTransition, SyncPetriNet, SyncTransition, Token, Place, ArcIn
 from helpers.print_net import PrintPetriNet
-from helpers.graph_net import GraphNet
+from helpers.graph_net import GraphRenderer
 
 
 def tokens_from_comma_delimited(token: Token) -> tuple[Token]:
@@ -65,9 +65,8 @@ starting_petri_net = New.petri_net(nodes_and_edges)
 
 def main(save_graphs_to_files: bool = False):
     if save_graphs_to_files:
-        graphs_dir = Path("graphs")
-        graphs_dir.mkdir(exist_ok=True, parents=True)
-        GraphNet.to_file(starting_petri_net, graphs_dir/"000_before", format="svg")
+        graph_renderer = GraphRenderer(starting_petri_net, Path("graphs"), format="svg")
+        graph_renderer.submit(starting_petri_net, "000_before")
     transition_firing = True
     petri_net = starting_petri_net
     PrintPetriNet.places_and_tokens(petri_net)
@@ -80,10 +79,11 @@ def main(save_graphs_to_files: bool = False):
         )
         PrintPetriNet.places_and_tokens(petri_net)
         if save_graphs_to_files:
-            GraphNet.to_file(petri_net, graphs_dir/f"{step_count:03}_step", format="svg")
+            graph_renderer.submit(petri_net, f"{step_count:03}_step")
 
     if save_graphs_to_files:
-        GraphNet.to_file(petri_net, graphs_dir/"after", format="svg")
+        graph_renderer.submit(petri_net, "after")
+        graph_renderer.close()
 
 
 if __name__ == "__main__":
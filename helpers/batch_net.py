@@ -0,0 +1,148 @@
+import asyncio
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Optional
+
+from petri_net import AsyncPetriNet, PetriNet, SelectTransition, SyncPetriNet, Token, Transition
+
+
+Marking = dict[str, tuple[Token, ...]]
+
+
+class BatchPetriNet:
+    """Run many independent instances of the same net, each starting from its own initial marking.
+
+    The net_factory, selection and result functions are sent to worker processes, so they must be picklable
+    (e.g. defined at module level rather than as lambdas).
+    """
+
+    def marking(net: PetriNet) -> Marking:
+        return {place_id: tuple(place.tokens) for place_id, place in net.places.items()}
+
+    def sink_marking(net: PetriNet) -> Marking:
+        """The tokens held by places that are not an input to any transition."""
+        input_place_ids = {arc.place_id for arc in net.arcs_in}
+        return {
+            place_id: tuple(place.tokens) for place_id, place in net.places.items() if place_id not in input_place_ids
+        }
+
+    def with_marking(net: PetriNet, initial_marking: Marking) -> PetriNet:
+        """Refill the places in initial_marking, keeping their token containers, e.g. SpillingPlaceTokens."""
+        for place_id, tokens in initial_marking.items():
+            if place_id not in net.places:
+                raise ValueError(f"Place \"{place_id}\" not found in net.")
+            net.places[place_id].tokens.clear()
+            net.places[place_id].tokens.extend(tokens)
+        return net
+
+    def run_instance(
+        net_factory: Callable[[], PetriNet],
+        initial_marking: Marking,
+        transition_selection_function: Callable[[PetriNet], Optional[Transition]] = (
+            SelectTransition.using_priority_functions
+        ),
+        result_function: Optional[Callable[[PetriNet], Any]] = None,
+        run_checks=True,
+    ) -> Any:
+        net = BatchPetriNet.with_marking(net_factory(), initial_marking)
+        while SyncPetriNet.step(net, transition_selection_function, run_checks=run_checks, verbose=False):
+            pass
+        return (result_function or BatchPetriNet.marking)(net)
+
+    def run_chunk(
+        chunk: list[tuple[int, Marking]],
+        net_factory: Callable[[], PetriNet],
+        transition_selection_function: Callable[[PetriNet], Optional[Transition]],
+        result_function: Optional[Callable[[PetriNet], Any]],
+        run_checks: bool,
+    ) -> list[tuple[int, Any]]:
+        return [
+            (index, BatchPetriNet.run_instance(
+                net_factory, marking, transition_selection_function, result_function, run_checks
+            ))
+            for index, marking in chunk
+        ]
+
+    def run(
+        net_factory: Callable[[], PetriNet],
+        initial_markings: Iterable[Marking],
+        processes: Optional[int] = None,
+        chunk_size: int = 16,
+        transition_selection_function: Callable[[PetriNet], Optional[Transition]] = (
+            SelectTransition.using_priority_functions
+        ),
+        result_function: Optional[Callable[[PetriNet], Any]] = None,
+        run_checks=True,
+    ) -> Iterator[tuple[int, Any]]:
+        """Run sync net instances across a process pool, yielding (index, result) pairs as chunks finish.
+
+        The index is the position of the initial marking in initial_markings, results arrive in completion order.
+        By default the result is the final marking, pass BatchPetriNet.sink_marking to only return the sink places.
+        """
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size should be a positive int, got {chunk_size}.")
+        workers = processes if processes is not None else (os.cpu_count() or 1)
+        indexed_markings = enumerate(initial_markings)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+
+            def submit_next_chunk() -> bool:
+                chunk = list(islice(indexed_markings, chunk_size))
+                if len(chunk) == 0:
+                    return False
+                pending.add(executor.submit(
+                    BatchPetriNet.run_chunk,
+                    chunk, net_factory, transition_selection_function, result_function, run_checks,
+                ))
+                return True
+
+            # Keep a bounded number of chunks in flight so that the markings are consumed lazily.
+            pending: set = set()
+            while len(pending) < 2 * workers and submit_next_chunk():
+                pass
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+                    submit_next_chunk()
+
+    async def run_async(
+        net_factory: Callable[[], PetriNet],
+        initial_markings: Iterable[Marking],
+        maximum_concurrent_instances: Optional[int] = 100,
+        transition_selection_function: Callable[[PetriNet], Optional[Transition]] = (
+            SelectTransition.using_priority_functions
+        ),
+        result_function: Optional[Callable[[PetriNet], Any]] = None,
+        run_checks=True,
+    ) -> AsyncIterator[tuple[int, Any]]:
+        """Run async net instances concurrently on the current event loop, yielding (index, result) pairs."""
+
+        async def run_async_instance(index: int, initial_marking: Marking) -> tuple[int, Any]:
+            net = BatchPetriNet.with_marking(net_factory(), initial_marking)
+            while await AsyncPetriNet.step(net, transition_selection_function, run_checks=run_checks, verbose=False):
+                pass
+            return index, (result_function or BatchPetriNet.marking)(net)
+
+        indexed_markings = enumerate(initial_markings)
+        pending: set[asyncio.Task] = set()
+
+        def start_next_instance() -> bool:
+            for index, marking in islice(indexed_markings, 1):
+                pending.add(asyncio.ensure_future(run_async_instance(index, marking)))
+                return True
+            return False
+
+        try:
+            while (maximum_concurrent_instances is None or len(pending) < maximum_concurrent_instances) and (
+                start_next_instance()
+            ):
+                pass
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+                    start_next_instance()
+        finally:
+            for task in pending:
+                task.cancel()
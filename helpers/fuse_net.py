@@ -0,0 +1,200 @@
+from dataclasses import dataclass, replace
+from typing import Callable, Optional, cast
+
+from petri_net import ArcIn, ArcOut, CountPriorityFunction, PetriNet, SyncFiringFunctions, Token, Transition
+
+
+@dataclass
+class FusedNet:
+    net: PetriNet  # The net to run, with each chain replaced by one transition.
+    original: PetriNet  # The net that was fused, its places are shared with net.
+    chains: dict[str, tuple[str, ...]]  # The transition ids of each chain, by the id of the transition replacing it.
+
+
+class FusePetriNet:
+    """Fuse chains of SyncTransition.flip transitions joined by places that nothing else uses into one transition.
+
+    A link from one flip to the next is fused when the place between them is empty and untimed, has no capacity, shed
+    policy or dead letter place, is not the shed or dead letter place of another place and has no other producers or
+    consumers. The later flip must fire whenever it has a token, so its priority function must be a
+    CountPriorityFunction, and neither flip may use resource pools or a maximum_concurrency.
+    A fused firing applies every transform in turn, so one step moves a token along the whole chain, and
+    FusePetriNet.unfuse gives the original net back with the firings counted against each flip of the chain.
+    Only firings counts are attributed back to the original flips. The delta subscribers of the net see one delta per
+    fused firing, from the start to the end of the chain, with the id of the fused transition, so per-transition and
+    per-place monitors such as MemoryMonitor and LatencyTracker see neither the flips nor the places inside a chain.
+    Transitions that are not flips, e.g. a Transition with its own fire and priority functions, are never fused.
+    """
+
+    def is_flip(transition: Transition) -> bool:
+        return (
+            transition.transform_function is not None
+            and len(transition.resource_pool_ids) == 0
+            and transition.maximum_concurrency is None
+        )
+
+    def fires_on_any_token(transition: Transition) -> bool:
+        priority_function = transition.priority_function
+        return isinstance(priority_function, CountPriorityFunction) and (
+            priority_function.constant is None or priority_function.constant > 0
+        )
+
+    def chains(net: PetriNet) -> list[tuple[str, ...]]:
+        """The transition ids of each maximal chain of at least two fusable flips, in firing order."""
+        consumers: dict[str, list[str]] = {}
+        producers: dict[str, list[str]] = {}
+        inputs: dict[str, list[str]] = {}
+        outputs: dict[str, list[str]] = {}
+        for arc_in in net.arcs_in:
+            consumers.setdefault(arc_in.place_id, []).append(arc_in.transition_id)
+            inputs.setdefault(arc_in.transition_id, []).append(arc_in.place_id)
+        for arc_out in net.arcs_out:
+            producers.setdefault(arc_out.place_id, []).append(arc_out.transition_id)
+            outputs.setdefault(arc_out.transition_id, []).append(arc_out.place_id)
+        referenced_place_ids = {place.dead_letter_place for place in net.places.values()} | {
+            place.shed_policy.shed_place for place in net.places.values() if place.shed_policy is not None
+        }
+        flip_ids = {
+            transition_id for transition_id, transition in net.transitions.items()
+            if FusePetriNet.is_flip(transition)
+            and len(inputs.get(transition_id, [])) == 1
+            and len(outputs.get(transition_id, [])) == 1
+            and inputs[transition_id] != outputs[transition_id]
+        }
+
+        def is_private(place_id: str) -> bool:
+            place = net.places[place_id]
+            return (
+                len(place.tokens) == 0
+                and place.tokens.next_due() is None
+                and place.capacity is None
+                and place.shed_policy is None
+                and place.dead_letter_place is None
+                and place_id not in referenced_place_ids
+                and len(producers.get(place_id, [])) == 1
+                and len(consumers.get(place_id, [])) == 1
+            )
+
+        next_ids: dict[str, str] = {}
+        for transition_id in sorted(flip_ids):
+            place_id = outputs[transition_id][0]
+            if not is_private(place_id):
+                continue
+            next_id = consumers[place_id][0]
+            if next_id in flip_ids and FusePetriNet.fires_on_any_token(net.transitions[next_id]):
+                next_ids[transition_id] = next_id
+
+        chains = []
+        previous_ids = set(next_ids.values())
+        for transition_id in sorted(next_ids):
+            if transition_id in previous_ids:
+                continue
+            chain = [transition_id]
+            while chain[-1] in next_ids:
+                chain.append(next_ids[chain[-1]])
+            chains.append(tuple(chain))
+        # Links that form a ring have no start and are left unfused.
+        return chains
+
+    def composed(transforms: list[Callable[[Token], Token]]) -> Callable[[Token], Token]:
+        def transform(token: Token) -> Optional[Token]:
+            for transform_function in transforms:
+                transformed: Optional[Token] = transform_function(token)
+                if transformed is None:
+                    return None
+                token = transformed
+            return token
+
+        # Typed like the transform of a single flip, which may also return None to leave its token in place.
+        return cast(Callable[[Token], Token], transform)
+
+    def fused_transition(transitions: list[Transition]) -> Transition:
+        """One flip applying the transforms of transitions in order, with the priority function of the first.
+
+        The fused transition can fire as many times as the chain's transition with the fewest firings left.
+        A transform returning None leaves the token in the chain's input place, as it would for a single flip.
+        """
+        transform_function = FusePetriNet.composed([transition.transform_function for transition in transitions])
+        remaining = [
+            transition.maximum_firings - transition.firings_count
+            for transition in transitions if transition.maximum_firings is not None
+        ]
+        return Transition(
+            id="+".join(transition.id for transition in transitions),
+            name=" + ".join(transition.name or transition.id for transition in transitions),
+            fire=lambda input_places, output_places: SyncFiringFunctions.move_and_transform_highest_priority_token(
+                input_places, output_places, transform_function=transform_function,
+            ),
+            maximum_firings=max(0, min(remaining)) if remaining else None,
+            priority_function=transitions[0].priority_function,
+            transform_function=transform_function,
+        )
+
+    def fuse(net: PetriNet) -> FusedNet:
+        """Replace each chain of fusable flips in net with one transition.
+
+        The fused net shares the places of net, so net itself should not be stepped until FusePetriNet.unfuse.
+        """
+        chains = {}
+        transitions = dict(net.transitions)
+        places = dict(net.places)
+        arcs_in = set(net.arcs_in)
+        arcs_out = set(net.arcs_out)
+        for chain in FusePetriNet.chains(net):
+            fused = FusePetriNet.fused_transition([net.transitions[transition_id] for transition_id in chain])
+            if fused.id in transitions:
+                raise ValueError(f"Fused transition id \"{fused.id}\" is already used in the net.")
+            chain_ids = set(chain)
+            input_place_ids = [arc.place_id for arc in arcs_in if arc.transition_id == chain[0]]
+            output_place_ids = [arc.place_id for arc in arcs_out if arc.transition_id == chain[-1]]
+            for arc in [arc for arc in arcs_out if arc.transition_id in chain_ids and arc.transition_id != chain[-1]]:
+                del places[arc.place_id]
+            arcs_in = {arc for arc in arcs_in if arc.transition_id not in chain_ids}
+            arcs_out = {arc for arc in arcs_out if arc.transition_id not in chain_ids}
+            arcs_in.add(ArcIn(input_place_ids[0], fused.id))
+            arcs_out.add(ArcOut(fused.id, output_place_ids[0]))
+            for transition_id in chain:
+                del transitions[transition_id]
+            transitions[fused.id] = fused
+            chains[fused.id] = chain
+        fused_net = PetriNet(
+            places, transitions, arcs_in, arcs_out,
+            resource_pools=net.resource_pools,
+            delta_subscribers=net.delta_subscribers,
+            clock=net.clock,
+        )
+        return FusedNet(fused_net, net, chains)
+
+    def firings_counts(fused: FusedNet) -> dict[str, int]:
+        """The firings count of every transition of the original net, with fused firings counted for each flip."""
+        counts = {
+            transition_id: transition.firings_count
+            for transition_id, transition in fused.net.transitions.items() if transition_id not in fused.chains
+        }
+        for fused_id, chain in fused.chains.items():
+            fired = fused.net.transitions[fused_id].firings_count
+            for transition_id in chain:
+                counts[transition_id] = fused.original.transitions[transition_id].firings_count + fired
+        return counts
+
+    def unfuse(fused: FusedNet) -> PetriNet:
+        """The original net, with the places and firings counts reached by running the fused net."""
+        counts = FusePetriNet.firings_counts(fused)
+        transitions = {
+            transition_id: replace(transition, firings_count=counts[transition_id])
+            for transition_id, transition in fused.original.transitions.items()
+        }
+        transitions.update({
+            transition_id: transition
+            for transition_id, transition in fused.net.transitions.items()
+            if transition_id not in fused.chains and transition_id in transitions
+        })
+        return PetriNet(
+            {place_id: fused.net.places.get(place_id, place) for place_id, place in fused.original.places.items()},
+            transitions,
+            set(fused.original.arcs_in),
+            set(fused.original.arcs_out),
+            resource_pools=fused.net.resource_pools,
+            delta_subscribers=fused.net.delta_subscribers,
+            clock=fused.net.clock,
+        )
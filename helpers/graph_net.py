@@ -1,8 +1,15 @@
-from typing import Any, Optional
-from graphviz import Digraph
+import heapq
+import os
+import queue
+import shlex
+import subprocess
+import threading
+from pathlib import Path
+from typing import Any, Iterator, Optional, Union
+from graphviz import Digraph, Source
 from warnings import warn
 
-from petri_net import PetriNet, Token
+from petri_net import PetriNet, Place, Token
 
 
 class GraphNet:
@@ -49,16 +56,79 @@ class GraphNet:
             formatted_data = GraphNet.format_data(token.data, max_characters_per_field)
         return token.id + delim + formatted_data + "\n"
 
+    def place_label(
+        place: Place, max_characters_per_field: int, maximum_tokens_per_place: Optional[int] = None
+    ) -> str:
+        """The place name and its tokens, or for larger places the token count and the highest priority tokens."""
+        if maximum_tokens_per_place is None or len(place.tokens) <= maximum_tokens_per_place:
+            tokens_info = [GraphNet.format_token_data(t, max_characters_per_field) for t in place.tokens]
+            return f"{place.name}\n{''.join(tokens_info)}"
+        top_tokens = heapq.nlargest(maximum_tokens_per_place, place.tokens, key=lambda t: t.priority)
+        tokens_info = [GraphNet.format_token_data(t, max_characters_per_field) for t in top_tokens]
+        hidden_count = len(place.tokens) - len(top_tokens)
+        return f"{place.name} ({len(place.tokens)} tokens)\n{''.join(tokens_info)}... {hidden_count} more\n"
+
+    def quote(s: str) -> str:
+        return '"' + s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+    def dot_lines(
+        petri_net: PetriNet,
+        include_token_ids=True,
+        max_characters_per_field=100,
+        maximum_tokens_per_place: Optional[int] = None,
+        positions: Optional[dict[str, tuple[float, float]]] = None,
+    ) -> Iterator[str]:
+        """Yield the DOT source of the net line by line, pinning nodes to the given positions in points."""
+        quote = GraphNet.quote
+
+        def pinned(node_id: str) -> str:
+            if positions is None or node_id not in positions:
+                return ""
+            x, y = positions[node_id]
+            return f" pos={quote(f'{x:.2f},{y:.2f}!')}"
+
+        yield "digraph {\n"
+        for (place_id, place) in petri_net.places.items():
+            if include_token_ids:
+                label = GraphNet.place_label(place, max_characters_per_field, maximum_tokens_per_place)
+                yield f"\t{quote(place_id)} [label={quote(label)} shape=box style=rounded{pinned(place_id)}]\n"
+            else:
+                yield f"\t{quote(place_id)} [label={quote(place.name or place_id)}{pinned(place_id)}]\n"
+        for (transition_id, transition) in petri_net.transitions.items():
+            label = transition.name or transition_id
+            yield f"\t{quote(transition_id)} [label={quote(label)} shape=box{pinned(transition_id)}]\n"
+        for arc_in in petri_net.arcs_in:
+            yield f"\t{quote(arc_in.place_id)} -> {quote(arc_in.transition_id)}\n"
+        for arc_out in petri_net.arcs_out:
+            yield f"\t{quote(arc_out.transition_id)} -> {quote(arc_out.place_id)}\n"
+        yield "}\n"
+
+    def positions_from_plain(plain: str) -> dict[str, tuple[float, float]]:
+        """Node positions in points from the output of the graphviz plain format, which are given in inches."""
+        positions = {}
+        for line in plain.splitlines():
+            fields = shlex.split(line)
+            if len(fields) >= 4 and fields[0] == "node":
+                positions[fields[1]] = (float(fields[2]) * 72, float(fields[3]) * 72)
+        return positions
+
+    def layout(dot_source: str) -> dict[str, tuple[float, float]]:
+        """Run the dot layout once and return the node positions."""
+        return GraphNet.positions_from_plain(Source(dot_source).pipe(format="plain", encoding="utf-8"))
+
     def to_file(
-        petri_net: PetriNet, file_path: str, include_token_ids=True, format="png", max_characters_per_field=100
+        petri_net: PetriNet,
+        file_path: str,
+        include_token_ids=True,
+        format="png",
+        max_characters_per_field=100,
+        maximum_tokens_per_place: Optional[int] = None,
     ) -> None:
         dot = Digraph()
         for (place_id, place) in petri_net.places.items():
             if include_token_ids:
-                tokens_info = [GraphNet.format_token_data(t, max_characters_per_field) for t in place.tokens]
-                place_name_and_tokens = (
-                    f"{place.name}\n"
-                    f"{''.join(tokens_info)}"
+                place_name_and_tokens = GraphNet.place_label(
+                    place, max_characters_per_field, maximum_tokens_per_place
                 )
                 dot.node(place.id, place_name_and_tokens, shape="box", style="rounded")
             else:
@@ -70,3 +140,93 @@ class GraphNet:
         for arc in petri_net.arcs_out:
             dot.edge(arc.transition_id, arc.place_id)
         dot.render(file_path, format=format, cleanup=True)
+
+
+class GraphRenderer:
+    """Write a graph of the net for each submitted frame, laying out the net only once.
+
+    Each frame is taken as DOT text when submitted and written to directory by a background thread. With a format,
+    the nodes are pinned to the layout of the first frame and every batch of queued frames is rendered by a single
+    neato process, which needs the graphviz binaries. With format=None only the .gv files are written.
+    Places with more than maximum_tokens_per_place tokens are shown as a count and their highest priority tokens.
+    """
+
+    def __init__(
+        self,
+        petri_net: PetriNet,
+        directory: Union[str, Path],
+        format: Optional[str] = "svg",
+        include_token_ids=True,
+        max_characters_per_field=100,
+        maximum_tokens_per_place: Optional[int] = 10,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.format = format
+        self.include_token_ids = include_token_ids
+        self.max_characters_per_field = max_characters_per_field
+        self.maximum_tokens_per_place = maximum_tokens_per_place
+        self.positions = None
+        if format is not None:
+            self.positions = GraphNet.layout("".join(self.dot_lines(petri_net)))
+        self.frames: queue.Queue = queue.Queue()
+        self.errors: list[BaseException] = []
+        self.worker = threading.Thread(target=self.write_frames, daemon=True)
+        self.worker.start()
+
+    def dot_lines(self, petri_net: PetriNet) -> Iterator[str]:
+        return GraphNet.dot_lines(
+            petri_net,
+            self.include_token_ids,
+            self.max_characters_per_field,
+            self.maximum_tokens_per_place,
+            self.positions,
+        )
+
+    def submit(self, petri_net: PetriNet, name: str) -> None:
+        """Queue a frame of the current marking, to be written as name.gv (and rendered to name.<format>)."""
+        if len(self.errors) > 0:
+            raise self.errors[0]
+        self.frames.put((name, list(self.dot_lines(petri_net))))
+
+    def write_frames(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self.frames.get()]
+            while True:
+                try:
+                    batch.append(self.frames.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = None in batch
+            try:
+                self.write_batch([frame for frame in batch if frame is not None])
+            except Exception as e:
+                self.errors.append(e)
+
+    def write_batch(self, frames: list[tuple[str, list[str]]]) -> None:
+        paths = []
+        for name, lines in frames:
+            path = self.directory / f"{name}.gv"
+            with open(path, "w") as f:
+                f.writelines(lines)
+            paths.append(path)
+        if self.format is None or len(paths) == 0:
+            return
+        subprocess.run(["neato", "-n2", f"-T{self.format}", "-O", *map(str, paths)], check=True)
+        for path in paths:
+            os.replace(f"{path}.{self.format}", path.with_suffix(f".{self.format}"))
+
+    def close(self) -> None:
+        """Wait for the queued frames to be written."""
+        if self.worker.is_alive():
+            self.frames.put(None)
+            self.worker.join()
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+    def __enter__(self) -> "GraphRenderer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
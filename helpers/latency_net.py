@@ -0,0 +1,145 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from petri_net import PetriNet, PetriNetOperations, StepDelta, Token
+
+
+@dataclass
+class LatencySummary:
+    count: int
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+    maximum: float
+
+    def from_samples(samples: list[float]) -> Optional["LatencySummary"]:
+        if len(samples) == 0:
+            return None
+        ordered = sorted(samples)
+
+        def percentile(q: float) -> float:
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+        return LatencySummary(
+            len(ordered), sum(ordered) / len(ordered), percentile(0.5), percentile(0.95), percentile(0.99), ordered[-1]
+        )
+
+
+@dataclass
+class LatencyReport:
+    dwell: dict[str, LatencySummary]  # Time tokens spent in each place before a transition took them.
+    end_to_end: dict[str, LatencySummary]  # Time from a token's start until it reached each sink place.
+
+    def slowest_places(self, n: int = 5, key: str = "p95") -> list[tuple[str, LatencySummary]]:
+        return sorted(self.dwell.items(), key=lambda item: getattr(item[1], key), reverse=True)[:n]
+
+
+class LatencyTracker:
+    """Time when tokens enter and leave each place of a net, from its step deltas.
+
+    A token starts when it is first seen, either in the net when tracking begins or when added by a firing that took
+    no tokens. Tokens added by a firing inherit the earliest start of the tokens it took, so children of an expand
+    keep the start of their parent. Sink places, which are not an input to any transition, end a token's journey.
+    The most recent maximum_samples samples per place are kept for the report.
+    Tokens are told apart by identity, as deltas carry the token objects stored in the places, so tokens sharing an id
+    are timed separately. A token read back from a spilled place is a new object and is matched to the oldest tracked
+    token with its id and priority instead.
+    """
+
+    def __init__(
+        self, net: PetriNet, maximum_samples: Optional[int] = 100_000, clock: Callable[[], float] = time.monotonic
+    ):
+        self.net = net
+        self.clock = clock
+        self.maximum_samples = maximum_samples
+        input_place_ids = {arc.place_id for arc in net.arcs_in}
+        self.sink_place_ids = {place_id for place_id in net.places if place_id not in input_place_ids}
+        # The id, priority, entry and start times of the tokens in each place, by id(token) in the order they entered.
+        self.timestamps: dict[str, dict[int, tuple[str, int, float, float]]] = {}
+        # The id(token) keys of the tracked tokens of each place by token id and priority, oldest first.
+        self.keys_by_token: dict[str, dict[tuple[str, int], deque[int]]] = {}
+        self.dwell_samples: dict[str, deque[float]] = {}
+        self.end_to_end_samples: dict[str, deque[float]] = {}
+        now = clock()
+        for place_id, place in net.places.items():
+            for token in place.tokens:
+                self.entered(place_id, token, now, now)
+        PetriNetOperations.subscribe(net, self.on_delta)
+
+    def samples(self, samples_by_place: dict[str, deque[float]], place_id: str) -> deque[float]:
+        if place_id not in samples_by_place:
+            samples_by_place[place_id] = deque(maxlen=self.maximum_samples)
+        return samples_by_place[place_id]
+
+    def entered(self, place_id: str, token: Token, entered_at: float, started_at: float) -> None:
+        if place_id in self.sink_place_ids:
+            self.samples(self.end_to_end_samples, place_id).append(entered_at - started_at)
+            return
+        place_timestamps = self.timestamps.setdefault(place_id, {})
+        if id(token) in place_timestamps:  # The token left the place without a delta, e.g. taken directly.
+            self.forget(place_id, id(token))
+        place_timestamps[id(token)] = (token.id, token.priority, entered_at, started_at)
+        self.keys_by_token.setdefault(place_id, {}).setdefault((token.id, token.priority), deque()).append(id(token))
+
+    def forget(self, place_id: str, key: int) -> tuple[float, float]:
+        token_id, priority, entered_at, started_at = self.timestamps[place_id].pop(key)
+        keys = self.keys_by_token[place_id][(token_id, priority)]
+        if keys[0] == key:
+            keys.popleft()
+        else:
+            keys.remove(key)
+        if len(keys) == 0:
+            del self.keys_by_token[place_id][(token_id, priority)]
+        return entered_at, started_at
+
+    def left(self, place_id: str, token: Token) -> Optional[tuple[float, float]]:
+        """Stop tracking the token in the place, returning when it entered the place and when it started."""
+        tracked = self.timestamps.get(place_id, {}).get(id(token))
+        if tracked is not None and tracked[:2] == (token.id, token.priority):
+            return self.forget(place_id, id(token))
+        keys = self.keys_by_token.get(place_id, {}).get((token.id, token.priority))
+        if not keys:
+            return None
+        return self.forget(place_id, keys[0])  # A copy of the token, e.g. read back from a spilled place.
+
+    def times(self, place_id: str, token_id: str) -> Optional[tuple[float, float]]:
+        """When the oldest token with this id entered the place and when it started, if it is being tracked."""
+        for tracked_id, _, entered_at, started_at in self.timestamps.get(place_id, {}).values():
+            if tracked_id == token_id:
+                return entered_at, started_at
+        return None
+
+    def on_delta(self, delta: StepDelta) -> None:
+        now = self.clock()
+        removed_at = delta.started if delta.started is not None and self.clock is time.monotonic else now
+        added_at = delta.finished if delta.finished is not None and self.clock is time.monotonic else now
+        started_at: Optional[float] = None
+        for place_id, tokens in delta.removed.items():
+            for token in tokens:
+                times = self.left(place_id, token)
+                if times is None:
+                    continue
+                entered_at, token_started_at = times
+                self.samples(self.dwell_samples, place_id).append(removed_at - entered_at)
+                started_at = token_started_at if started_at is None else min(started_at, token_started_at)
+        for place_id, tokens in delta.added.items():
+            for token in tokens:
+                self.entered(place_id, token, added_at, added_at if started_at is None else started_at)
+
+    def report(self) -> LatencyReport:
+        return LatencyReport(
+            dwell={
+                place_id: LatencySummary.from_samples(list(samples))
+                for place_id, samples in self.dwell_samples.items() if len(samples) > 0
+            },
+            end_to_end={
+                place_id: LatencySummary.from_samples(list(samples))
+                for place_id, samples in self.end_to_end_samples.items() if len(samples) > 0
+            },
+        )
+
+    def close(self) -> None:
+        PetriNetOperations.unsubscribe(self.net, self.on_delta)
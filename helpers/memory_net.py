@@ -0,0 +1,161 @@
+import asyncio
+import sys
+import tracemalloc
+from dataclasses import dataclass, fields, is_dataclass
+from typing import Any, Callable, Optional
+
+from petri_net import PetriNet, PetriNetOperations, StepDelta, Token
+
+
+def estimate_size(obj: Any, seen: Optional[set[int]] = None) -> int:
+    """Estimate the bytes held by an object, following containers, dataclasses and object attributes."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        return size + sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(item, seen) for item in obj)
+    if is_dataclass(obj):
+        return size + sum(estimate_size(getattr(obj, f.name), seen) for f in fields(obj))
+    if hasattr(obj, "__dict__"):
+        return size + estimate_size(vars(obj), seen)
+    return size
+
+
+@dataclass
+class PlaceMemory:
+    count: int = 0
+    peak_count: int = 0
+    sampled_tokens: int = 0
+    mean_token_bytes: float = 0.0  # Mean of the sampled token sizes.
+    peak_estimated_bytes: float = 0.0
+
+    @property
+    def estimated_bytes(self) -> float:
+        return self.count * self.mean_token_bytes
+
+
+@dataclass
+class TransitionAllocations:
+    firings: int = 0
+    allocated_bytes: int = 0  # Sum over firings of the most memory in use during the firing, above the start.
+    retained_bytes: int = 0  # Sum over firings of the memory still in use when the firing finished.
+    peak_bytes: int = 0  # The most allocated by a single firing.
+
+
+@dataclass
+class MemoryReport:
+    places: dict[str, PlaceMemory]
+    transitions: dict[str, TransitionAllocations]
+
+    def top_places(self, n: int = 10, key: str = "estimated_bytes") -> list[tuple[str, PlaceMemory]]:
+        return sorted(self.places.items(), key=lambda item: getattr(item[1], key), reverse=True)[:n]
+
+    def top_transitions(self, n: int = 10, key: str = "retained_bytes") -> list[tuple[str, TransitionAllocations]]:
+        return sorted(self.transitions.items(), key=lambda item: getattr(item[1], key), reverse=True)[:n]
+
+
+class MemoryMonitor:
+    """Track the current and peak token count and estimated payload size of each place of a net.
+
+    Counts are kept up to date from the step deltas of the net. The size of one in sample_every tokens added to a
+    place is estimated, and the mean sampled size times the count gives the estimated bytes of the place.
+    With trace_allocations, each transition's fire is measured with tracemalloc, which slows firing down noticeably.
+    Measurements of async firings that overlap include the allocations of each other.
+    Tokens added to a place directly, rather than by a firing, are not in any delta and so are not counted.
+    """
+
+    def __init__(self, net: PetriNet, sample_every: int = 100, trace_allocations=False):
+        if sample_every < 1:
+            raise ValueError(f"sample_every should be a positive int, got {sample_every}.")
+        self.net = net
+        self.sample_every = sample_every
+        self.added_counts: dict[str, int] = {}
+        self.places: dict[str, PlaceMemory] = {place_id: PlaceMemory() for place_id in net.places}
+        for place_id, place in net.places.items():
+            for token in place.tokens:
+                self.record_added(place_id, token)
+        self.transitions: dict[str, TransitionAllocations] = {}
+        self.original_fire_functions: dict[str, Callable] = {}
+        self.started_tracemalloc = False
+        if trace_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracemalloc = True
+            for transition_id, transition in net.transitions.items():
+                self.original_fire_functions[transition_id] = transition.fire
+                transition.fire = self.traced(transition_id, transition.fire)
+        PetriNetOperations.subscribe(net, self.on_delta)
+
+    def record_added(self, place_id: str, token: Token) -> None:
+        place = self.places.setdefault(place_id, PlaceMemory())
+        place.count += 1
+        added_count = self.added_counts.get(place_id, 0)
+        self.added_counts[place_id] = added_count + 1
+        if added_count % self.sample_every == 0:
+            place.sampled_tokens += 1
+            token_bytes = estimate_size(token.data) + sys.getsizeof(token) + sys.getsizeof(token.id)
+            place.mean_token_bytes += (token_bytes - place.mean_token_bytes) / place.sampled_tokens
+        place.peak_count = max(place.peak_count, place.count)
+        place.peak_estimated_bytes = max(place.peak_estimated_bytes, place.estimated_bytes)
+
+    def on_delta(self, delta: StepDelta) -> None:
+        for place_id, tokens in delta.removed.items():
+            place = self.places.setdefault(place_id, PlaceMemory())
+            place.count = max(0, place.count - len(tokens))  # Tokens added directly were never counted.
+        for place_id, tokens in delta.added.items():
+            for token in tokens:
+                self.record_added(place_id, token)
+
+    def record_allocations(self, transition_id: str, start: int) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        allocations = self.transitions.setdefault(transition_id, TransitionAllocations())
+        allocations.firings += 1
+        allocations.allocated_bytes += max(0, peak - start)
+        allocations.retained_bytes += current - start
+        allocations.peak_bytes = max(allocations.peak_bytes, peak - start)
+
+    def traced(self, transition_id: str, fire: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(fire):
+            async def traced_async_fire(input_places, output_places):
+                tracemalloc.reset_peak()
+                start = tracemalloc.get_traced_memory()[0]
+                try:
+                    return await fire(input_places, output_places)
+                finally:
+                    self.record_allocations(transition_id, start)
+            return traced_async_fire
+
+        def traced_fire(input_places, output_places):
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            try:
+                return fire(input_places, output_places)
+            finally:
+                self.record_allocations(transition_id, start)
+        return traced_fire
+
+    def report(self) -> MemoryReport:
+        return MemoryReport(
+            places={place_id: PlaceMemory(**vars(place)) for place_id, place in self.places.items()},
+            transitions={
+                transition_id: TransitionAllocations(**vars(allocations))
+                for transition_id, allocations in self.transitions.items()
+            },
+        )
+
+    def close(self) -> None:
+        """Stop monitoring and restore the fire functions of the transitions."""
+        PetriNetOperations.unsubscribe(self.net, self.on_delta)
+        for transition_id, fire in self.original_fire_functions.items():
+            if transition_id in self.net.transitions:
+                self.net.transitions[transition_id].fire = fire
+        self.original_fire_functions = {}
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
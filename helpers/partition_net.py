@@ -0,0 +1,381 @@
+import math
+import multiprocessing
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Optional
+
+from petri_net import PetriNet, SelectTransition, SyncPetriNet, Transition
+
+
+@dataclass(frozen=True)
+class NetPartitioning:
+    """Which partition owns each place and transition.
+
+    A place is always owned by the same partition as the transitions that take tokens from it,
+    so only tokens added through an ArcOut can cross a partition boundary.
+    """
+    partitions: int
+    place_partitions: dict[str, int]
+    transition_partitions: dict[str, int]
+
+
+class QueueTransport:
+    """Send messages between partition workers on one machine through multiprocessing queues."""
+
+    def __init__(self, endpoints: int):
+        self.queues: list[multiprocessing.Queue] = [multiprocessing.Queue() for _ in range(endpoints)]
+        self.endpoint: Optional[int] = None
+
+    def open(self, endpoint: int) -> None:
+        self.endpoint = endpoint
+
+    def send(self, endpoint: int, message: Any) -> None:
+        self.queues[endpoint].put(message)
+
+    def receive(self, timeout: Optional[float] = None) -> Optional[Any]:
+        if self.endpoint is None:
+            raise ValueError("Call open before receiving messages.")
+        try:
+            if timeout == 0:
+                return self.queues[self.endpoint].get_nowait()
+            return self.queues[self.endpoint].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self) -> None:
+        pass
+
+
+class SocketTransport:
+    """Send messages between partition workers over sockets, one (host, port) address per endpoint.
+
+    The workers may run on different nodes, as long as every address is reachable from every endpoint.
+    """
+
+    def __init__(self, addresses: list[tuple[str, int]], authkey: bytes = b"petristep", connect_timeout: float = 10.0):
+        self.addresses = addresses
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self.endpoint: Optional[int] = None
+
+    def open(self, endpoint: int) -> None:
+        self.endpoint = endpoint
+        self.inbox: queue.Queue = queue.Queue()
+        self.connections: dict[int, Any] = {}
+        self.listener = Listener(self.addresses[endpoint], authkey=self.authkey)
+        threading.Thread(target=self._accept_connections, daemon=True).start()
+
+    def _accept_connections(self) -> None:
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:  # The listener was closed.
+                return
+            threading.Thread(target=self._read_messages, args=(connection,), daemon=True).start()
+
+    def _read_messages(self, connection) -> None:
+        while True:
+            try:
+                self.inbox.put(connection.recv())
+            except (EOFError, OSError):
+                return
+
+    def _connect(self, endpoint: int):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return Client(self.addresses[endpoint], authkey=self.authkey)
+            except ConnectionRefusedError:  # The other endpoint may not be listening yet.
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def send(self, endpoint: int, message: Any) -> None:
+        if endpoint not in self.connections:
+            self.connections[endpoint] = self._connect(endpoint)
+        self.connections[endpoint].send(message)
+
+    def receive(self, timeout: Optional[float] = None) -> Optional[Any]:
+        try:
+            if timeout == 0:
+                return self.inbox.get_nowait()
+            return self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self) -> None:
+        for connection in self.connections.values():
+            connection.close()
+        self.listener.close()
+
+
+class PartitionPetriNet:
+    """Run a single net split across several worker processes.
+
+    Every worker builds the whole net with net_factory but only fires the transitions of its own partition.
+    Tokens added to a place owned by another partition are shipped to it in batches through the transport.
+    Capacities and custom priority functions only see the places of the partition evaluating them.
+    """
+
+    def partition(net: PetriNet, partitions: int) -> NetPartitioning:
+        """Assign places and transitions to partitions, greedily keeping ArcOut connected parts together."""
+        if partitions < 1:
+            raise ValueError(f"partitions should be a positive int, got {partitions}.")
+        # Union each transition with its input places, these have to be owned by the same partition.
+        parent: dict[tuple[str, str], tuple[str, str]] = {}
+
+        def find(node: tuple[str, str]) -> tuple[str, str]:
+            parent.setdefault(node, node)
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for transition_id in net.transitions:
+            find(("transition", transition_id))
+        for arc in net.arcs_in:
+            parent[find(("place", arc.place_id))] = find(("transition", arc.transition_id))
+        components: dict[tuple[str, str], list[tuple[str, str]]] = {}
+        for node in tuple(parent):
+            components.setdefault(find(node), []).append(node)
+        weights = {
+            root: max(1, sum(1 for kind, _ in nodes if kind == "transition")) for root, nodes in components.items()
+        }
+        # Count the ArcOut arcs between components.
+        links: dict[tuple[str, str], dict[tuple[str, str], int]] = {root: {} for root in components}
+        for arc_out in net.arcs_out:
+            source, target = find(("transition", arc_out.transition_id)), ("place", arc_out.place_id)
+            if target not in parent:
+                continue  # A place without consumers, placed with its producers below.
+            target = find(target)
+            if source != target:
+                links[source][target] = links[source].get(target, 0) + 1
+                links[target][source] = links[target].get(source, 0) + 1
+
+        # Grow partitions by repeatedly placing the component most connected to those already placed.
+        limit = max(math.ceil(1.1 * sum(weights.values()) / partitions), max(weights.values(), default=1))
+        loads = [0] * partitions
+        assigned: dict[tuple[str, str], int] = {}
+        unassigned = set(components)
+        while unassigned:
+            root = max(
+                unassigned,
+                key=lambda r: (sum(w for other, w in links[r].items() if other in assigned), weights[r], r),
+            )
+            unassigned.remove(root)
+            connection = [0] * partitions
+            for other, weight in links[root].items():
+                if other in assigned:
+                    connection[assigned[other]] += weight
+            candidates = [p for p in range(partitions) if loads[p] + weights[root] <= limit] or list(range(partitions))
+            chosen = max(candidates, key=lambda p: (connection[p], -loads[p], -p))
+            assigned[root] = chosen
+            loads[chosen] += weights[root]
+
+        transition_partitions = {transition_id: assigned[find(("transition", transition_id))]
+                                 for transition_id in net.transitions}
+        place_partitions = {}
+        for place_id in net.places:
+            if ("place", place_id) in parent:
+                place_partitions[place_id] = assigned[find(("place", place_id))]
+            else:  # Own places without consumers in the partition of their most frequent producer.
+                producers = [
+                    transition_partitions[arc.transition_id] for arc in net.arcs_out if arc.place_id == place_id
+                ]
+                place_partitions[place_id] = max(set(producers), key=producers.count) if producers else 0
+        return NetPartitioning(partitions, place_partitions, transition_partitions)
+
+    def cross_partition_arcs(net: PetriNet, partitioning: NetPartitioning) -> set:
+        return {
+            arc for arc in net.arcs_out
+            if partitioning.transition_partitions[arc.transition_id] != partitioning.place_partitions[arc.place_id]
+        }
+
+    def run_worker(
+        net_factory: Callable[[], PetriNet],
+        partitioning: NetPartitioning,
+        partition: int,
+        transport: Any,
+        batch_size: int = 64,
+        transition_selection_function: Callable[[PetriNet], Optional[Transition]] = (
+            SelectTransition.using_priority_functions
+        ),
+        run_checks=True,
+    ) -> None:
+        """Fire the transitions of one partition until the coordinator (endpoint `partitions`) stops it."""
+        transport.open(partition)
+        coordinator = partitioning.partitions
+        try:
+            net = net_factory()
+            owned_place_ids = {
+                place_id for place_id, owner in partitioning.place_partitions.items() if owner == partition
+            }
+            net.transitions = {
+                transition_id: transition for transition_id, transition in net.transitions.items()
+                if partitioning.transition_partitions[transition_id] == partition
+            }
+            for place_id, place in net.places.items():
+                if place_id not in owned_place_ids:
+                    place.tokens.clear()
+            remote_place_ids = {
+                arc.place_id for arc in net.arcs_out
+                if arc.transition_id in net.transitions and arc.place_id not in owned_place_ids
+            }
+            outbox: dict[int, list[tuple[str, tuple]]] = {}
+            outbox_sizes: dict[int, int] = {}
+            sent, received = 0, 0
+            last_status = None
+
+            def flush(owner: int) -> None:
+                nonlocal sent
+                if outbox.get(owner):
+                    transport.send(owner, ("tokens", outbox.pop(owner)))
+                    outbox_sizes[owner] = 0
+                    sent += 1
+
+            def handle(message: tuple) -> bool:  # Returns False once the worker is asked to stop.
+                nonlocal received
+                kind = message[0]
+                if kind == "tokens":
+                    received += 1
+                    for place_id, tokens in message[1]:
+                        net.places[place_id].tokens.extend(tokens)
+                elif kind == "probe":
+                    transport.send(coordinator, ("probe_reply", message[1], partition, sent, received))
+                elif kind == "stop":
+                    transport.send(coordinator, (
+                        "marking",
+                        partition,
+                        {place_id: tuple(net.places[place_id].tokens) for place_id in owned_place_ids},
+                        {transition_id: t.firings_count for transition_id, t in net.transitions.items()},
+                    ))
+                    return False
+                return True
+
+            while True:
+                message = transport.receive(0)
+                while message is not None:
+                    if not handle(message):
+                        return
+                    message = transport.receive(0)
+                if SyncPetriNet.step(net, transition_selection_function, run_checks=run_checks, verbose=False):
+                    for place_id in remote_place_ids:
+                        place = net.places[place_id]
+                        if len(place.tokens) > 0:
+                            owner = partitioning.place_partitions[place_id]
+                            outbox.setdefault(owner, []).append((place_id, tuple(place.tokens)))
+                            outbox_sizes[owner] = outbox_sizes.get(owner, 0) + len(place.tokens)
+                            place.tokens.clear()
+                            if outbox_sizes[owner] >= batch_size:
+                                flush(owner)
+                    continue
+                # Nothing left to fire locally, ship any remaining tokens and wait for more.
+                for owner in tuple(outbox):
+                    flush(owner)
+                if last_status != (sent, received):
+                    last_status = (sent, received)
+                    transport.send(coordinator, ("status", partition, sent, received))
+                if not handle(transport.receive(None)):
+                    return
+        except Exception as e:
+            transport.send(coordinator, ("error", partition, repr(e)))
+            raise
+        finally:
+            transport.close()
+
+    def coordinate(
+        net_factory: Callable[[], PetriNet],
+        partitioning: NetPartitioning,
+        transport: Any,
+        timeout: Optional[float] = None,
+    ) -> PetriNet:
+        """Detect when all workers are idle with no tokens in transit, stop them and combine their markings."""
+        transport.open(partitioning.partitions)
+        workers = range(partitioning.partitions)
+        statuses: dict[int, tuple[int, int]] = {}
+        probe, probed_statuses, replies = 0, None, {}
+        try:
+            # Two consecutive matching waves of counts, with as many token batches received as sent, mean that no
+            # worker has been given new tokens since it last became idle.
+            while True:
+                message = transport.receive(timeout)
+                if message is None:
+                    raise TimeoutError("Timed out waiting for partition workers.")
+                kind = message[0]
+                if kind == "error":
+                    raise RuntimeError(f"Partition {message[1]} failed: {message[2]}")
+                if kind == "status":
+                    statuses[message[1]] = (message[2], message[3])
+                elif kind == "probe_reply" and message[1] == probe:
+                    replies[message[2]] = (message[3], message[4])
+                if probed_statuses is not None and len(replies) == len(workers):
+                    if replies == probed_statuses:
+                        break
+                    probed_statuses = None
+                if (
+                    probed_statuses is None
+                    and len(statuses) == len(workers)
+                    and sum(s for s, _ in statuses.values()) == sum(r for _, r in statuses.values())
+                ):
+                    probe, probed_statuses, replies = probe + 1, dict(statuses), {}
+                    for worker in workers:
+                        transport.send(worker, ("probe", probe))
+            for worker in workers:
+                transport.send(worker, ("stop",))
+            net = net_factory()
+            for _ in workers:
+                message = transport.receive(timeout)
+                while message is not None and message[0] != "marking":
+                    if message[0] == "error":
+                        raise RuntimeError(f"Partition {message[1]} failed: {message[2]}")
+                    message = transport.receive(timeout)
+                if message is None:
+                    raise TimeoutError("Timed out waiting for partition markings.")
+                _, _, marking, firings_counts = message
+                for place_id, tokens in marking.items():
+                    net.places[place_id].tokens.clear()  # Keeps the container, e.g. SpillingPlaceTokens.
+                    net.places[place_id].tokens.extend(tokens)
+                for transition_id, firings_count in firings_counts.items():
+                    net.transitions[transition_id].firings_count = firings_count
+            return net
+        finally:
+            transport.close()
+
+    def run(
+        net_factory: Callable[[], PetriNet],
+        partitions: int = 2,
+        transport: Optional[Any] = None,
+        batch_size: int = 64,
+        transition_selection_function: Callable[[PetriNet], Optional[Transition]] = (
+            SelectTransition.using_priority_functions
+        ),
+        run_checks=True,
+        timeout: Optional[float] = None,
+    ) -> PetriNet:
+        """Run the net across local worker processes and return it with the combined final marking.
+
+        The transport needs partitions + 1 endpoints, the last one is used by the coordinator.
+        """
+        partitioning = PartitionPetriNet.partition(net_factory(), partitions)
+        transport = transport if transport is not None else QueueTransport(partitions + 1)
+        processes = [
+            multiprocessing.Process(
+                target=PartitionPetriNet.run_worker,
+                args=(net_factory, partitioning, partition, transport, batch_size, transition_selection_function,
+                      run_checks),
+                daemon=True,
+            )
+            for partition in range(partitions)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            return PartitionPetriNet.coordinate(net_factory, partitioning, transport, timeout=timeout)
+        finally:
+            for process in processes:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
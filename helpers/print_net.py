@@ -1,4 +1,4 @@
-from petri_net import PetriNet
+from petri_net import PetriNet, StepDelta
 
 
 class PrintPetriNet:
@@ -14,3 +14,13 @@ class PrintPetriNet:
             print(f"  {place.id}: {place.name}")
             for t in place.tokens:
                 print(f"    {t.id}: {t.data}")
+
+    def delta(delta: StepDelta) -> None:
+        """Print only the tokens a firing moved, e.g. as a subscriber with PetriNetOperations.subscribe."""
+        print(f"Fired {delta.transition_id}:")
+        for place_id, tokens in delta.removed.items():
+            for t in tokens:
+                print(f"  - {place_id} {t.id}: {t.data}")
+        for place_id, tokens in delta.added.items():
+            for t in tokens:
+                print(f"  + {place_id} {t.id}: {t.data}")
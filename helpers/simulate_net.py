@@ -0,0 +1,257 @@
+import heapq
+import math
+import random
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from petri_net import PetriNet, PetriNetOperations
+
+
+class ServiceTime:
+    """Service time distributions, each a function of a random.Random returning seconds."""
+
+    def constant(seconds: float) -> Callable[[random.Random], float]:
+        return lambda rng: seconds
+
+    def exponential(mean: float) -> Callable[[random.Random], float]:
+        return lambda rng: rng.expovariate(1 / mean)
+
+    def uniform(low: float, high: float) -> Callable[[random.Random], float]:
+        return lambda rng: rng.uniform(low, high)
+
+    def lognormal(mean: float, sigma: float) -> Callable[[random.Random], float]:
+        """Log-normal with the given mean, sigma is the standard deviation of the underlying normal."""
+        mu = math.log(mean) - sigma ** 2 / 2
+        return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+@dataclass
+class TransitionModel:
+    """How a transition behaves in a simulation instead of calling its transform.
+
+    A fork is modelled with routing, the probability of sending the token to each output place, otherwise every
+    output place gets the token. An expand is modelled with children, the number of tokens it outputs.
+    Without servers, the transition's maximum_concurrency (or 1 if it has none) firings can be in service at once.
+    """
+    service_time: Callable[[random.Random], float]
+    routing: Optional[dict[str, float]] = None
+    children: Optional[Callable[[random.Random], int]] = None
+    servers: Optional[int] = None
+
+
+@dataclass
+class PlaceStatistics:
+    mean_queue_length: float
+    maximum_queue_length: int
+    final_queue_length: int
+
+
+@dataclass
+class TransitionStatistics:
+    firings: int
+    utilization: float  # The fraction of the time its servers were busy.
+
+
+@dataclass
+class SimulationReport:
+    duration: float
+    arrivals: int
+    rejected: int  # Arrivals to a full place.
+    completed: int  # Tokens that reached a place which is not an input to any transition.
+    throughput: float
+    latency_mean: Optional[float]
+    latency_percentiles: dict[float, float]
+    places: dict[str, PlaceStatistics]
+    transitions: dict[str, TransitionStatistics]
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Simulation:
+    """Discrete-event simulation of the flow of tokens through a net, for capacity planning.
+
+    Tokens arrive at the arrival place as a Poisson process and are served by each transition in turn, taking a time
+    drawn from its TransitionModel while the virtual clock advances through an event queue. No fire functions are
+    called. Tokens are served in arrival order, from whichever input place has waited longest, and a transition only
+    starts serving while none of its output places is full. Latency is measured from arrival until a token (or a
+    child of an expanded token) reaches a sink place.
+    """
+
+    def __init__(
+        self,
+        net: PetriNet,
+        models: dict[str, TransitionModel],
+        arrival_place: str,
+        arrival_rate: float,
+        seed: Optional[int] = None,
+        latency_percentiles: tuple[float, ...] = (0.5, 0.95, 0.99),
+    ):
+        missing = [transition_id for transition_id in net.transitions if transition_id not in models]
+        if len(missing) > 0:
+            raise ValueError(f"No TransitionModel for transitions {missing}.")
+        if arrival_place not in net.places:
+            raise ValueError(f"Place \"{arrival_place}\" not found in net.")
+        for transition_id, model in models.items():
+            for place_id in (model.routing or {}):
+                if place_id not in PetriNetOperations.arc_index(net).outgoing_place_ids.get(transition_id, ()):
+                    raise ValueError(f"Routing of \"{transition_id}\" to \"{place_id}\" which is not an output.")
+        self.net = net
+        self.models = models
+        self.arrival_place = arrival_place
+        self.arrival_rate = arrival_rate
+        self.rng = random.Random(seed)
+        self.latency_percentiles = latency_percentiles
+        index = PetriNetOperations.arc_index(net)
+        self.inputs = {t: index.incoming_place_ids.get(t, ()) for t in net.transitions}
+        self.outputs = {t: index.outgoing_place_ids.get(t, ()) for t in net.transitions}
+        self.consumers: dict[str, list[str]] = {place_id: [] for place_id in net.places}
+        self.producers: dict[str, list[str]] = {place_id: [] for place_id in net.places}
+        for transition_id in net.transitions:
+            for place_id in self.inputs[transition_id]:
+                self.consumers[place_id].append(transition_id)
+            for place_id in self.outputs[transition_id]:
+                self.producers[place_id].append(transition_id)
+        self.servers = {
+            transition_id: model.servers or net.transitions[transition_id].maximum_concurrency or 1
+            for transition_id, model in models.items()
+        }
+
+    def run(self, duration: float) -> SimulationReport:
+        """Simulate duration seconds of virtual time."""
+        now = 0.0
+        events: list = []  # (time, sequence, transition id or None for an arrival, token arrival time)
+        sequence = 0
+        queues: dict[str, deque[tuple[float, float]]] = {
+            place_id: deque() for place_id, consumers in self.consumers.items() if len(consumers) > 0
+        }
+        capacities = {place_id: place.capacity for place_id, place in self.net.places.items()}
+        limited_outputs = {  # Only outputs with a capacity can stop a transition from starting.
+            transition_id: tuple(place_id for place_id in outputs if capacities[place_id] is not None)
+            for transition_id, outputs in self.outputs.items()
+        }
+        sink_counts = {place_id: 0 for place_id in self.net.places if place_id not in queues}
+        busy = {transition_id: 0 for transition_id in self.net.transitions}
+        firings = {transition_id: 0 for transition_id in self.net.transitions}
+        busy_area = {transition_id: 0.0 for transition_id in self.net.transitions}
+        busy_since = {transition_id: 0.0 for transition_id in self.net.transitions}
+        queue_area = {place_id: 0.0 for place_id in queues}
+        queue_since = {place_id: 0.0 for place_id in queues}
+        maximum_lengths = {place_id: 0 for place_id in queues}
+        latencies: list[float] = []
+        arrivals = rejected = 0
+
+        def count(place_id: str) -> int:
+            return len(queues[place_id]) if place_id in queues else sink_counts[place_id]
+
+        def is_full(place_id: str) -> bool:
+            capacity = capacities[place_id]
+            return capacity is not None and count(place_id) >= capacity
+
+        def queue_changed(place_id: str) -> None:
+            queue_area[place_id] += len(queues[place_id]) * (now - queue_since[place_id])
+            queue_since[place_id] = now
+
+        def busy_changed(transition_id: str) -> None:
+            busy_area[transition_id] += busy[transition_id] * (now - busy_since[transition_id])
+            busy_since[transition_id] = now
+
+        def add(place_id: str, arrived_at: float) -> None:
+            if place_id not in queues:
+                sink_counts[place_id] += 1
+                latencies.append(now - arrived_at)
+                return
+            queue_changed(place_id)
+            queues[place_id].append((now, arrived_at))
+            maximum_lengths[place_id] = max(maximum_lengths[place_id], len(queues[place_id]))
+            for transition_id in self.consumers[place_id]:
+                try_start(transition_id)
+
+        def try_start(transition_id: str) -> None:
+            nonlocal sequence
+            inputs = self.inputs[transition_id]
+            while busy[transition_id] < self.servers[transition_id]:
+                for place_id in limited_outputs[transition_id]:
+                    if is_full(place_id):
+                        return
+                if len(inputs) == 1:
+                    place_id = inputs[0]
+                    if len(queues[place_id]) == 0:
+                        return
+                else:
+                    waiting = [place_id for place_id in inputs if len(queues[place_id]) > 0]
+                    if len(waiting) == 0:
+                        return
+                    place_id = min(waiting, key=lambda p: queues[p][0][0])
+                queue_changed(place_id)
+                _, arrived_at = queues[place_id].popleft()
+                busy_changed(transition_id)
+                busy[transition_id] += 1
+                sequence += 1
+                service_time = self.models[transition_id].service_time(self.rng)
+                heapq.heappush(events, (now + service_time, sequence, transition_id, arrived_at))
+                if capacities[place_id] is not None:  # The place may have been full, and now has room.
+                    for producer_id in self.producers[place_id]:
+                        if producer_id != transition_id:
+                            try_start(producer_id)
+
+        def complete(transition_id: str, arrived_at: float) -> None:
+            busy_changed(transition_id)
+            busy[transition_id] -= 1
+            firings[transition_id] += 1
+            model = self.models[transition_id]
+            if model.routing is not None:
+                place_ids, weights = zip(*model.routing.items())
+                destinations = tuple(self.rng.choices(place_ids, weights))
+            else:
+                destinations = self.outputs[transition_id]
+            children = 1 if model.children is None else model.children(self.rng)
+            for place_id in destinations:
+                for _ in range(children):
+                    add(place_id, arrived_at)
+            try_start(transition_id)
+
+        sequence += 1
+        heapq.heappush(events, (self.rng.expovariate(self.arrival_rate), sequence, None, 0.0))
+        while len(events) > 0 and events[0][0] <= duration:
+            now, _, transition_id, arrived_at = heapq.heappop(events)
+            if transition_id is not None:
+                complete(transition_id, arrived_at)
+                continue
+            arrivals += 1
+            if is_full(self.arrival_place):
+                rejected += 1
+            else:
+                add(self.arrival_place, now)
+            sequence += 1
+            heapq.heappush(events, (now + self.rng.expovariate(self.arrival_rate), sequence, None, 0.0))
+
+        now = duration
+        for place_id in queues:
+            queue_changed(place_id)
+        for transition_id in busy:
+            busy_changed(transition_id)
+        latencies.sort()
+        return SimulationReport(
+            duration=duration,
+            arrivals=arrivals,
+            rejected=rejected,
+            completed=len(latencies),
+            throughput=len(latencies) / duration,
+            latency_mean=sum(latencies) / len(latencies) if len(latencies) > 0 else None,
+            latency_percentiles={
+                q: percentile(latencies, q) for q in self.latency_percentiles if len(latencies) > 0
+            },
+            places={
+                place_id: PlaceStatistics(queue_area[place_id] / duration, maximum_lengths[place_id], len(queue))
+                for place_id, queue in queues.items()
+            },
+            transitions={
+                transition_id: TransitionStatistics(
+                    firings[transition_id], busy_area[transition_id] / (self.servers[transition_id] * duration)
+                )
+                for transition_id in self.net.transitions
+            },
+        )
@@ -1,22 +1,558 @@
+import asyncio
+import heapq
+import inspect
+import math
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextvars import ContextVar
 from copy import deepcopy
-from dataclasses import dataclass
-from typing import Any, Coroutine, Iterable, Optional, Callable, Union
+from dataclasses import dataclass, field, replace
+from typing import Any, AsyncGenerator, Coroutine, Iterable, Optional, Callable, Union, cast
 
 
-@dataclass(frozen=True)
+def _data_as_summary(data: Any) -> Any:
+    return data  # A module level function rather than a lambda so that tokens can be pickled.
+
+
+@dataclass(frozen=True, slots=True)
 class Token:
     id: str
     data: Optional[Any]
     priority: int = 1
-    summary_function: Optional[Callable[[Any], str]] = lambda data: data
+    summary_function: Optional[Callable[[Any], str]] = field(default=_data_as_summary, compare=False, repr=False)
     # The summary_function can be used for data-specific formatting.
+    not_before: Optional[float] = field(default=None, compare=False, repr=False)
+    expires_at: Optional[float] = field(default=None, compare=False, repr=False)
+    # Times on the clock of the net, see PlaceTokens for how timed tokens are held back and expired.
+
+    def __hash__(self) -> int:
+        # Hash on the cheap fields only; data may be large or unhashable (e.g. a dict).
+        return hash((self.id, self.priority))
+
+
+class TokenChanges:
+    """The tokens added to and removed from each PlaceTokens while a transition fires, keyed by id(PlaceTokens)."""
+
+    __slots__ = ("removed", "added")
+
+    def __init__(self):
+        self.removed: dict[int, list[Token]] = {}
+        self.added: dict[int, list[Token]] = {}
+
+    def record_removed(self, tokens: "PlaceTokens", token: Token) -> None:
+        self.removed.setdefault(id(tokens), []).append(token)
+
+    def record_added(self, tokens: "PlaceTokens", token: Token) -> None:
+        removed = self.removed.get(id(tokens), [])
+        for i, removed_token in enumerate(removed):
+            if removed_token is token:  # A token put back, e.g. by an async firing that failed.
+                del removed[i]
+                return
+        self.added.setdefault(id(tokens), []).append(token)
+
+
+_token_changes: ContextVar[Optional[TokenChanges]] = ContextVar("token_changes", default=None)
+
+
+class PlaceTokens:
+    """Ordered collection of the tokens held by a place.
+
+    Each token added to a place is given a unique handle so that a specific token can be removed in O(1), even when
+    other tokens in the place compare equal to it. Tokens are also indexed by Token.id for O(1) lookup, and by
+    Token.priority so that the first token with the highest priority is found without scanning the place.
+    Iterating, len() and comparison with a tuple behave as for the tuple of tokens in insertion order.
+
+    A token with a not_before time is held back in a heap, without a handle, until release_due is called once it is
+    due, and is then added without its not_before time. Tokens still in the place at their expires_at time are removed
+    by release_due. The engines call release_due through PetriNetOperations.release_timed_tokens.
+    """
+
+    __slots__ = (
+        "_tokens", "_handles_by_id", "_handles_by_priority", "_next_handle", "_pending", "_expiries", "version"
+    )
+
+    def __init__(self, tokens: Iterable[Token] = ()):
+        self._tokens: dict[int, Token] = {}
+        self._handles_by_id: dict[str, dict[int, None]] = {}
+        # OrderedDict finds its first key in O(1), a dict has to skip the slots of the keys removed before it.
+        self._handles_by_priority: dict[int, OrderedDict[int, None]] = {}
+        self._next_handle = 0
+        self._pending: list[tuple[float, int, Token]] = []  # Heap of tokens that are not due yet.
+        self._expiries: list[tuple[float, int]] = []  # Heap of the expiry times and handles of tokens.
+        self.version = 0  # Incremented on every change, used to detect whether a firing changed the place.
+        for token in tokens:
+            self.add(token)
+
+    def add(self, token: Token) -> Optional[int]:
+        """Add the token, returning its handle, or None if it is held back until its not_before time."""
+        if token.not_before is not None:
+            heapq.heappush(self._pending, (token.not_before, self._next_handle, token))
+            self._next_handle += 1  # Handles only need to increase, so one is used to order the pending tokens.
+            return None
+        handle = self._next_handle
+        self._next_handle += 1
+        self._insert(handle, token)
+        if token.expires_at is not None:
+            heapq.heappush(self._expiries, (token.expires_at, handle))
+        self.version += 1
+        changes = _token_changes.get()
+        if changes is not None:
+            changes.record_added(self, token)
+        return handle
+
+    def extend(self, tokens: Iterable[Token]) -> tuple[Optional[int], ...]:
+        return tuple(self.add(token) for token in tokens)
+
+    def next_due(self) -> Optional[float]:
+        """The earliest time a held back token is due or a token expires, None if there are no timed tokens."""
+        due = self._pending[0][0] if self._pending else None
+        if self._expiries and (due is None or self._expiries[0][0] < due):
+            return self._expiries[0][0]
+        return due
+
+    def release_due(self, now: float) -> tuple[list[Token], list[Token]]:
+        """Add the held back tokens that are due and remove the tokens that have expired, returning both."""
+        released, expired = [], []
+        while self._pending and self._pending[0][0] <= now:
+            token = heapq.heappop(self._pending)[2]
+            if token.expires_at is not None and token.expires_at <= now:
+                expired.append(token)
+            else:
+                released.append(replace(token, not_before=None))
+                self.add(released[-1])
+        while self._expiries and self._expiries[0][0] <= now:
+            handle = heapq.heappop(self._expiries)[1]
+            if self.has_handle(handle):
+                expired.append(self.remove(handle))
+        return released, expired
+
+    def pending(self) -> tuple[Token, ...]:
+        """The tokens held back until their not_before time, the first due first."""
+        return tuple(token for _, _, token in sorted(self._pending))
+
+    def clear(self) -> None:
+        """Remove every token, including held back ones, keeping the container, e.g. to give a place a new marking.
+
+        Handles keep increasing, so tokens added afterwards are newer than the ones removed. Meant for use outside of
+        firings, the tokens removed are not recorded as changes of a firing.
+        """
+        self._tokens.clear()
+        self._handles_by_id.clear()
+        self._handles_by_priority.clear()
+        self._pending.clear()
+        self._expiries.clear()
+        self.version += 1
+
+    def remove(self, handle: int) -> Token:
+        token = self._take(handle)
+        self.version += 1
+        changes = _token_changes.get()
+        if changes is not None:
+            changes.record_removed(self, token)
+        return token
+
+    def _insert(self, handle: int, token: Token) -> None:
+        self._tokens[handle] = token
+        self._handles_by_id.setdefault(token.id, {})[handle] = None
+        handles = self._handles_by_priority.get(token.priority)
+        if handles is None:
+            handles = self._handles_by_priority[token.priority] = OrderedDict()
+        handles[handle] = None
+
+    def _take(self, handle: int) -> Token:
+        token = self._tokens.pop(handle)
+        handles = self._handles_by_id[token.id]
+        del handles[handle]
+        if len(handles) == 0:
+            del self._handles_by_id[token.id]
+        handles = self._handles_by_priority[token.priority]
+        del handles[handle]
+        if len(handles) == 0:
+            del self._handles_by_priority[token.priority]
+        return token
+
+    def get(self, handle: int) -> Token:
+        return self._tokens[handle]
+
+    def items(self) -> Iterable[tuple[int, Token]]:
+        return self._tokens.items()
+
+    def items_after(self, handle: int) -> list[tuple[int, Token]]:
+        """The handles and tokens added after the token with the given handle, in insertion order."""
+        newer = []
+        for newer_handle in reversed(self._tokens):
+            if newer_handle <= handle:
+                break
+            newer.append((newer_handle, self._tokens[newer_handle]))
+        newer.reverse()
+        return newer
+
+    def has_handle(self, handle: int) -> bool:
+        return handle in self._tokens
+
+    def handles_with_id(self, token_id: str) -> tuple[int, ...]:
+        return tuple(self._handles_by_id.get(token_id, ()))
+
+    def with_id(self, token_id: str) -> tuple[Token, ...]:
+        return tuple(self._tokens[handle] for handle in self._handles_by_id.get(token_id, ()))
+
+    def highest_priority(self) -> Optional[tuple[Any, int]]:
+        """The highest priority in the place and the handle of the first token added with it, None if empty."""
+        if len(self._handles_by_priority) == 0:
+            return None
+        priority = max(self._handles_by_priority)
+        return priority, next(iter(self._handles_by_priority[priority]))
+
+    def in_priority_order(self) -> Iterable[tuple[int, Token]]:
+        """The handles and tokens in the order they would be selected, highest priority and oldest first."""
+        for priority in sorted(self._handles_by_priority, reverse=True):
+            for handle in self._handles_by_priority[priority]:
+                yield handle, self._tokens[handle]
+
+    def newest_handle(self) -> int:
+        return next(reversed(self._tokens))
+
+    def __reversed__(self):
+        return reversed(self._tokens.values())
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def __iter__(self):
+        return iter(self._tokens.values())
+
+    def __getitem__(self, index):
+        return tuple(self._tokens.values())[index]
+
+    def __add__(self, other: Iterable[Token]) -> tuple[Token, ...]:
+        return tuple(self) + tuple(other)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (PlaceTokens, tuple, list)):
+            return len(self) == len(other) and tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        raise TypeError("unhashable type: 'PlaceTokens'")
+
+    def __repr__(self) -> str:
+        return f"PlaceTokens({tuple(self)!r})"
+
+
+class SpillingPlaceTokens(PlaceTokens):
+    """PlaceTokens that keep at most maximum_in_memory tokens in memory and spill the rest to an SQLite file.
+
+    The tokens kept in memory are the ones that would be selected first, highest priority and oldest, so selecting
+    a token never reads the file. Once the place holds more than maximum_in_memory tokens, the batch_size tokens that
+    would be selected last are written to the file, and batches are read back as the place drains. Iteration, len(),
+    handles and comparison behave as for PlaceTokens, but iterating reads the spilled tokens, which must be picklable.
+    A file at path is overwritten. Without a path the file is a temporary one, removed when the tokens are garbage
+    collected or closed.
+    """
+
+    __slots__ = ("maximum_in_memory", "batch_size", "connection", "spilled_count", "_spilled_best", "_unwritten")
+
+    def __init__(
+        self,
+        tokens: Iterable[Token] = (),
+        maximum_in_memory: int = 100_000,
+        batch_size: Optional[int] = None,
+        path: Optional[str] = None,
+    ):
+        if maximum_in_memory < 1:
+            raise ValueError(f"maximum_in_memory should be a positive int, got {maximum_in_memory}.")
+        batch_size = batch_size if batch_size is not None else max(1, maximum_in_memory // 10)
+        if not 0 < batch_size <= maximum_in_memory:
+            raise ValueError(f"batch_size should be between 1 and maximum_in_memory, got {batch_size}.")
+        self.maximum_in_memory = maximum_in_memory
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(
+            path if path is not None else "", isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("DROP TABLE IF EXISTS tokens")
+        self.connection.execute(
+            "CREATE TABLE tokens (handle INTEGER PRIMARY KEY, id TEXT, priority INTEGER, token BLOB)"
+        )
+        self.connection.execute("CREATE INDEX tokens_by_priority ON tokens (priority DESC, handle)")
+        self.spilled_count = 0
+        self._spilled_best: Optional[tuple[int, int]] = None  # The priority and handle of the first spilled token.
+        self._unwritten: list[tuple[int, str, int, bytes]] = []  # Spilled rows written in batches.
+        super().__init__(tokens)
+
+    def clear(self) -> None:
+        super().clear()
+        self._unwritten.clear()
+        self.connection.execute("DELETE FROM tokens")
+        self.spilled_count = 0
+        self._spilled_best = None
+
+    def _insert(self, handle: int, token: Token) -> None:
+        best = self._spilled_best  # None while nothing is spilled.
+        if best is not None and (token.priority, -handle) < (best[0], -best[1]):
+            self._spill(((handle, token),))  # Selected after a token that is already spilled.
+            return
+        super()._insert(handle, token)
+        if len(self._tokens) > self.maximum_in_memory:
+            self._spill(self._selected_last(self.batch_size))
+
+    def _take(self, handle: int) -> Token:
+        if handle in self._tokens:
+            token = super()._take(handle)
+            if self.spilled_count > 0 and len(self._tokens) <= self.maximum_in_memory - self.batch_size:
+                self._page_in()
+            return token
+        self._write()
+        row = self.connection.execute("SELECT token FROM tokens WHERE handle = ?", (handle,)).fetchone()
+        if row is None:
+            raise KeyError(handle)
+        self.connection.execute("DELETE FROM tokens WHERE handle = ?", (handle,))
+        self.spilled_count -= 1
+        if self._spilled_best is not None and handle == self._spilled_best[1]:
+            self._find_spilled_best()
+        return pickle.loads(row[0])
+
+    def _selected_last(self, count: int) -> list[tuple[int, Token]]:
+        """The in-memory tokens that would be selected last, lowest priority and newest first."""
+        selected = []
+        for priority in sorted(self._handles_by_priority):
+            for handle in reversed(self._handles_by_priority[priority]):
+                selected.append((handle, self._tokens[handle]))
+                if len(selected) == count:
+                    return selected
+        return selected
+
+    def _spill(self, items: Iterable[tuple[int, Token]]) -> None:
+        rows = [(handle, token.id, token.priority, pickle.dumps(token)) for handle, token in items]
+        for handle, *_ in rows:
+            if handle in self._tokens:
+                super()._take(handle)
+        self._unwritten.extend(rows)
+        if len(self._unwritten) >= self.batch_size:
+            self._write()
+        self.spilled_count += len(rows)
+        for handle, _, priority, _ in rows:
+            if self._spilled_best is None or (priority, -handle) > (self._spilled_best[0], -self._spilled_best[1]):
+                self._spilled_best = (priority, handle)
+
+    def _write(self) -> None:
+        if len(self._unwritten) > 0:
+            self.connection.executemany("INSERT INTO tokens VALUES (?, ?, ?, ?)", self._unwritten)
+            self._unwritten.clear()
+
+    def _page_in(self) -> None:
+        self._write()
+        rows = self.connection.execute(
+            "SELECT handle, token FROM tokens ORDER BY priority DESC, handle LIMIT ?", (self.batch_size,)
+        ).fetchall()
+        self.connection.executemany("DELETE FROM tokens WHERE handle = ?", [(handle,) for handle, _ in rows])
+        self.spilled_count -= len(rows)
+        for handle, data in rows:
+            super()._insert(handle, pickle.loads(data))
+        self._find_spilled_best()
+
+    def _find_spilled_best(self) -> None:
+        self._spilled_best = self.connection.execute(
+            "SELECT priority, handle FROM tokens ORDER BY priority DESC, handle LIMIT 1"
+        ).fetchone()
+
+    def _spilled(self, query: str, parameters: tuple = ()) -> Iterable[tuple[int, Token]]:
+        self._write()
+        for handle, data in self.connection.execute(f"SELECT handle, token FROM tokens {query}", parameters):
+            yield handle, pickle.loads(data)
+
+    def get(self, handle: int) -> Token:
+        if handle in self._tokens:
+            return self._tokens[handle]
+        for _, token in self._spilled("WHERE handle = ?", (handle,)):
+            return token
+        raise KeyError(handle)
+
+    def has_handle(self, handle: int) -> bool:
+        self._write()
+        return handle in self._tokens or self.connection.execute(
+            "SELECT 1 FROM tokens WHERE handle = ?", (handle,)
+        ).fetchone() is not None
+
+    def items(self) -> Iterable[tuple[int, Token]]:
+        return heapq.merge(sorted(self._tokens.items()), self._spilled("ORDER BY handle"), key=lambda item: item[0])
+
+    def items_after(self, handle: int) -> list[tuple[int, Token]]:
+        return list(heapq.merge(
+            sorted(item for item in self._tokens.items() if item[0] > handle),
+            self._spilled("WHERE handle > ? ORDER BY handle", (handle,)),
+            key=lambda item: item[0],
+        ))
+
+    def handles_with_id(self, token_id: str) -> tuple[int, ...]:
+        return tuple(handle for handle, _ in self._items_with_id(token_id))
+
+    def with_id(self, token_id: str) -> tuple[Token, ...]:
+        return tuple(token for _, token in self._items_with_id(token_id))
+
+    def _items_with_id(self, token_id: str) -> list[tuple[int, Token]]:
+        in_memory = [(handle, self._tokens[handle]) for handle in self._handles_by_id.get(token_id, ())]
+        return sorted(in_memory + list(self._spilled("WHERE id = ?", (token_id,))))
+
+    def in_priority_order(self) -> Iterable[tuple[int, Token]]:
+        yield from super().in_priority_order()
+        yield from self._spilled("ORDER BY priority DESC, handle")
+
+    def newest_handle(self) -> int:
+        self._write()
+        newest = self.connection.execute("SELECT MAX(handle) FROM tokens").fetchone()[0]
+        return max(max(self._tokens, default=-1), newest if newest is not None else -1)
+
+    def __reversed__(self):
+        return (token for _, token in heapq.merge(
+            sorted(self._tokens.items(), reverse=True),
+            self._spilled("ORDER BY handle DESC"),
+            key=lambda item: item[0],
+            reverse=True,
+        ))
+
+    def __len__(self) -> int:
+        return len(self._tokens) + self.spilled_count
+
+    def __iter__(self):
+        return (token for _, token in self.items())
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __deepcopy__(self, memo) -> "SpillingPlaceTokens":
+        tokens = (deepcopy(token, memo) for token in (*self, *self.pending()))
+        return SpillingPlaceTokens(tokens, self.maximum_in_memory, self.batch_size)
+
+    def __repr__(self) -> str:
+        return f"SpillingPlaceTokens({len(self._tokens)} in memory, {self.spilled_count} spilled)"
+
+
+def _data_size(token: Token) -> int:
+    return sys.getsizeof(token.data)
+
+
+@dataclass
+class ShedPolicy:
+    """Shed tokens from a place once it holds more than maximum_count tokens, tokens older than maximum_age seconds or
+    more than maximum_bytes of token data.
+
+    Tokens are shed in the reverse of the order they would be taken in, lowest priority and newest first, apart from
+    tokens over maximum_age, which are shed oldest first. Tokens with at least protected_priority are never shed.
+    Shed tokens are moved to the shed_place, or dropped if there is none. The ages are measured from when the policy
+    first saw the token, and the bytes are estimated with size_function on a sample of the newest tokens.
+    The number of tokens shed for exceeding each limit ("count", "age" or "bytes") is kept in shed_counts.
+    """
+    maximum_count: Optional[int] = None
+    maximum_age: Optional[float] = None
+    maximum_bytes: Optional[int] = None
+    shed_place: Optional[str] = None
+    protected_priority: Optional[int] = None
+    size_function: Callable[[Token], int] = field(default=_data_size, repr=False)
+    clock: Callable[[], float] = field(default=time.monotonic, repr=False)
+    shed_counts: dict[str, int] = field(default_factory=dict)
+    # The newest handle in the place and the time at each check, used to estimate the age of tokens.
+    checkpoints: deque[tuple[int, float]] = field(default_factory=deque, repr=False, compare=False)
+    # The container the checkpoints were taken of, as handles only increase within one PlaceTokens.
+    checkpointed_tokens: Optional["PlaceTokens"] = field(default=None, repr=False, compare=False)
+
+    def sheddable(self, token: Token) -> bool:
+        return self.protected_priority is None or token.priority < self.protected_priority
+
+    def select(self, tokens: "PlaceTokens") -> list[tuple[int, str]]:
+        """The handles of the tokens to shed and the limit each exceeds."""
+        shed: list[tuple[int, str]] = []
+        if len(tokens) == 0:
+            return shed
+        if self.maximum_age is not None:
+            now = self.clock()
+            if tokens is not self.checkpointed_tokens:  # A new container, its tokens are first seen now.
+                self.checkpoints.clear()
+                self.checkpointed_tokens = tokens
+            newest_handle = tokens.newest_handle()
+            if len(self.checkpoints) == 0 or self.checkpoints[-1][0] < newest_handle:
+                self.checkpoints.append((newest_handle, now))
+            checkpoints = iter(self.checkpoints)
+            checkpoint_handle, seen_at = next(checkpoints)
+            for handle, token in tokens.items():
+                while checkpoint_handle < handle:
+                    checkpoint_handle, seen_at = next(checkpoints)
+                if now - seen_at <= self.maximum_age:
+                    break
+                if self.sheddable(token):
+                    shed.append((handle, "age"))
+            aged = {handle for handle, _ in shed}
+            oldest_kept = next((handle for handle, _ in tokens.items() if handle not in aged), newest_handle)
+            while len(self.checkpoints) > 1 and self.checkpoints[0][0] < oldest_kept:
+                self.checkpoints.popleft()
+        maximum_count, reason = self.maximum_count, "count"
+        if self.maximum_bytes is not None:
+            sample = [token for _, token in zip(range(16), reversed(tokens))]
+            mean_size = sum(self.size_function(token) for token in sample) / len(sample)
+            allowed = int(self.maximum_bytes // mean_size) if mean_size > 0 else len(tokens)
+            if maximum_count is None or allowed < maximum_count:
+                maximum_count, reason = allowed, "bytes"
+        excess = 0 if maximum_count is None else len(tokens) - len(shed) - maximum_count
+        if excess > 0:
+            already_shed = {handle for handle, _ in shed}
+            candidates = (
+                (handle, token) for handle, token in tokens.items()
+                if handle not in already_shed and self.sheddable(token)
+            )
+            lowest = heapq.nsmallest(excess, candidates, key=lambda item: (item[1].priority, -item[0]))
+            shed.extend((handle, reason) for handle, _ in lowest)
+        for _, shed_reason in shed:
+            self.shed_counts[shed_reason] = self.shed_counts.get(shed_reason, 0) + 1
+        return shed
 
 
 @dataclass
 class Place:
     id: str
     name: Optional[str]
-    tokens: Iterable[Token]
+    tokens: PlaceTokens  # Any iterable of tokens is converted to PlaceTokens when set.
+    capacity: Optional[int] = None
+    # A place holding capacity or more tokens is full and blocks the transitions that output to it.
+    shed_policy: Optional[ShedPolicy] = field(default=None, compare=False)
+    dead_letter_place: Optional[str] = None  # Receives the tokens that expire in this place, which are dropped if None.
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name == "tokens" and not isinstance(value, PlaceTokens):
+            value = PlaceTokens(value)
+        object.__setattr__(self, name, value)
+
+
+class CountPriorityFunction:
+    """A transition priority function that only depends on the number of tokens in the input places.
+
+    The engine recognises these and evaluates them from place token counts without collecting the places.
+    If constant is None the priority is the input token count, otherwise it is constant when there are any input tokens.
+    """
+
+    __slots__ = ("constant",)
+
+    def __init__(self, constant: Optional[int] = None):
+        self.constant = constant
+
+    def from_input_token_count(self, count: int) -> int:
+        if self.constant is None:
+            return count
+        return self.constant if count > 0 else 0
+
+    def __call__(self, input_places: dict[str, "Place"], output_places: dict[str, "Place"]) -> int:
+        return self.from_input_token_count(SelectToken.total_count(input_places))
+
+    def __repr__(self) -> str:
+        return f"CountPriorityFunction({self.constant!r})"
 
 
 FireFunctionType = Union[
@@ -32,8 +568,13 @@ class Transition:
     fire: FireFunctionType
     maximum_firings: Optional[int] = 1
     firings_count: int = 0
-    priority_function: Optional[Callable[[dict[str, Place], dict[str, Place]], int]] = \
-        lambda input_places, _: len(tuple(token for place in input_places.values() for token in place.tokens))
+    priority_function: Optional[Callable[[dict[str, Place], dict[str, Place]], int]] = CountPriorityFunction()
+    resource_pool_ids: tuple[str, ...] = ()  # Named PetriNet.resource_pools to hold while firing.
+    maximum_concurrency: Optional[int] = None  # The most firings of this transition in flight at once.
+    # The transform of a SyncTransition.flip, which lets chains of flips be fused into one transition.
+    transform_function: Optional[Callable[[Token], Token]] = field(default=None, compare=False, repr=False)
+    # False when a firing takes more than the highest priority input token, as a SyncTransition.join does.
+    single_token: bool = field(default=True, compare=False, repr=False)
 
 
 @dataclass(frozen=True)
@@ -48,12 +589,305 @@ class ArcOut:
     place_id: str
 
 
+class ResourcePool:
+    """A resource acquired by a transition for the duration of each firing, declared by name on the PetriNet.
+
+    A transition is treated as not enabled while any of its resource pools is unavailable.
+    """
+
+    def available(self) -> bool:
+        return True
+
+    def acquire(self) -> Any:
+        return None
+
+    def release(self, resource: Any, latency: float, error: Optional[BaseException]) -> None:
+        pass
+
+    def seconds_until_available(self) -> Optional[float]:
+        """The time until the pool becomes available again without waiting for a release, None if unknown."""
+        return 0.0 if self.available() else None
+
+    def metrics(self) -> dict[str, float]:
+        return {}
+
+
+class ConcurrencyLimit(ResourcePool):
+    """Allow at most limit firings, of all the transitions sharing the pool, to be in flight at once."""
+
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError(f"limit should be a positive int, got {limit}.")
+        self.limit = limit
+        self.in_use = 0
+
+    def available(self) -> bool:
+        return self.in_use < self.limit
+
+    def acquire(self) -> Any:
+        self.in_use += 1
+
+    def release(self, resource: Any, latency: float, error: Optional[BaseException]) -> None:
+        self.in_use -= 1
+
+    def metrics(self) -> dict[str, float]:
+        return {"limit": self.limit, "in_use": self.in_use}
+
+
+class AdaptiveConcurrencyLimit(ConcurrencyLimit):
+    """A ConcurrencyLimit that adjusts its limit from the latency and errors of the firings it releases.
+
+    With "aimd" the limit grows by one for every limit successful firings, and is multiplied by backoff on an error or
+    a latency above latency_threshold. With "gradient" the limit is scaled by the ratio of tolerance times the lowest
+    latency seen to the recent (smoothed) latency, between 0.5 and 1, plus a headroom of its square root, and also
+    backs off on errors. The limit only grows while at least half of it is in use, and stays between minimum_limit
+    and maximum_limit. Cancelled firings do not change the limit.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        minimum_limit: int = 1,
+        maximum_limit: int = 1000,
+        algorithm: str = "aimd",
+        backoff: float = 0.9,
+        latency_threshold: Optional[float] = None,
+        tolerance: float = 1.5,
+        smoothing: float = 0.2,
+    ):
+        if algorithm not in ("aimd", "gradient"):
+            raise ValueError(f"algorithm should be \"aimd\" or \"gradient\", got \"{algorithm}\".")
+        if not 1 <= minimum_limit <= initial_limit <= maximum_limit:
+            raise ValueError(
+                f"Expecting 1 <= minimum_limit <= initial_limit <= maximum_limit, "
+                f"got {minimum_limit}, {initial_limit} and {maximum_limit}."
+            )
+        super().__init__(initial_limit)
+        self.minimum_limit = minimum_limit
+        self.maximum_limit = maximum_limit
+        self.algorithm = algorithm
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.estimated_limit = float(initial_limit)
+        self.minimum_latency: Optional[float] = None
+        self.smoothed_latency: Optional[float] = None
+        self.successes = 0
+        self.errors = 0
+
+    def release(self, resource: Any, latency: float, error: Optional[BaseException]) -> None:
+        saturated = 2 * self.in_use >= self.limit
+        super().release(resource, latency, error)
+        if error is not None and not isinstance(error, Exception):  # Cancelled, which says nothing about the load.
+            return
+        if error is not None:
+            self.errors += 1
+            self.estimated_limit *= self.backoff
+        elif self.algorithm == "aimd":
+            self.successes += 1
+            if self.latency_threshold is not None and latency > self.latency_threshold:
+                self.estimated_limit *= self.backoff
+            elif saturated:
+                self.estimated_limit += 1 / self.estimated_limit
+        else:
+            self.successes += 1
+            self.minimum_latency = latency if self.minimum_latency is None else min(self.minimum_latency, latency)
+            self.smoothed_latency = latency if self.smoothed_latency is None else (
+                (1 - self.smoothing) * self.smoothed_latency + self.smoothing * latency
+            )
+            gradient = 1.0
+            if self.smoothed_latency > 0:
+                gradient = max(0.5, min(1.0, self.tolerance * self.minimum_latency / self.smoothed_latency))
+            new_limit = self.estimated_limit * gradient + (math.sqrt(self.estimated_limit) if saturated else 0.0)
+            self.estimated_limit = (1 - self.smoothing) * self.estimated_limit + self.smoothing * new_limit
+        self.estimated_limit = max(self.minimum_limit, min(self.maximum_limit, self.estimated_limit))
+        self.limit = int(self.estimated_limit)
+
+    def metrics(self) -> dict[str, float]:
+        return {
+            **super().metrics(),
+            "estimated_limit": self.estimated_limit,
+            "successes": self.successes,
+            "errors": self.errors,
+        }
+
+
+class ConnectionPool(ResourcePool):
+    """Share up to size connections, made with connect when needed, between the firings of transitions."""
+
+    def __init__(self, connect: Callable[[], Any], size: int):
+        if size < 1:
+            raise ValueError(f"size should be a positive int, got {size}.")
+        self.connect = connect
+        self.size = size
+        self.in_use = 0
+        self.idle: list[Any] = []
+
+    def available(self) -> bool:
+        return self.in_use < self.size
+
+    def acquire(self) -> Any:
+        self.in_use += 1
+        return self.idle.pop() if self.idle else self.connect()
+
+    def release(self, resource: Any, latency: float, error: Optional[BaseException]) -> None:
+        self.in_use -= 1
+        self.idle.append(resource)
+
+    def metrics(self) -> dict[str, float]:
+        return {"size": self.size, "in_use": self.in_use, "idle": len(self.idle)}
+
+
+class TokenBucket(ResourcePool):
+    """Rate limit firings to rate per second on average, allowing bursts of up to burst firings."""
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Expected a positive rate and burst, got {rate} and {burst}.")
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> bool:
+        self._refill()
+        return self.tokens >= 1
+
+    def acquire(self) -> Any:
+        self._refill()
+        self.tokens -= 1
+
+    def seconds_until_available(self) -> Optional[float]:
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def metrics(self) -> dict[str, float]:
+        self._refill()
+        return {"rate": self.rate, "tokens": self.tokens}
+
+
+_acquired_resources: ContextVar[dict[str, Any]] = ContextVar("acquired_resources", default={})
+
+
+class AcquiredResources:
+
+    def get(pool_id: str) -> Any:
+        """Return the resource (e.g. a connection) acquired from the named pool for the current firing."""
+        resources = _acquired_resources.get()
+        if pool_id not in resources:
+            raise KeyError(f"No resource acquired from pool \"{pool_id}\" by the current firing.")
+        return resources[pool_id]
+
+
+def _counting_changes(method: Callable) -> Callable:
+    def counted(self, *args):
+        self.version += 1
+        return method(self, *args)
+
+    return counted
+
+
+class VersionedSet(set):
+    """A set that counts the changes made to it, so that the arc index can tell when it is out of date."""
+    version = 0
+
+
+for _name in (
+    "add", "discard", "remove", "pop", "clear", "update", "difference_update", "intersection_update",
+    "symmetric_difference_update", "__ior__", "__iand__", "__isub__", "__ixor__",
+):
+    setattr(VersionedSet, _name, _counting_changes(getattr(set, _name)))
+
+
+class VersionedDict(dict):
+    """A dict that counts the changes made to its keys, replacing the value of an existing key is not counted."""
+    version = 0
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.version += 1
+        dict.__setitem__(self, key, value)
+
+
+for _name in ("__delitem__", "pop", "popitem", "clear", "update", "setdefault", "__ior__"):
+    setattr(VersionedDict, _name, _counting_changes(getattr(dict, _name)))
+
+
+def _version(container: Any) -> int:
+    """The change count of a VersionedSet or VersionedDict."""
+    return container.version
+
+
+@dataclass
+class ArcIndex:
+    """Place ids connected to each transition, in the order of PetriNet.places."""
+    arcs_in: set[ArcIn]
+    arcs_out: set[ArcOut]
+    places: dict[str, Place]
+    arcs_in_version: int
+    arcs_out_version: int
+    places_version: int
+    incoming_place_ids: dict[str, tuple[str, ...]]
+    outgoing_place_ids: dict[str, tuple[str, ...]]
+    outgoing_arc_place_ids: dict[str, tuple[str, ...]]  # Including arcs to places that do not exist.
+
+
 @dataclass
 class PetriNet:
     places: dict[str, Place]
     transitions: dict[str, Transition]
     arcs_in: set[ArcIn]
     arcs_out: set[ArcOut]
+    arc_index: Optional[ArcIndex] = field(default=None, repr=False, compare=False)
+    # The arc_index is a cache rebuilt by PetriNetOperations.arc_index when the arcs or places change.
+    resource_pools: dict[str, ResourcePool] = field(default_factory=dict, repr=False, compare=False)
+    firings_in_flight: dict[str, int] = field(default_factory=dict, repr=False, compare=False)
+    delta_subscribers: list[Callable[["StepDelta"], None]] = field(default_factory=list, repr=False, compare=False)
+    clock: Callable[[], float] = field(default=time.monotonic, repr=False, compare=False)  # For timed tokens.
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in ("arcs_in", "arcs_out") and not isinstance(value, VersionedSet):
+            value = VersionedSet(value)
+        elif name == "places" and not isinstance(value, VersionedDict):
+            value = VersionedDict(value)
+        object.__setattr__(self, name, value)
+
+
+@dataclass(frozen=True)
+class StepDelta:
+    """The tokens removed from and added to each place by a firing that changed the net.
+
+    The times, from time.monotonic, are when the firing started (async firings take their tokens then) and finished.
+    Tokens shed by the ShedPolicy of a place are published in a delta with a transition_id of None.
+    """
+    transition_id: Optional[str]
+    removed: dict[str, tuple[Token, ...]]
+    added: dict[str, tuple[Token, ...]]
+    started: Optional[float] = field(default=None, compare=False)
+    finished: Optional[float] = field(default=None, compare=False)
+
+
+class DeltaStream:
+    """Buffer the deltas of the firings of a net until they are read by iterating over the stream."""
+
+    def __init__(self, net: PetriNet, maximum_size: Optional[int] = None):
+        self.net = net
+        self.deltas: deque[StepDelta] = deque(maxlen=maximum_size)
+        PetriNetOperations.subscribe(net, self.deltas.append)
+
+    def __iter__(self):
+        while len(self.deltas) > 0:
+            yield self.deltas.popleft()
+
+    def close(self) -> None:
+        PetriNetOperations.unsubscribe(self.net, self.deltas.append)
 
 
 class TransitionFiringLimitExceeded(Exception):
@@ -89,6 +923,8 @@ class PetriNetCheck:
             raise PlaceTypeError(f"Expected place name to be a str, got {type(place.name)}.")
         if not isinstance(place, Place):
             raise PlaceTypeError(f"Expected Place, got {type(place)}.")
+        if place.capacity is not None and (not isinstance(place.capacity, int) or place.capacity < 1):
+            raise PlaceTypeError(f"Expected place capacity to be None or a positive int, got {place.capacity}.")
         PetriNetCheck.tokens(place.tokens)
 
     def places(places: Iterable[Place]) -> None:
@@ -106,37 +942,50 @@ class SelectToken:
     def total_count(places: dict[str, Place]) -> int:
         return sum(len(place.tokens) for place in places.values())
 
+    def handle_with_highest_priority(places: dict[str, Place]) -> Optional[tuple[str, int]]:
+        """Return the place id and handle of the first token with the highest priority."""
+        selected = None
+        highest_priority = None
+        for place_id, place in places.items():
+            place_highest = place.tokens.highest_priority()
+            if place_highest is not None and (highest_priority is None or place_highest[0] > highest_priority):
+                highest_priority, handle = place_highest
+                selected = (place_id, handle)
+        return selected
+
     def with_highest_priority(places: dict[str, Place]) -> Optional[Token]:
-        tokens = tuple(token for place in places.values() for token in place.tokens)
-        if len(tokens) == 0:
+        selected = SelectToken.handle_with_highest_priority(places)
+        if selected is None:
             return None
-        tokens_with_priority = ((token, token.priority) for token in tokens)
-        sorted_by_priority = sorted(tokens_with_priority, key=lambda item: item[1], reverse=True)
-        return sorted_by_priority[0][0]
+        place_id, handle = selected
+        return places[place_id].tokens.get(handle)
+
+    def with_id(places: dict[str, Place], token_id: str) -> tuple[Token, ...]:
+        return tuple(token for place in places.values() for token in place.tokens.with_id(token_id))
 
 
 class RemoveToken:
 
+    def by_handle(places: dict[str, Place], place_id: str, handle: int) -> Token:
+        return places[place_id].tokens.remove(handle)
+
     def with_highest_priority(places: dict[str, Place]) -> tuple[Optional[Token], dict[str, Place]]:
-        token = SelectToken.with_highest_priority(places)
-        if token is None:
+        """Remove the token with the highest priority from the place holding it, the places are changed in place."""
+        selected = SelectToken.handle_with_highest_priority(places)
+        if selected is None:
             return None, places
-        places_sans_token = {
-            place_id: Place(place.id, place.name, tuple(t for t in place.tokens if t != token))
-            for place_id, place in places.items()
-        }
-        return token, places_sans_token
+        token = RemoveToken.by_handle(places, *selected)
+        return token, places
 
 
 class AddTokens:
 
     def to_place(tokens: Iterable[Token], place: Place, checks=True) -> Place:
+        tokens = tuple(tokens)
         if checks:
             PetriNetCheck.tokens(tokens)
-        resulting_place = Place(place.id, place.name, place.tokens + tuple(tokens))
-        if checks:
-            PetriNetCheck.place(resulting_place)
-        return resulting_place
+        place.tokens.extend(tokens)
+        return place
 
     def to_output_places(
         tokens: tuple[Token, ...],
@@ -166,33 +1015,135 @@ class AddTokens:
             return out
 
 
-class TransitionPriorityFunction:
+class PlaceCapacity:
 
-    def _constant_if_any_input_tokens(input_places, _, value: int) -> int:
-        if SelectToken.total_count(input_places) > 0:
-            return value
-        return 0
+    def is_full(place: Place, reserved: int = 0) -> bool:
+        """Whether the place has no room for another token, with reserved tokens still to be added by firings."""
+        return place.capacity is not None and len(place.tokens) + reserved >= place.capacity
 
-    def constant_if_any_input_tokens(value: int) -> Callable[[dict[str, Place], dict[str, Place]], int]:
-        return lambda input_places, _: TransitionPriorityFunction._constant_if_any_input_tokens(input_places, _, value)
 
-    def _equal_to_input_token_count(input_places, _) -> int:
-        return SelectToken.total_count(input_places)
+class TransitionPriorityFunction:
+
+    def constant_if_any_input_tokens(value: int) -> Callable[[dict[str, Place], dict[str, Place]], int]:
+        return CountPriorityFunction(value)
 
     def equal_to_input_token_count() -> Callable[[dict[str, Place], dict[str, Place]], int]:
-        return lambda input_places, _: TransitionPriorityFunction._equal_to_input_token_count(input_places, _)
+        return CountPriorityFunction()
 
 
 class SelectTransition:
 
     def using_priority_functions(net: PetriNet) -> Optional[Transition]:
         transitions_and_priorities: dict[str, int] = PetriNetOperations.transition_priorities(net)
+        if len(transitions_and_priorities) == 0:
+            return None
         transition_id, priority = sorted(transitions_and_priorities.items(), key=lambda item: item[1])[-1]
         if priority <= 0:
             return None
         return net.transitions[transition_id]
 
 
+class KeyedJoin:
+    """Match tokens across the places place_ids by key_function(token.data), for a join transition.
+
+    Each place has a hash index from key to the handles of its tokens, brought up to date from the tokens added since
+    the last lookup, so a match is found without scanning the places. Entries for tokens taken by other transitions are
+    dropped when they are looked up. With a timeout, tokens left unmatched for timeout seconds after the join first saw
+    them have expired. Expiry is checked whenever the join's transition is considered for firing.
+    """
+
+    def __init__(
+        self,
+        key_function: Callable[[Any], Any],
+        place_ids: tuple[str, ...],
+        timeout: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if len(place_ids) < 2:
+            raise ValueError(f"A join needs at least two places, got {place_ids}.")
+        if timeout is not None and timeout <= 0:
+            raise ValueError(f"timeout should be positive, got {timeout}.")
+        self.key_function = key_function
+        self.place_ids = place_ids
+        self.timeout = timeout
+        self.clock = clock
+        self.indexed_tokens: dict[str, PlaceTokens] = {}
+        self.last_handles: dict[str, int] = {}
+        self.handles_by_key: dict[str, dict[Any, dict[int, None]]] = {place_id: {} for place_id in place_ids}
+        self.arrivals: dict[str, deque[tuple[int, float]]] = {place_id: deque() for place_id in place_ids}
+        self.ready_keys: dict[Any, None] = {}  # Keys that were seen in every place, oldest match first.
+
+    def refresh(self, places: dict[str, Place]) -> None:
+        """Index the tokens added to the places since the last refresh."""
+        PetriNetCheck.selected_places_exist(self.place_ids, places)
+        now = self.clock() if self.timeout is not None else 0.0
+        for place_id in self.place_ids:
+            tokens = places[place_id].tokens
+            if tokens is not self.indexed_tokens.get(place_id):  # A new container, index it from scratch.
+                self.indexed_tokens[place_id] = tokens
+                self.last_handles[place_id] = -1
+                self.handles_by_key[place_id] = {}
+                self.arrivals[place_id] = deque()
+            new_tokens = tokens.items_after(self.last_handles[place_id])
+            if len(new_tokens) == 0:
+                continue
+            self.last_handles[place_id] = new_tokens[-1][0]
+            by_key = self.handles_by_key[place_id]
+            for handle, token in new_tokens:
+                key = self.key_function(token.data)
+                by_key.setdefault(key, {})[handle] = None
+                if self.timeout is not None:
+                    self.arrivals[place_id].append((handle, now))
+                if all(key in self.handles_by_key[other_id] for other_id in self.place_ids):
+                    self.ready_keys[key] = None
+
+    def first_handle(self, place_id: str, key: Any) -> Optional[int]:
+        """The oldest token with the key still in the place, dropping the handles of tokens no longer there."""
+        by_key = self.handles_by_key[place_id]
+        handles = by_key.get(key)
+        tokens = self.indexed_tokens[place_id]
+        while handles:
+            handle = next(iter(handles))
+            if tokens.has_handle(handle):
+                return handle
+            del handles[handle]
+        by_key.pop(key, None)
+        return None
+
+    def match(self, places: dict[str, Place]) -> Optional[tuple[int, ...]]:
+        """The handles of the oldest tokens sharing a key in each of the places, in place_ids order."""
+        self.refresh(places)
+        while self.ready_keys:
+            key = next(iter(self.ready_keys))
+            handles = [self.first_handle(place_id, key) for place_id in self.place_ids]
+            found = tuple(handle for handle in handles if handle is not None)
+            if len(found) == len(handles):
+                return found
+            del self.ready_keys[key]
+        return None
+
+    def expired(self, places: dict[str, Place], remove=False) -> list[tuple[str, int]]:
+        """The place ids and handles of tokens that have waited longer than timeout, the first one unless remove."""
+        expired: list[tuple[str, int]] = []
+        if self.timeout is None:
+            return expired
+        self.refresh(places)
+        now = self.clock()
+        for place_id in self.place_ids:
+            arrivals, tokens = self.arrivals[place_id], self.indexed_tokens[place_id]
+            while arrivals and (not tokens.has_handle(arrivals[0][0]) or now - arrivals[0][1] > self.timeout):
+                handle, _ = arrivals[0]
+                if tokens.has_handle(handle):
+                    expired.append((place_id, handle))
+                    if not remove:
+                        return expired
+                arrivals.popleft()
+        return expired
+
+    def ready(self, places: dict[str, Place]) -> bool:
+        return self.match(places) is not None or len(self.expired(places)) > 0
+
+
 class SyncFiringFunctions:
 
     def move_and_transform_highest_priority_token(
@@ -202,9 +1153,10 @@ class SyncFiringFunctions:
         checks=True,
     ) -> tuple[dict[str, Place], dict[str, Place]]:
         """Remove one token from the input places and make a corresponding token in the output places."""
-        token_to_move, input_places_sans_token = RemoveToken.with_highest_priority(input_places)
-        if token_to_move is None:
+        selected = SelectToken.handle_with_highest_priority(input_places)
+        if selected is None:
             return input_places, output_places
+        token_to_move = input_places[selected[0]].tokens.get(selected[1])
         if checks:
             PetriNetCheck.token(token_to_move)
         new_token = transform_function(token_to_move)
@@ -215,12 +1167,13 @@ class SyncFiringFunctions:
             return input_places, output_places
         if checks:
             PetriNetCheck.token(new_token)
+        RemoveToken.by_handle(input_places, *selected)
         output_places_with_token = AddTokens.to_output_places(
             (new_token,),
             None,  # Output to all destinations.
             output_places
         )
-        return input_places_sans_token, output_places_with_token
+        return input_places, output_places_with_token
 
     def move_and_expand_highest_priority_token(
         input_places: dict[str, Place],
@@ -229,20 +1182,22 @@ class SyncFiringFunctions:
         checks=True,
     ) -> tuple[dict[str, Place], dict[str, Place]]:
         """Remove one token and make many tokens from it."""
-        token_to_move, input_places_sans_token = RemoveToken.with_highest_priority(input_places)
-        if token_to_move is None:
+        selected = SelectToken.handle_with_highest_priority(input_places)
+        if selected is None:
             return input_places, output_places
+        token_to_move = input_places[selected[0]].tokens.get(selected[1])
         if checks:
             PetriNetCheck.token(token_to_move)
         new_tokens = expand_function(token_to_move)
         if checks:
             PetriNetCheck.tokens(new_tokens)
+        RemoveToken.by_handle(input_places, *selected)
         output_places_with_tokens = AddTokens.to_output_places(
             new_tokens,
             None,  # Output to all destinations.
             output_places,
         )
-        return input_places_sans_token, output_places_with_tokens
+        return input_places, output_places_with_tokens
 
     def route_and_transform_highest_priority_token(
         input_places: dict[str, Place],
@@ -252,9 +1207,10 @@ class SyncFiringFunctions:
         checks=True,
     ) -> tuple[dict[str, Place], dict[str, Place]]:
         """Path a token to a destination place and transform the token."""
-        token_to_move, input_places_sans_token = RemoveToken.with_highest_priority(input_places)
-        if token_to_move is None:
+        selected = SelectToken.handle_with_highest_priority(input_places)
+        if selected is None:
             return input_places, output_places
+        token_to_move = input_places[selected[0]].tokens.get(selected[1])
         if checks:
             PetriNetCheck.token(token_to_move)
         new_token: Token = transform_function(token_to_move)
@@ -270,88 +1226,563 @@ class SyncFiringFunctions:
             for place_id in selected_place_ids:
                 if not isinstance(place_id, str):
                     raise ValueError(f"routing_function should return a tuple of str, not {type(place_id)}.")
+        RemoveToken.by_handle(input_places, *selected)
         output_places_with_token = AddTokens.to_output_places(
             (new_token,), selected_place_ids, output_places
         )
-        return input_places_sans_token, output_places_with_token
+        return input_places, output_places_with_token
+
+    def join_matching_tokens(
+        input_places: dict[str, Place],
+        output_places: dict[str, Place],
+        join: KeyedJoin,
+        join_function: Callable[[tuple[Token, ...]], Token],
+        expired_place_id: Optional[str] = None,
+        checks=True,
+    ) -> tuple[dict[str, Place], dict[str, Place]]:
+        """Move expired tokens to the expired place, then join the oldest tokens sharing a key across the places.
+
+        join_function receives one token from each of join.place_ids, in that order. Expired tokens are dropped if there
+        is no expired place.
+        """
+        expired = join.expired(input_places, remove=True)
+        if len(expired) > 0:
+            expired_tokens = tuple(RemoveToken.by_handle(input_places, *selected) for selected in expired)
+            if expired_place_id is not None:
+                PetriNetCheck.selected_places_exist((expired_place_id,), output_places)
+                output_places = AddTokens.to_output_places(expired_tokens, (expired_place_id,), output_places)
+        handles = join.match(input_places)
+        if handles is None:
+            return input_places, output_places
+        tokens_to_join = tuple(
+            input_places[place_id].tokens.get(handle) for place_id, handle in zip(join.place_ids, handles)
+        )
+        new_token = join_function(tokens_to_join)
+        if checks:
+            PetriNetCheck.token(new_token)
+        for place_id, handle in zip(join.place_ids, handles):
+            RemoveToken.by_handle(input_places, place_id, handle)
+        destinations = None if expired_place_id is None else tuple(
+            place_id for place_id in output_places if place_id != expired_place_id
+        )
+        output_places_with_token = AddTokens.to_output_places((new_token,), destinations, output_places)
+        return input_places, output_places_with_token
+
+
+class Lanes:
+    """Partition the input tokens of an async transition into lanes by key_function(token.data).
+
+    At most one firing per lane is in flight, so tokens with the same key are processed one after another, in order
+    of priority (the oldest first among equal priorities) or with order="fifo" in the order they were added. Firings
+    for different keys run concurrently, with the transition's maximum_concurrency capping the active lanes.
+    """
+
+    def __init__(self, key_function: Callable[[Any], Any], order: str = "priority"):
+        if order not in ("priority", "fifo"):
+            raise ValueError(f"order should be \"priority\" or \"fifo\", got \"{order}\".")
+        self.key_function = key_function
+        self.order = order
+        self.active: set[Any] = set()
+
+    def select(self, places: dict[str, Place]) -> Optional[tuple[str, int]]:
+        """The place id and handle of the next token of a lane without a firing in flight."""
+        selected, selected_priority = None, None
+        for place_id, place in places.items():
+            tokens = place.tokens.items() if self.order == "fifo" else place.tokens.in_priority_order()
+            for handle, token in tokens:
+                if self.key_function(token.data) not in self.active:
+                    if self.order == "fifo":
+                        return place_id, handle
+                    if selected_priority is None or token.priority > selected_priority:
+                        selected, selected_priority = (place_id, handle), token.priority
+                    break
+        return selected
+
+    def enter(self, token: Token) -> Any:
+        key = self.key_function(token.data)
+        self.active.add(key)
+        return key
+
+    def leave(self, key: Any) -> None:
+        self.active.discard(key)
+
+
+class RunSignals:
+    """Signals between AsyncPetriNet.run and the firings in flight that add tokens before they finish.
+
+    Firings set progress when they add tokens, so that run considers the transitions downstream of them. A firing that
+    waits for space in a full output place is woken whenever run starts or finishes a firing, and is let through even
+    though the place is full when every firing in flight is waiting.
+    """
+
+    def __init__(self):
+        self.progress = asyncio.Event()
+        self.waiting = 0
+        self.forced = False  # Until run next starts or finishes a firing.
+        self._changed: Optional[asyncio.Future] = None
+
+    def notify(self, force=False) -> None:
+        self.forced = force
+        if self._changed is not None and not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = None
+
+    async def wait_for_space(self, output_places: dict[str, Place], place_ids: Optional[tuple[str, ...]]) -> None:
+        while any(
+            PlaceCapacity.is_full(place) for place_id, place in output_places.items()
+            if place_ids is None or place_id in place_ids
+        ):
+            if self.forced:
+                return
+            if self._changed is None:
+                self._changed = asyncio.get_running_loop().create_future()
+            self.waiting += 1
+            try:
+                await asyncio.shield(self._changed)
+            finally:
+                self.waiting -= 1
+
+
+_run_signals: ContextVar[Optional[RunSignals]] = ContextVar("run_signals", default=None)
 
 
 class AsyncFiringFunctions:
+    """Async firing functions take their input token before awaiting, so concurrent firings select other tokens.
+
+    If the awaited function raises, or is cancelled, the token is put back in its input place.
+    A function that takes longer than timeout seconds is cancelled, and the token is moved unchanged to the
+    timeout place if one is given. Otherwise the asyncio.TimeoutError is raised like any other error.
+    """
+
+    def destinations_without(
+        output_places: dict[str, Place], timeout_place_id: Optional[str]
+    ) -> Optional[tuple[str, ...]]:
+        """All output places apart from the timeout place, None (meaning all of them) if there is no timeout place."""
+        if timeout_place_id is None:
+            return None
+        return tuple(place_id for place_id in output_places if place_id != timeout_place_id)
+
+    def to_timeout_place(
+        token: Token, timeout_place_id: str, output_places: dict[str, Place]
+    ) -> dict[str, Place]:
+        PetriNetCheck.selected_places_exist((timeout_place_id,), output_places)
+        return AddTokens.to_output_places((token,), (timeout_place_id,), output_places)
 
     async def move_and_transform_highest_priority_token(
         input_places: dict[str, Place],
         output_places: dict[str, Place],
-        transform_function: Callable[[Token], Token],
+        transform_function: Callable[[Token], Coroutine[Any, Any, Token]],
         checks=True,
+        timeout: Optional[float] = None,
+        timeout_place_id: Optional[str] = None,
+        lanes: Optional[Lanes] = None,
     ) -> tuple[dict[str, Place], dict[str, Place]]:
-        token_to_move, input_places_sans_token = RemoveToken.with_highest_priority(input_places)
-        if token_to_move is None:
+        selected = (lanes.select if lanes else SelectToken.handle_with_highest_priority)(input_places)
+        if selected is None:
             return input_places, output_places
-        if checks:
-            PetriNetCheck.token(token_to_move)
-        new_token = await transform_function(token_to_move)
-        if checks:
-            PetriNetCheck.token(new_token)
-        if new_token is None:
-            return input_places_sans_token, output_places
-        if checks:
-            PetriNetCheck.token(new_token)
-        output_places_with_token: dict[str, Place] = AddTokens.to_output_places(
-            tokens=(new_token,),
-            destination_place_ids=None,  # Output to all destinations.
-            output_places=output_places,
-        )
-        return input_places_sans_token, output_places_with_token
+        token_to_move = RemoveToken.by_handle(input_places, *selected)
+        lane = lanes.enter(token_to_move) if lanes else None
+        try:
+            if checks:
+                PetriNetCheck.token(token_to_move)
+            try:
+                new_token = await asyncio.wait_for(transform_function(token_to_move), timeout)
+            except asyncio.TimeoutError:
+                if timeout_place_id is None:
+                    input_places[selected[0]].tokens.add(token_to_move)
+                    raise
+                return input_places, AsyncFiringFunctions.to_timeout_place(
+                    token_to_move, timeout_place_id, output_places
+                )
+            except BaseException:
+                input_places[selected[0]].tokens.add(token_to_move)
+                raise
+            if checks:
+                PetriNetCheck.token(new_token)
+            if new_token is None:
+                return input_places, output_places
+            if checks:
+                PetriNetCheck.token(new_token)
+            output_places_with_token: dict[str, Place] = AddTokens.to_output_places(
+                tokens=(new_token,),
+                destination_place_ids=AsyncFiringFunctions.destinations_without(output_places, timeout_place_id),
+                output_places=output_places,
+            )
+            return input_places, output_places_with_token
+        finally:
+            if lanes:
+                lanes.leave(lane)
+
+    async def stream_to_output_places(
+        children: AsyncGenerator[Token, None],
+        output_places: dict[str, Place],
+        destination_place_ids: Optional[tuple[str, ...]],
+        checks=True,
+        counts: Optional[dict[str, int]] = None,
+    ) -> None:
+        """Add each token to the output places as it is yielded, pausing while a destination is full during run.
+
+        The number of tokens added so far is kept in counts["streamed"].
+        """
+        signals = _run_signals.get()
+        try:
+            async for child in children:
+                if checks:
+                    PetriNetCheck.token(child)
+                AddTokens.to_output_places((child,), destination_place_ids, output_places)
+                if counts is not None:
+                    counts["streamed"] = counts.get("streamed", 0) + 1
+                if signals is not None:
+                    signals.progress.set()
+                    await signals.wait_for_space(output_places, destination_place_ids)
+        finally:
+            await children.aclose()
 
     async def move_and_expand_highest_priority_token(
         input_places: dict[str, Place],
         output_places: dict[str, Place],
-        expand_function: Callable[[Any], Coroutine[Any, Any, tuple[Token, ...]]],
+        expand_function: Callable[[Token], Union[Coroutine[Any, Any, tuple[Token, ...]], AsyncGenerator[Token, None]]],
         checks=True,
+        timeout: Optional[float] = None,
+        timeout_place_id: Optional[str] = None,
+        lanes: Optional[Lanes] = None,
     ) -> tuple[dict[str, Place], dict[str, Place]]:
-        token_to_move, input_places_sans_token = RemoveToken.with_highest_priority(input_places)
-        if token_to_move is None:
+        """Remove one token and make many tokens from it.
+
+        If expand_function is an async generator, each token it yields is added to the output places straight away.
+        Tokens already yielded stay in the output places if the generator raises or times out, so the token they were
+        made from is not put back to be expanded again, it is moved to the timeout_place or dropped if there is none.
+        """
+        selected = (lanes.select if lanes else SelectToken.handle_with_highest_priority)(input_places)
+        if selected is None:
             return input_places, output_places
-        new_tokens = await expand_function(token_to_move)
-        if checks:
-            PetriNetCheck.tokens(new_tokens)
-        output_places_with_tokens = AddTokens.to_output_places(
-            new_tokens,
-            None,  # Output to all destinations.
-            output_places,
-        )
-        return input_places_sans_token, output_places_with_tokens
+        token_to_move = RemoveToken.by_handle(input_places, *selected)
+        lane = lanes.enter(token_to_move) if lanes else None
+        destination_place_ids = AsyncFiringFunctions.destinations_without(output_places, timeout_place_id)
+        counts = {"streamed": 0}
+        try:
+            try:
+                expanded = expand_function(token_to_move)
+                if isinstance(expanded, AsyncGenerator):
+                    await asyncio.wait_for(AsyncFiringFunctions.stream_to_output_places(
+                        expanded, output_places, destination_place_ids, checks, counts
+                    ), timeout)
+                    return input_places, output_places
+                new_tokens = await asyncio.wait_for(expanded, timeout)
+            except asyncio.TimeoutError:
+                if timeout_place_id is None:
+                    if counts["streamed"] == 0:
+                        input_places[selected[0]].tokens.add(token_to_move)
+                    raise
+                return input_places, AsyncFiringFunctions.to_timeout_place(
+                    token_to_move, timeout_place_id, output_places
+                )
+            except BaseException:
+                if counts["streamed"] == 0:
+                    input_places[selected[0]].tokens.add(token_to_move)
+                elif timeout_place_id is not None:
+                    AsyncFiringFunctions.to_timeout_place(token_to_move, timeout_place_id, output_places)
+                raise
+            if checks:
+                PetriNetCheck.tokens(new_tokens)
+            output_places_with_tokens = AddTokens.to_output_places(new_tokens, destination_place_ids, output_places)
+            return input_places, output_places_with_tokens
+        finally:
+            if lanes:
+                lanes.leave(lane)
 
     async def route_and_transform_highest_priority_token(
         input_places: dict[str, Place],
         output_places: dict[str, Place],
-        transform_function: Callable[[Token], Token],
+        transform_function: Callable[[Token], Coroutine[Any, Any, Token]],
         routing_function: Callable[[Token], tuple[str, ...]],
         checks=True,
+        timeout: Optional[float] = None,
+        timeout_place_id: Optional[str] = None,
+        lanes: Optional[Lanes] = None,
     ) -> tuple[dict[str, Place], dict[str, Place]]:
         """Path a token to a destination place and transform the token."""
-        token_to_move, input_places_sans_token = RemoveToken.with_highest_priority(input_places)
-        if token_to_move is None:
-            return input_places, output_places
-        if checks:
-            PetriNetCheck.token(token_to_move)
-        new_token = await transform_function(token_to_move)
-        if new_token is None:
+        selected = (lanes.select if lanes else SelectToken.handle_with_highest_priority)(input_places)
+        if selected is None:
             return input_places, output_places
-        if checks:
-            PetriNetCheck.token(new_token)
-        selected_place_ids: tuple[str, ...] = await routing_function(new_token)
-        PetriNetCheck.selected_places_exist(selected_place_ids, output_places)
-        if checks:
-            if not isinstance(selected_place_ids, tuple):
-                raise ValueError(f"routing_function should return a tuple, not {type(selected_place_ids)}.")
-            for place_id in selected_place_ids:
-                if not isinstance(place_id, str):
-                    raise ValueError(f"routing_function should return a tuple of str, not {type(place_id)}.")
-        output_places_with_token = AddTokens.to_output_places(
-            (new_token,), selected_place_ids, output_places
-        )
-        return input_places_sans_token, output_places_with_token
+        token_to_move = RemoveToken.by_handle(input_places, *selected)
+        lane = lanes.enter(token_to_move) if lanes else None
+        try:
+            if checks:
+                PetriNetCheck.token(token_to_move)
+            try:
+                try:
+                    new_token = await asyncio.wait_for(transform_function(token_to_move), timeout)
+                except asyncio.TimeoutError:
+                    if timeout_place_id is None:
+                        raise
+                    return input_places, AsyncFiringFunctions.to_timeout_place(
+                        token_to_move, timeout_place_id, output_places
+                    )
+                if new_token is None:  # The token is not consumed.
+                    input_places[selected[0]].tokens.add(token_to_move)
+                    return input_places, output_places
+                if checks:
+                    PetriNetCheck.token(new_token)
+                selected_place_ids: tuple[str, ...] = await routing_function(new_token)
+                PetriNetCheck.selected_places_exist(selected_place_ids, output_places)
+                if checks:
+                    if not isinstance(selected_place_ids, tuple):
+                        raise ValueError(f"routing_function should return a tuple, not {type(selected_place_ids)}.")
+                    for place_id in selected_place_ids:
+                        if not isinstance(place_id, str):
+                            raise ValueError(f"routing_function should return a tuple of str, not {type(place_id)}.")
+            except BaseException:
+                input_places[selected[0]].tokens.add(token_to_move)
+                raise
+            output_places_with_token = AddTokens.to_output_places(
+                (new_token,), selected_place_ids, output_places
+            )
+            return input_places, output_places_with_token
+        finally:
+            if lanes:
+                lanes.leave(lane)
+
+
+def _shared_result_for_token(token: Token, value: Any) -> Any:
+    """A flip or fork result made for another token with the same key, rebuilt as token with the result's data."""
+    if isinstance(value, Token):
+        return replace(token, data=value.data)
+    return value
+
+
+class TransformCache:
+    """Memoise the results of a transform by a key computed from Token.data.
+
+    The in-memory tier keeps at most maximum_size results, evicting the least recently used, and results older than
+    time_to_live seconds are discarded. With a path, results are also written to an SQLite file that survives restarts,
+    so they must be picklable. On a miss the transform's result is returned as it is. On a hit a flip or fork result,
+    made from a different token, gives the incoming token with the cached data, keeping its id, priority and times.
+    Hit and miss counts are kept in the attributes and returned by statistics().
+    """
+
+    def __init__(
+        self,
+        key_function: Callable[[Any], Any],
+        maximum_size: Optional[int] = 1024,
+        time_to_live: Optional[float] = None,
+        path: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.key_function = key_function
+        self.maximum_size = maximum_size
+        self.time_to_live = time_to_live
+        self.clock = clock
+        self.entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()  # Transforms run on the worker threads of ThreadedPetriNet share the cache.
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, stored_at REAL, value BLOB)"
+            )
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.time_to_live is not None and self.clock() - stored_at > self.time_to_live
+
+    def _remember(self, key: Any, stored_at: float, value: Any) -> None:
+        self.entries[key] = (stored_at, value)
+        self.entries.move_to_end(key)
+        if self.maximum_size is not None and len(self.entries) > self.maximum_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: Any) -> tuple[bool, Any]:
+        """Return whether the key was found and the cached result."""
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key: Any) -> tuple[bool, Any]:
+        if key in self.entries:
+            stored_at, value = self.entries[key]
+            if not self._expired(stored_at):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self.entries[key]
+            self.evictions += 1
+        if self.connection is not None:
+            row = self.connection.execute(
+                "SELECT stored_at, value FROM results WHERE key = ?", (pickle.dumps(key),)
+            ).fetchone()
+            if row is not None and not self._expired(row[0]):
+                value = pickle.loads(row[1])
+                self._remember(key, row[0], value)
+                self.disk_hits += 1
+                return True, value
+        self.misses += 1
+        return False, None
+
+    def put(self, key: Any, value: Any) -> None:
+        with self.lock:
+            stored_at = self.clock()
+            self._remember(key, stored_at, value)
+            if self.connection is not None:
+                with self.connection:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                        (pickle.dumps(key), stored_at, pickle.dumps(value)),
+                    )
+
+    def statistics(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+        }
+
+    def cached(self, function: Callable[[Token], Any], keep_incoming_id=True) -> Callable[[Token], Any]:
+        def cached_function(token: Token) -> Any:
+            key = self.key_function(token.data)
+            found, value = self.get(key)
+            if found:
+                return _shared_result_for_token(token, value) if keep_incoming_id else value
+            value = function(token)
+            if value is not None:  # A transform returning None leaves the token in place, so it is not cached.
+                self.put(key, value)
+            return value
+        return cached_function
+
+    def cached_async(
+        self, function: Callable[[Token], Coroutine[Any, Any, Any]], keep_incoming_id=True
+    ) -> Callable[[Token], Coroutine[Any, Any, Any]]:
+        async def cached_function(token: Token) -> Any:
+            key = self.key_function(token.data)
+            found, value = self.get(key)
+            if found:
+                return _shared_result_for_token(token, value) if keep_incoming_id else value
+            value = await function(token)
+            if value is not None:
+                self.put(key, value)
+            return value
+        return cached_function
+
+
+class SingleFlight:
+    """Coalesce concurrent calls of an async transform for tokens with equal keys into one call.
+
+    The token that started the call gets the result as it is. Each other waiting token still gets its own result, for
+    flip and fork transforms that token itself with the shared result's data.
+    The shared call is cancelled if every token waiting on it is cancelled.
+    """
+
+    def __init__(self, key_function: Callable[[Any], Any]):
+        self.key_function = key_function
+        self.in_flight: dict[Any, asyncio.Task] = {}
+        self.waiters: dict[Any, int] = {}
+        self.calls = 0
+        self.coalesced_calls = 0
+
+    def _forget(self, key: Any, task: asyncio.Task) -> None:
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+            del self.waiters[key]
+
+    def coalesced(
+        self, function: Callable[[Token], Coroutine[Any, Any, Any]], keep_incoming_id=True
+    ) -> Callable[[Token], Coroutine[Any, Any, Any]]:
+        async def coalesced_function(token: Token) -> Any:
+            key = self.key_function(token.data)
+            task = self.in_flight.get(key)
+            started = task is None
+            if task is None:
+                task = asyncio.ensure_future(function(token))
+                task.add_done_callback(lambda _: self._forget(key, task))
+                self.in_flight[key] = task
+                self.waiters[key] = 0
+                self.calls += 1
+            else:
+                self.coalesced_calls += 1
+            self.waiters[key] += 1
+            try:
+                value = await asyncio.shield(task)
+            finally:
+                if self.in_flight.get(key) is task:
+                    self.waiters[key] -= 1
+                    if self.waiters[key] == 0 and not task.done():  # Nobody is waiting for the result any more.
+                        self._forget(key, task)
+                        task.cancel()
+            if started or not keep_incoming_id:
+                return value
+            return _shared_result_for_token(token, value)
+        return coalesced_function
+
+
+class Hedge:
+    """Start a second attempt of a slow async transform and keep whichever attempt finishes first.
+
+    The second attempt starts once the first has run for longer than the given percentile of the latencies of recent
+    successful calls. Until minimum_samples latencies have been observed it starts after delay seconds, or never if
+    delay is None. The losing attempt is cancelled, so transforms should be safe to run twice.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        history_size: int = 100,
+        minimum_samples: int = 10,
+        delay: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not 0 < percentile <= 1:
+            raise ValueError(f"percentile should be in (0, 1], got {percentile}.")
+        self.percentile = percentile
+        self.minimum_samples = minimum_samples
+        self.delay = delay
+        self.clock = clock
+        self.latencies: deque[float] = deque(maxlen=history_size)
+        self.calls = 0
+        self.hedged_calls = 0
+        self.hedge_wins = 0
+
+    def threshold(self) -> Optional[float]:
+        """Seconds after which a second attempt is started."""
+        if len(self.latencies) < max(1, self.minimum_samples):
+            return self.delay
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def hedged(
+        self, function: Callable[[Token], Coroutine[Any, Any, Any]]
+    ) -> Callable[[Token], Coroutine[Any, Any, Any]]:
+        async def hedged_function(token: Token) -> Any:
+            self.calls += 1
+            first = asyncio.ensure_future(function(token))
+            started = {first: self.clock()}
+            attempts = {first}
+            try:
+                done, _ = await asyncio.wait(attempts, timeout=self.threshold())
+                if len(done) == 0:
+                    second = asyncio.ensure_future(function(token))
+                    started[second] = self.clock()
+                    attempts.add(second)
+                    self.hedged_calls += 1
+                while True:
+                    done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                    succeeded = [attempt for attempt in done if attempt.exception() is None]
+                    if len(succeeded) > 0 or len(attempts) == 0:  # Otherwise wait for the other attempt.
+                        winner = succeeded[0] if len(succeeded) > 0 else done.pop()
+                        break
+                value = winner.result()
+                self.latencies.append(self.clock() - started[winner])
+                if winner is not first:
+                    self.hedge_wins += 1
+                return value
+            finally:
+                for attempt in attempts:
+                    attempt.cancel()
+        return hedged_function
 
 
 class TransitionMaking:
@@ -379,8 +1810,11 @@ class SyncTransition:
         priority: Optional[int] = None,
         priority_function: Optional[Callable[[dict[str, Place], dict[str, Place]], int]] = None,
         name: Optional[str] = None,
+        cache: Optional[TransformCache] = None,
     ) -> Transition:
         """Remove a token from an input place and add a token to the output place, transforming the data."""
+        if cache is not None:
+            transform_function = cache.cached(transform_function)
         return Transition(
             id=id,
             name=name if name is not None else id,
@@ -389,6 +1823,7 @@ class SyncTransition:
             ),
             maximum_firings=maximum_firings,
             priority_function=TransitionMaking.priority_function_from_args(priority, priority_function),
+            transform_function=transform_function,
         )
 
     def fork(
@@ -399,11 +1834,14 @@ class SyncTransition:
         priority: Optional[int] = None,
         priority_function: Optional[Callable[[dict[str, Place], dict[str, Place]], int]] = None,
         name: Optional[str] = None,
+        cache: Optional[TransformCache] = None,
     ) -> Transition:
         """Remove a token from the input places, transform data, and add tokens to output places.
 
         The routing function is applied to the transformed token to determine which output places to add tokens to.
         """
+        if cache is not None:
+            transform_function = cache.cached(transform_function)
         return Transition(
             id=id,
             name=name if name is not None else id,
@@ -421,8 +1859,11 @@ class SyncTransition:
         priority: Optional[int] = None,
         priority_function: Optional[Callable[[dict[str, Place], dict[str, Place]], int]] = None,
         name: Optional[str] = None,
+        cache: Optional[TransformCache] = None,
     ) -> Transition:
         """Remove a token from the input places and add multiple tokens to the output places."""
+        if cache is not None:
+            expand_function = cache.cached(expand_function, keep_incoming_id=False)
         return Transition(
             id=id,
             name=name if name is not None else id,
@@ -433,19 +1874,75 @@ class SyncTransition:
             priority_function=TransitionMaking.priority_function_from_args(priority, priority_function),
         )
 
+    def join(
+        id: str,
+        place_ids: tuple[str, ...],
+        key_function: Callable[[Any], Any],
+        join_function: Callable[[tuple[Token, ...]], Token],
+        maximum_firings: Optional[int] = 1,
+        priority: Optional[int] = None,
+        priority_function: Optional[Callable[[dict[str, Place], dict[str, Place]], int]] = None,
+        name: Optional[str] = None,
+        timeout: Optional[float] = None,
+        expired_place: Optional[str] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> Transition:
+        """Remove one token with the same key_function(token.data) from each of the input places place_ids and add
+        the token made from them by join_function to the output places.
+
+        Tokens left unmatched for timeout seconds are moved to the expired_place output, which does not receive joined
+        tokens. The transition is only enabled while there is a match or an expired token.
+        """
+        join = KeyedJoin(key_function, place_ids, timeout=timeout, clock=clock)
+        base_priority_function = TransitionMaking.priority_function_from_args(priority, priority_function)
+        return Transition(
+            id=id,
+            name=name if name is not None else id,
+            fire=lambda input_places, output_places: SyncFiringFunctions.join_matching_tokens(
+                input_places, output_places, join=join, join_function=join_function, expired_place_id=expired_place,
+            ),
+            maximum_firings=maximum_firings,
+            priority_function=lambda input_places, output_places: (
+                base_priority_function(input_places, output_places) if join.ready(input_places) else 0
+            ),
+            single_token=False,
+        )
+
 
 class AsyncTransition:
-    """Wrappers to reduce the amount of syntax needed when declaring Transitions."""
+    """Wrappers to reduce the amount of syntax needed when declaring Transitions.
+
+    Firings hold the named resource_pools of the net while in flight, at most maximum_concurrency at a time.
+    A transform running longer than timeout seconds is cancelled and its token moved to the timeout_place output,
+    which does not receive transformed tokens. A hedge starts a second attempt of transforms that run slow.
+    With lanes, tokens sharing a lane key are fired one at a time in order, while different lanes run concurrently.
+    """
 
     def flip(
         id: str,
-        async_transform_function: Callable[[Token], Token],
+        async_transform_function: Callable[[Token], Coroutine[Any, Any, Token]],
         maximum_firings: Optional[int] = 1,
         priority: Optional[int] = None,
         priority_function: Optional[Callable[[dict[str, Place], dict[str, Place]], int]] = None,
         name: Optional[str] = None,
+        resource_pools: tuple[str, ...] = (),
+        maximum_concurrency: Optional[int] = None,
+        cache: Optional[TransformCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        timeout: Optional[float] = None,
+        timeout_place: Optional[str] = None,
+        hedge: Optional[Hedge] = None,
+        lanes: Optional[Lanes] = None,
     ) -> Transition:
         """Remove a token from an input place and add a token to the output place, transforming the data."""
+        if timeout is not None and timeout <= 0:
+            raise ValueError(f"timeout should be positive, got {timeout}.")
+        if hedge is not None:
+            async_transform_function = hedge.hedged(async_transform_function)
+        if single_flight is not None:
+            async_transform_function = single_flight.coalesced(async_transform_function)
+        if cache is not None:
+            async_transform_function = cache.cached_async(async_transform_function)
 
         async def async_fire(
             input_places: dict[str, Place],
@@ -453,6 +1950,7 @@ class AsyncTransition:
         ) -> tuple[dict[str, Place], dict[str, Place]]:
             return await AsyncFiringFunctions.move_and_transform_highest_priority_token(
                 input_places, output_places, transform_function=async_transform_function,
+                timeout=timeout, timeout_place_id=timeout_place, lanes=lanes,
             )
 
         return Transition(
@@ -461,21 +1959,39 @@ class AsyncTransition:
             fire=async_fire,
             maximum_firings=maximum_firings,
             priority_function=TransitionMaking.priority_function_from_args(priority, priority_function),
+            resource_pool_ids=resource_pools,
+            maximum_concurrency=maximum_concurrency,
         )
 
     def fork(
         id: str,
-        async_transform_function: Callable[[Token], Token],
+        async_transform_function: Callable[[Token], Coroutine[Any, Any, Token]],
         async_routing_function: Callable[[Token], tuple[str, ...]],
         maximum_firings: Optional[int] = 1,
         priority: Optional[int] = None,
         priority_function: Optional[Callable[[dict[str, Place], dict[str, Place]], int]] = None,
         name: Optional[str] = None,
+        resource_pools: tuple[str, ...] = (),
+        maximum_concurrency: Optional[int] = None,
+        cache: Optional[TransformCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        timeout: Optional[float] = None,
+        timeout_place: Optional[str] = None,
+        hedge: Optional[Hedge] = None,
+        lanes: Optional[Lanes] = None,
     ) -> Transition:
         """Remove a token from the input places, transform data, and add tokens to output places.
 
         The routing function is applied to the transformed token to determine which output places to add tokens to.
         """
+        if timeout is not None and timeout <= 0:
+            raise ValueError(f"timeout should be positive, got {timeout}.")
+        if hedge is not None:
+            async_transform_function = hedge.hedged(async_transform_function)
+        if single_flight is not None:
+            async_transform_function = single_flight.coalesced(async_transform_function)
+        if cache is not None:
+            async_transform_function = cache.cached_async(async_transform_function)
 
         async def async_fire(
             input_places: dict[str, Place],
@@ -486,6 +2002,9 @@ class AsyncTransition:
                 output_places,
                 transform_function=async_transform_function,
                 routing_function=async_routing_function,
+                timeout=timeout,
+                timeout_place_id=timeout_place,
+                lanes=lanes,
             )
 
         return Transition(
@@ -495,17 +2014,45 @@ class AsyncTransition:
             maximum_firings=maximum_firings,
             firings_count=0,
             priority_function=TransitionMaking.priority_function_from_args(priority, priority_function),
+            resource_pool_ids=resource_pools,
+            maximum_concurrency=maximum_concurrency,
         )
 
     def expand(
         id: str,
-        async_expand_function: Callable[[Token], Coroutine[Any, Any, tuple[Token, ...]]],
+        async_expand_function: Callable[
+            [Token], Union[Coroutine[Any, Any, tuple[Token, ...]], AsyncGenerator[Token, None]]
+        ],
         maximum_firings: Optional[int] = 1,
         priority: Optional[int] = None,
         priority_function: Optional[Callable[[dict[str, Place], dict[str, Place]], int]] = None,
         name: Optional[str] = None,
+        resource_pools: tuple[str, ...] = (),
+        maximum_concurrency: Optional[int] = None,
+        cache: Optional[TransformCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        timeout: Optional[float] = None,
+        timeout_place: Optional[str] = None,
+        hedge: Optional[Hedge] = None,
+        lanes: Optional[Lanes] = None,
     ) -> Transition:
-        """Remove a token from the input places and add multiple tokens to the output places."""
+        """Remove a token from the input places and add multiple tokens to the output places.
+
+        An async generator expand function streams its tokens, each becoming available downstream as it is yielded.
+        """
+        if timeout is not None and timeout <= 0:
+            raise ValueError(f"timeout should be positive, got {timeout}.")
+        if cache is not None or single_flight is not None or hedge is not None:
+            if inspect.isasyncgenfunction(async_expand_function):
+                raise ValueError("cache, single_flight and hedge need an expand function returning a tuple of tokens.")
+            coroutine_function = cast(Callable[[Token], Coroutine[Any, Any, tuple[Token, ...]]], async_expand_function)
+            if hedge is not None:
+                coroutine_function = hedge.hedged(coroutine_function)
+            if single_flight is not None:
+                coroutine_function = single_flight.coalesced(coroutine_function, keep_incoming_id=False)
+            if cache is not None:
+                coroutine_function = cache.cached_async(coroutine_function, keep_incoming_id=False)
+            async_expand_function = coroutine_function
 
         async def async_fire(
             input_places: dict[str, Place],
@@ -513,6 +2060,7 @@ class AsyncTransition:
         ) -> tuple[dict[str, Place], dict[str, Place]]:
             return await AsyncFiringFunctions.move_and_expand_highest_priority_token(
                 input_places, output_places, expand_function=async_expand_function,
+                timeout=timeout, timeout_place_id=timeout_place, lanes=lanes,
             )
 
         return Transition(
@@ -522,49 +2070,256 @@ class AsyncTransition:
             maximum_firings=maximum_firings,
             firings_count=0,
             priority_function=TransitionMaking.priority_function_from_args(priority, priority_function),
+            resource_pool_ids=resource_pools,
+            maximum_concurrency=maximum_concurrency,
         )
 
 
 class PetriNetOperations:
 
+    def arc_index(net: PetriNet) -> ArcIndex:
+        """Return the cached place ids connected to each transition, rebuilding it if the arcs or places changed."""
+        index = net.arc_index
+        if (
+            index is not None
+            and index.arcs_in is net.arcs_in and index.arcs_in_version == _version(net.arcs_in)
+            and index.arcs_out is net.arcs_out and index.arcs_out_version == _version(net.arcs_out)
+            and index.places is net.places and index.places_version == _version(net.places)
+        ):
+            return index
+        incoming: dict[str, set[str]] = {}
+        for arc_in in net.arcs_in:
+            incoming.setdefault(arc_in.transition_id, set()).add(arc_in.place_id)
+        outgoing: dict[str, set[str]] = {}
+        for arc_out in net.arcs_out:
+            outgoing.setdefault(arc_out.transition_id, set()).add(arc_out.place_id)
+        index = ArcIndex(
+            arcs_in=net.arcs_in,
+            arcs_out=net.arcs_out,
+            places=net.places,
+            arcs_in_version=_version(net.arcs_in),
+            arcs_out_version=_version(net.arcs_out),
+            places_version=_version(net.places),
+            incoming_place_ids={
+                transition_id: tuple(place_id for place_id in net.places if place_id in place_ids)
+                for transition_id, place_ids in incoming.items()
+            },
+            outgoing_place_ids={
+                transition_id: tuple(place_id for place_id in net.places if place_id in place_ids)
+                for transition_id, place_ids in outgoing.items()
+            },
+            outgoing_arc_place_ids={
+                transition_id: tuple(place_ids) for transition_id, place_ids in outgoing.items()
+            },
+        )
+        net.arc_index = index
+        return index
+
     def collect_incoming_places(net: PetriNet, transition: Transition, run_checks=True) -> dict[str, Place]:
-        arcs_to_transition = (arc for arc in net.arcs_in if arc.transition_id == transition.id)
-        arc_place_ids = tuple(arc.place_id for arc in arcs_to_transition)
-        places = {
-            place_id: place for place_id, place in net.places.items()
-            if place.id in arc_place_ids  # place_id and place.id should be the same.
-        }
+        place_ids = PetriNetOperations.arc_index(net).incoming_place_ids.get(transition.id, ())
+        places = {place_id: net.places[place_id] for place_id in place_ids}
         if run_checks:
             PetriNetCheck.places(places.values())
         return places
 
     def collect_outgoing_places(net: PetriNet, transition: Transition, run_checks=True) -> dict[str, Place]:
-        arcs_from_transition = (arc for arc in net.arcs_out if arc.transition_id == transition.id)
-        arc_place_ids = tuple(arc.place_id for arc in arcs_from_transition)
+        index = PetriNetOperations.arc_index(net)
         # Check that the places exist.
         if run_checks:
-            PetriNetCheck.selected_places_exist(arc_place_ids, net.places)
-        places = {
-            place_id: place for place_id, place in net.places.items()
-            if place.id in arc_place_ids  # place_id and place.id should be the same.
-        }
+            PetriNetCheck.selected_places_exist(index.outgoing_arc_place_ids.get(transition.id, ()), net.places)
+        places = {place_id: net.places[place_id] for place_id in index.outgoing_place_ids.get(transition.id, ())}
         if run_checks:
             PetriNetCheck.places(places.values())
         return places
 
     def transition_priorities(petri_net: PetriNet) -> dict[str, int]:
-        """Use the transition_function associated with each transition to calculate its priority."""
+        """Use the transition_function associated with each transition to calculate its priority.
+
+        Transitions with a full output place are given a priority of zero until downstream transitions drain it.
+        A CountPriorityFunction is evaluated from the token counts of the input places without collecting them.
+        """
         priorities = {}
         for transition in petri_net.transitions.values():
-            if transition.priority_function is not None:
-                priority = transition.priority_function(
-                    PetriNetOperations.collect_incoming_places(petri_net, transition),
-                    PetriNetOperations.collect_outgoing_places(petri_net, transition),
-                )
+            priority = PetriNetOperations.transition_priority(petri_net, transition)
+            if priority is not None:
                 priorities[transition.id] = priority
         # Return an ordered dictionary sorted by priority values.
         return dict(sorted(priorities.items(), key=lambda item: item[1]))
 
+    def transition_priority(petri_net: PetriNet, transition: Transition, check_resources=True) -> Optional[int]:
+        """The priority of one transition, zero if it is blocked and None if it has no priority function."""
+        priority_function = transition.priority_function
+        if priority_function is None:
+            return None
+        index = PetriNetOperations.arc_index(petri_net)
+        places = petri_net.places
+        if any(PlaceCapacity.is_full(places[place_id]) for place_id in index.outgoing_place_ids.get(transition.id, ())):
+            return 0
+        if check_resources and not PetriNetOperations.resources_available(petri_net, transition):
+            return 0
+        if isinstance(priority_function, CountPriorityFunction):
+            count = sum(len(places[place_id].tokens) for place_id in index.incoming_place_ids.get(transition.id, ()))
+            return priority_function.from_input_token_count(count)
+        # The places are checked when the transition fires, so they are not checked on every priority evaluation.
+        return priority_function(
+            PetriNetOperations.collect_incoming_places(petri_net, transition, run_checks=False),
+            PetriNetOperations.collect_outgoing_places(petri_net, transition, run_checks=False),
+        )
+
+    def resources_available(petri_net: PetriNet, transition: Transition) -> bool:
+        if (
+            transition.maximum_concurrency is not None
+            and petri_net.firings_in_flight.get(transition.id, 0) >= transition.maximum_concurrency
+        ):
+            return False
+        return all(petri_net.resource_pools[pool_id].available() for pool_id in transition.resource_pool_ids)
+
+    def seconds_until_resources_available(petri_net: PetriNet) -> Optional[float]:
+        """How long until a transition that only waits on its resource pools can fire, None if none are waiting."""
+        delays = []
+        for transition in petri_net.transitions.values():
+            if PetriNetOperations.resources_available(petri_net, transition):
+                continue
+            if (PetriNetOperations.transition_priority(petri_net, transition, check_resources=False) or 0) <= 0:
+                continue
+            pools = (petri_net.resource_pools[pool_id] for pool_id in transition.resource_pool_ids)
+            pool_delays = tuple(pool.seconds_until_available() for pool in pools if not pool.available())
+            known_delays = [delay for delay in pool_delays if delay is not None]
+            if len(pool_delays) > 0 and len(known_delays) == len(pool_delays):
+                delays.append(max(known_delays))
+        return min(delays) if delays else None
+
+    def resource_metrics(petri_net: PetriNet) -> dict[str, dict[str, float]]:
+        """The metrics of each resource pool, e.g. the current limit of an AdaptiveConcurrencyLimit."""
+        return {pool_id: pool.metrics() for pool_id, pool in petri_net.resource_pools.items()}
+
+    def shed_load(petri_net: PetriNet, place_ids: Optional[Iterable[str]] = None) -> dict[str, tuple[Token, ...]]:
+        """Apply the shed policies of the places (all of them by default), returning the tokens shed by place.
+
+        The engines call this for the output places of each firing, call it directly for places filled from outside.
+        """
+        places = petri_net.places
+        removed: dict[str, tuple[Token, ...]] = {}
+        added: dict[str, tuple[Token, ...]] = {}
+        for place_id in (places if place_ids is None else place_ids):
+            policy = places[place_id].shed_policy
+            if policy is None:
+                continue
+            shed = policy.select(places[place_id].tokens)
+            if len(shed) == 0:
+                continue
+            tokens = tuple(places[place_id].tokens.remove(handle) for handle, _ in shed)
+            removed[place_id] = tokens
+            if policy.shed_place is not None:
+                places[policy.shed_place].tokens.extend(tokens)
+                added[policy.shed_place] = added.get(policy.shed_place, ()) + tokens
+        if len(removed) > 0 and len(petri_net.delta_subscribers) > 0:
+            delta = StepDelta(None, removed, added, time.monotonic(), time.monotonic())
+            for subscriber in tuple(petri_net.delta_subscribers):
+                subscriber(delta)
+        return removed
+
+    def release_timed_tokens(petri_net: PetriNet) -> tuple[bool, Optional[float]]:
+        """Add the held back tokens that are due and move expired tokens to the dead-letter place of their place.
+
+        Returns whether any tokens were released or expired, and the next time on the net's clock that a token is
+        due or expires, None if there are no timed tokens. The engines call this before selecting a transition.
+        """
+        places = petri_net.places
+        now, next_due = None, None
+        added: dict[str, tuple[Token, ...]] = {}
+        removed: dict[str, tuple[Token, ...]] = {}
+        for place_id, place in places.items():
+            due = place.tokens.next_due()
+            if due is None:
+                continue
+            if now is None:
+                now = petri_net.clock()
+            if due <= now:
+                released, expired = place.tokens.release_due(now)
+                if len(released) > 0:
+                    added[place_id] = added.get(place_id, ()) + tuple(released)
+                if len(expired) > 0:
+                    removed[place_id] = tuple(expired)
+                    if place.dead_letter_place is not None:
+                        dead = tuple(replace(token, not_before=None, expires_at=None) for token in expired)
+                        places[place.dead_letter_place].tokens.extend(dead)
+                        added[place.dead_letter_place] = added.get(place.dead_letter_place, ()) + dead
+                due = place.tokens.next_due()
+            if due is not None and (next_due is None or due < next_due):
+                next_due = due
+        if (len(added) > 0 or len(removed) > 0) and len(petri_net.delta_subscribers) > 0:
+            delta = StepDelta(None, removed, added, time.monotonic(), time.monotonic())
+            for subscriber in tuple(petri_net.delta_subscribers):
+                subscriber(delta)
+        return len(added) > 0 or len(removed) > 0, next_due
+
+    def shed_counts(petri_net: PetriNet) -> dict[str, dict[str, int]]:
+        """The number of tokens shed from each place with a ShedPolicy, by the limit exceeded."""
+        return {
+            place_id: dict(place.shed_policy.shed_counts)
+            for place_id, place in petri_net.places.items() if place.shed_policy is not None
+        }
+
+    def acquire_resources(petri_net: PetriNet, transition: Transition) -> dict[str, Any]:
+        petri_net.firings_in_flight[transition.id] = petri_net.firings_in_flight.get(transition.id, 0) + 1
+        return {pool_id: petri_net.resource_pools[pool_id].acquire() for pool_id in transition.resource_pool_ids}
+
+    def release_resources(
+        petri_net: PetriNet,
+        transition: Transition,
+        resources: dict[str, Any],
+        latency: float,
+        error: Optional[BaseException],
+    ) -> None:
+        in_flight = petri_net.firings_in_flight[transition.id] - 1
+        if in_flight > 0:
+            petri_net.firings_in_flight[transition.id] = in_flight
+        else:
+            del petri_net.firings_in_flight[transition.id]
+        for pool_id, resource in resources.items():
+            petri_net.resource_pools[pool_id].release(resource, latency, error)
+
+    def bounded_outgoing_place_ids(petri_net: PetriNet, transition: Transition) -> tuple[str, ...]:
+        """The output places of the transition that have a capacity."""
+        return tuple(
+            place_id for place_id in PetriNetOperations.arc_index(petri_net).outgoing_place_ids.get(transition.id, ())
+            if petri_net.places[place_id].capacity is not None
+        )
+
+    def outputs_full(petri_net: PetriNet, place_ids: Iterable[str], reserved_outputs: dict[str, int]) -> bool:
+        """Whether any of the places is full once the firings in flight that output to it have added their tokens.
+
+        Engines running firings concurrently keep reserved_outputs, the count of firings in flight by bounded output
+        place, as the capacity check of the priority functions only sees the tokens already in the places.
+        """
+        return any(
+            PlaceCapacity.is_full(petri_net.places[place_id], reserved_outputs.get(place_id, 0))
+            for place_id in place_ids
+        )
+
+    def reserve_outputs(reserved_outputs: dict[str, int], place_ids: Iterable[str]) -> None:
+        for place_id in place_ids:
+            reserved_outputs[place_id] = reserved_outputs.get(place_id, 0) + 1
+
+    def release_outputs(reserved_outputs: dict[str, int], place_ids: Iterable[str]) -> None:
+        for place_id in place_ids:
+            reserved_outputs[place_id] -= 1
+            if reserved_outputs[place_id] == 0:
+                del reserved_outputs[place_id]
+
+    def without_transitions(petri_net: PetriNet, transition_ids: set[str]) -> PetriNet:
+        """A view of the net, sharing its places and state, in which the given transitions can not be selected."""
+        return PetriNet(
+            places=petri_net.places,
+            transitions={k: t for k, t in petri_net.transitions.items() if k not in transition_ids},
+            arcs_in=petri_net.arcs_in,
+            arcs_out=petri_net.arcs_out,
+            arc_index=petri_net.arc_index,
+            resource_pools=petri_net.resource_pools,
+            firings_in_flight=petri_net.firings_in_flight,
+        )
+
     def prepare_transition_firing(
         net: PetriNet,
         transition_selection_function: Callable[[PetriNet], Optional[Transition]],
@@ -581,13 +2336,74 @@ class PetriNetOperations:
             )
         return transition, incoming_places, outgoing_places
 
+    def snapshot_places(places: dict[str, Place]) -> dict[str, tuple[Place, PlaceTokens, int]]:
+        return {place_id: (place, place.tokens, place.tokens.version) for place_id, place in places.items()}
+
+    def places_changed(snapshot: dict[str, tuple[Place, PlaceTokens, int]], places: dict[str, Place]) -> bool:
+        """Check whether a firing changed the places, either in place or by returning different places."""
+        if snapshot.keys() != places.keys():
+            return True
+        for place_id, place in places.items():
+            previous_place, previous_tokens, previous_version = snapshot[place_id]
+            if place is previous_place and place.tokens is previous_tokens:
+                if place.tokens.version != previous_version:
+                    return True
+            elif place != previous_place or place.tokens != previous_tokens:
+                return True
+        return False
+
+    def subscribe(net: PetriNet, subscriber: Callable[[StepDelta], None]) -> Callable[[StepDelta], None]:
+        """Call subscriber with the StepDelta of every firing that changes the net."""
+        net.delta_subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(net: PetriNet, subscriber: Callable[[StepDelta], None]) -> None:
+        net.delta_subscribers.remove(subscriber)
+
+    def step_delta(
+        transition_id: str,
+        changes: TokenChanges,
+        snapshot: dict[str, tuple[Place, PlaceTokens, int]],
+        places: dict[str, Place],
+        started: Optional[float] = None,
+    ) -> StepDelta:
+        """Build the delta from the recorded changes, comparing contents for places whose tokens were replaced."""
+        removed, added = {}, {}
+        for place_id, place in places.items():
+            previous_tokens = snapshot[place_id][1] if place_id in snapshot else PlaceTokens()
+            if place.tokens is previous_tokens:
+                place_removed = tuple(changes.removed.get(id(previous_tokens), ()))
+                place_added = tuple(changes.added.get(id(previous_tokens), ()))
+            else:
+                previous_counts, counts = Counter(previous_tokens), Counter(place.tokens)
+                place_removed = tuple((previous_counts - counts).elements())
+                place_added = tuple((counts - previous_counts).elements())
+            if len(place_removed) > 0:
+                removed[place_id] = place_removed
+            if len(place_added) > 0:
+                added[place_id] = place_added
+        return StepDelta(transition_id, removed, added, started, time.monotonic())
+
+    def publish_delta(
+        petri_net: PetriNet,
+        transition: Transition,
+        changes: TokenChanges,
+        snapshot: dict[str, tuple[Place, PlaceTokens, int]],
+        places: dict[str, Place],
+        started: Optional[float] = None,
+    ) -> None:
+        delta = PetriNetOperations.step_delta(transition.id, changes, snapshot, places, started)
+        for subscriber in tuple(petri_net.delta_subscribers):
+            subscriber(delta)
+
     def update_net(
         petri_net: PetriNet,
         transition: Transition,
         new_incoming_places: dict[str, Place],
         new_outgoing_places: dict[str, Place],
     ) -> None:
-        new_transition = deepcopy(transition)
+        # Start from the transition in the net, concurrent firings of it may have finished since this one started.
+        new_transition = deepcopy(petri_net.transitions.get(transition.id, transition))
         new_transition.firings_count += 1
         petri_net.transitions[transition.id] = new_transition
         # Update incoming places
@@ -607,17 +2423,46 @@ class SyncPetriNet:
         run_checks=True,
         verbose=True,
     ) -> bool:  # The boolean indicates whether a transition was fired.
+        PetriNetOperations.release_timed_tokens(petri_net)
         transition, incoming_places, outgoing_places = PetriNetOperations.prepare_transition_firing(
             petri_net, transition_selection_function, run_checks=run_checks
         )
         if transition is None:  # No transition to fire so the petri net remains unchanged.
             return False
-        new_incoming_places, new_outgoing_places = transition.fire(incoming_places, outgoing_places)
-        if new_incoming_places == incoming_places and new_outgoing_places == outgoing_places:
+        incoming_snapshot = PetriNetOperations.snapshot_places(incoming_places)
+        outgoing_snapshot = PetriNetOperations.snapshot_places(outgoing_places)
+        changes = TokenChanges() if len(petri_net.delta_subscribers) > 0 else None
+        resources = PetriNetOperations.acquire_resources(petri_net, transition)
+        context = _acquired_resources.set(resources)
+        changes_context = _token_changes.set(changes)
+        started, error = time.monotonic(), None
+        try:
+            new_incoming_places, new_outgoing_places = transition.fire(incoming_places, outgoing_places)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _token_changes.reset(changes_context)
+            _acquired_resources.reset(context)
+            PetriNetOperations.release_resources(petri_net, transition, resources, time.monotonic() - started, error)
+        if not (
+            PetriNetOperations.places_changed(incoming_snapshot, new_incoming_places)
+            or PetriNetOperations.places_changed(outgoing_snapshot, new_outgoing_places)
+        ):
             if verbose:
                 print(f"Transition {transition.id} did not change the petri net.")
             return False
         PetriNetOperations.update_net(petri_net, transition, new_incoming_places, new_outgoing_places)
+        if changes is not None:
+            PetriNetOperations.publish_delta(
+                petri_net,
+                transition,
+                changes,
+                {**incoming_snapshot, **outgoing_snapshot},
+                {**new_incoming_places, **new_outgoing_places},
+                started,
+            )
+        PetriNetOperations.shed_load(petri_net, new_outgoing_places)
         return True
 
 
@@ -629,6 +2474,7 @@ class AsyncPetriNet:
         run_checks=True,
         verbose=True,
     ) -> bool:
+        PetriNetOperations.release_timed_tokens(petri_net)
         transition, incoming_places, outgoing_places = PetriNetOperations.prepare_transition_firing(
             petri_net, transition_selection_function, run_checks=run_checks
         )
@@ -637,38 +2483,614 @@ class AsyncPetriNet:
                 print(f"\nFiring Transition: {transition.name}")
         if transition is None:  # No transition to fire so the petri net remains unchanged.
             return False
-        new_incoming_places, new_outgoing_places = await transition.fire(incoming_places, outgoing_places)
-        if new_incoming_places == incoming_places and new_outgoing_places == outgoing_places:
+        return await AsyncPetriNet.fire_transition(petri_net, transition, incoming_places, outgoing_places, verbose)
+
+    async def fire_transition(
+        petri_net: PetriNet,
+        transition: Transition,
+        incoming_places: dict[str, Place],
+        outgoing_places: dict[str, Place],
+        verbose=True,
+    ) -> bool:
+        """Fire the transition while holding its resources and update the net, returning whether it changed."""
+        incoming_snapshot = PetriNetOperations.snapshot_places(incoming_places)
+        outgoing_snapshot = PetriNetOperations.snapshot_places(outgoing_places)
+        changes = TokenChanges() if len(petri_net.delta_subscribers) > 0 else None
+        resources = PetriNetOperations.acquire_resources(petri_net, transition)
+        context = _acquired_resources.set(resources)
+        changes_context = _token_changes.set(changes)
+        started, error = time.monotonic(), None
+        try:
+            new_incoming_places, new_outgoing_places = await transition.fire(incoming_places, outgoing_places)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _token_changes.reset(changes_context)
+            _acquired_resources.reset(context)
+            PetriNetOperations.release_resources(petri_net, transition, resources, time.monotonic() - started, error)
+        if not (
+            PetriNetOperations.places_changed(incoming_snapshot, new_incoming_places)
+            or PetriNetOperations.places_changed(outgoing_snapshot, new_outgoing_places)
+        ):
             if verbose:
                 print(f"Transition {transition.id} did not change the petri net.")
             return False
         PetriNetOperations.update_net(petri_net, transition, new_incoming_places, new_outgoing_places)
+        if changes is not None:
+            PetriNetOperations.publish_delta(
+                petri_net,
+                transition,
+                changes,
+                {**incoming_snapshot, **outgoing_snapshot},
+                {**new_incoming_places, **new_outgoing_places},
+                started,
+            )
+        PetriNetOperations.shed_load(petri_net, new_outgoing_places)
         return True
 
+    async def run(
+        petri_net: PetriNet,
+        transition_selection_function: Callable[[PetriNet], Optional[Transition]],
+        maximum_concurrent_firings: Optional[int] = None,
+        run_checks=True,
+        verbose=False,
+    ) -> int:
+        """Fire transitions concurrently until none can fire, returning the number of firings that changed the net.
+
+        A transition is selected whenever a firing slot is free. Its firing starts straight away and takes its input
+        tokens before the next transition is selected, so fire functions should remove tokens before their first await.
+        Transitions waiting on their resource pools, e.g. a rate limit, are retried once the pools become available.
+        Tokens streamed by firings in flight are considered as they are added, see AsyncFiringFunctions.
+        A transition is not selected while its output places with a capacity have no room for one more token on top of
+        those that the firings in flight outputting to them will add.
+        While timed tokens are held back, run sleeps until the next one is due instead of returning.
+        """
+        in_flight: set[asyncio.Task] = set()
+        blocked: set[str] = set()  # Transitions that could not fire since the net last changed.
+        reserved_outputs: dict[str, int] = {}  # Firings in flight by the output place with a capacity they add to.
+        bounded_place_ids_by_firing: dict[asyncio.Task, tuple[str, ...]] = {}
+        changes = 0
+        signals = RunSignals()
+        signals_context = _run_signals.set(signals)  # Inherited by the firings started below.
+        progress: Optional[asyncio.Task] = None
+        try:
+            while True:
+                released, next_due = PetriNetOperations.release_timed_tokens(petri_net)
+                if released:
+                    blocked.clear()
+                if maximum_concurrent_firings is None or len(in_flight) < maximum_concurrent_firings:
+                    candidates = petri_net if len(blocked) == 0 else (
+                        PetriNetOperations.without_transitions(petri_net, blocked)
+                    )
+                    transition = transition_selection_function(candidates)
+                    if transition is not None:
+                        in_flight_count = petri_net.firings_in_flight.get(transition.id, 0)
+                        if in_flight_count > 0 and transition.maximum_firings is not None and (
+                            transition.firings_count + in_flight_count >= transition.maximum_firings
+                        ):
+                            blocked.add(transition.id)  # Wait to see whether the firings in flight change the net.
+                            continue
+                        bounded_place_ids = PetriNetOperations.bounded_outgoing_place_ids(petri_net, transition)
+                        if PetriNetOperations.outputs_full(petri_net, bounded_place_ids, reserved_outputs):
+                            blocked.add(transition.id)  # Wait for the firings in flight to fill the output places.
+                            continue
+                        _, incoming_places, outgoing_places = PetriNetOperations.prepare_transition_firing(
+                            petri_net, lambda _: transition, run_checks=run_checks
+                        )
+                        if verbose:
+                            print(f"\nFiring Transition: {transition.name}")
+                        firing = asyncio.ensure_future(AsyncPetriNet.fire_transition(
+                            petri_net, transition, incoming_places, outgoing_places, verbose
+                        ))
+                        await asyncio.sleep(0)  # Let the firing take its input tokens.
+                        signals.notify()
+                        if not firing.done():
+                            in_flight.add(firing)
+                            bounded_place_ids_by_firing[firing] = bounded_place_ids
+                            PetriNetOperations.reserve_outputs(reserved_outputs, bounded_place_ids)
+                        elif firing.result():
+                            changes += 1
+                            blocked.clear()
+                        else:
+                            blocked.add(transition.id)
+                        continue
+                due_in = None if next_due is None else max(0.0, next_due - petri_net.clock())
+                if len(in_flight) == 0:
+                    delay = PetriNetOperations.seconds_until_resources_available(petri_net)
+                    if due_in is not None and (delay is None or due_in < delay):
+                        delay = due_in
+                    if delay is None:
+                        return changes
+                    await asyncio.sleep(delay)
+                    blocked.clear()
+                    continue
+                if signals.waiting >= len(in_flight):  # Every firing in flight waits for space that cannot be made.
+                    signals.notify(force=True)
+                if progress is None:
+                    progress = asyncio.ensure_future(signals.progress.wait())
+                done, _ = await asyncio.wait(
+                    (*in_flight, progress), timeout=due_in, return_when=asyncio.FIRST_COMPLETED
+                )
+                if progress in done:
+                    done.remove(progress)
+                    signals.progress.clear()
+                    progress = None
+                in_flight -= done
+                for firing in done:
+                    PetriNetOperations.release_outputs(reserved_outputs, bounded_place_ids_by_firing.pop(firing))
+                    if firing.result():
+                        changes += 1
+                if len(done) > 0:
+                    signals.notify()
+                blocked.clear()
+        finally:
+            _run_signals.reset(signals_context)
+            if progress is not None:
+                progress.cancel()
+            for firing in in_flight:
+                firing.cancel()
+
+
+@dataclass
+class Reservation:
+    """A firing of a transition whose highest priority input token has been taken from the net for it."""
+    transition: Transition
+    place_id: str
+    token: Token
+    resources: dict[str, Any]
+    bounded_place_ids: tuple[str, ...] = ()  # The output places with a capacity that this firing has room saved in.
+
+
+class ThreadedPetriNet:
+    """Fire sync transitions in parallel on worker threads, for transforms that release the GIL or free-threaded Python.
+
+    Under a lock held only briefly, a worker selects a transition and reserves its firing by taking the highest
+    priority token of its input places. The fire function then runs without the lock on private copies of the
+    transition's places, holding just that token, and the tokens left in the copies are added back to the net.
+    Fire functions must therefore use at most the highest priority input token, as the SyncTransition wrappers other
+    than join do, and run raises a ValueError for transitions with single_token set to False, such as a join.
+    Workers reserve firings in small batches into their own queues and steal from the queues of others when idle.
+    For transforms that are pure and nets in which the order of firing does not change the outcome, the final
+    marking holds the same tokens as with SyncPetriNet.step, although tokens may be in a different order in a place.
+    """
+
+    def reserve(
+        petri_net: PetriNet,
+        transition_selection_function: Callable[[PetriNet], Optional[Transition]],
+        blocked: set[str],
+        maximum_reservations: int,
+        reserved_outputs: Optional[dict[str, int]] = None,
+    ) -> list[Reservation]:
+        """Select transitions and take their input tokens, call with the lock of the net held.
+
+        With reserved_outputs, the count of reserved firings that output to each place with a capacity, a transition
+        is only reserved while its output places have room for the firings already reserved and one more.
+        """
+        reservations: list[Reservation] = []
+        try:
+            while len(reservations) < maximum_reservations:
+                candidates = petri_net if len(blocked) == 0 else (
+                    PetriNetOperations.without_transitions(petri_net, blocked)
+                )
+                transition = transition_selection_function(candidates)
+                if transition is None:
+                    break
+                in_flight_count = petri_net.firings_in_flight.get(transition.id, 0)
+                if transition.maximum_firings is not None and (
+                    transition.firings_count + in_flight_count >= transition.maximum_firings
+                ):
+                    blocked.add(transition.id)  # Wait to see whether the firings in flight change the net.
+                    continue
+                bounded_place_ids = (
+                    PetriNetOperations.bounded_outgoing_place_ids(petri_net, transition)
+                    if reserved_outputs is not None else ()
+                )
+                if reserved_outputs is not None and PetriNetOperations.outputs_full(
+                    petri_net, bounded_place_ids, reserved_outputs
+                ):
+                    blocked.add(transition.id)  # Wait for the firings in flight to fill the output places.
+                    continue
+                incoming_places = PetriNetOperations.collect_incoming_places(petri_net, transition, run_checks=False)
+                selected = SelectToken.handle_with_highest_priority(incoming_places)
+                if selected is None:
+                    blocked.add(transition.id)
+                    continue
+                resources = PetriNetOperations.acquire_resources(petri_net, transition)
+                token = RemoveToken.by_handle(incoming_places, *selected)
+                reservations.append(Reservation(transition, selected[0], token, resources, bounded_place_ids))
+                if reserved_outputs is not None:
+                    PetriNetOperations.reserve_outputs(reserved_outputs, bounded_place_ids)
+        except BaseException:
+            ThreadedPetriNet.put_back(petri_net, reservations, reserved_outputs)
+            raise
+        return reservations
+
+    def release_outputs(reservation: Reservation, reserved_outputs: Optional[dict[str, int]]) -> None:
+        if reserved_outputs is not None:
+            PetriNetOperations.release_outputs(reserved_outputs, reservation.bounded_place_ids)
+
+    def put_back(
+        petri_net: PetriNet,
+        reservations: Iterable[Reservation],
+        reserved_outputs: Optional[dict[str, int]] = None,
+        latency: float = 0.0,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Return the tokens and resources of reserved firings that did not complete, call with the lock held."""
+        for reservation in reservations:
+            petri_net.places[reservation.place_id].tokens.add(reservation.token)
+            PetriNetOperations.release_resources(
+                petri_net, reservation.transition, reservation.resources, latency, error
+            )
+            ThreadedPetriNet.release_outputs(reservation, reserved_outputs)
+
+    def fire(
+        petri_net: PetriNet, reservation: Reservation, record_changes: bool, run_checks: bool
+    ) -> tuple[dict[str, Place], Optional[StepDelta]]:
+        """Fire the reserved transition on private copies of its places, returning the places after the firing."""
+        transition = reservation.transition
+        index = PetriNetOperations.arc_index(petri_net)
+        incoming_place_ids = index.incoming_place_ids.get(transition.id, ())
+        outgoing_place_ids = index.outgoing_place_ids.get(transition.id, ())
+        private_places = {
+            place_id: Place(
+                place_id,
+                petri_net.places[place_id].name,
+                PlaceTokens((reservation.token,) if place_id == reservation.place_id else ()),
+                petri_net.places[place_id].capacity,
+            )
+            for place_id in (*incoming_place_ids, *outgoing_place_ids)
+        }
+        incoming_places = {place_id: private_places[place_id] for place_id in incoming_place_ids}
+        outgoing_places = {place_id: private_places[place_id] for place_id in outgoing_place_ids}
+        if run_checks:
+            PetriNetCheck.places(incoming_places.values())
+        snapshot = PetriNetOperations.snapshot_places(private_places)
+        changes = TokenChanges() if record_changes else None
+        context = _acquired_resources.set(reservation.resources)
+        changes_context = _token_changes.set(changes)
+        try:
+            new_incoming_places, new_outgoing_places = transition.fire(incoming_places, outgoing_places)
+        finally:
+            _token_changes.reset(changes_context)
+            _acquired_resources.reset(context)
+        new_places = {**new_incoming_places, **new_outgoing_places}
+        if not PetriNetOperations.places_changed(snapshot, new_places):
+            return new_places, None
+        delta = StepDelta(transition.id, {}, {})
+        if changes is not None:
+            delta = PetriNetOperations.step_delta(transition.id, changes, snapshot, new_places)
+        return new_places, delta
+
+    def run(
+        petri_net: PetriNet,
+        transition_selection_function: Callable[[PetriNet], Optional[Transition]] = (
+            SelectTransition.using_priority_functions
+        ),
+        workers: Optional[int] = None,
+        batch_size: int = 4,
+        run_checks=True,
+    ) -> int:
+        """Fire transitions on worker threads until none can fire, returning the number of firings that changed the net.
+
+        The first error raised in a worker, by a fire function or a priority function, stops the workers and is raised
+        once they have finished, after the tokens of the firings that did not complete are put back.
+        """
+        for transition in petri_net.transitions.values():
+            if asyncio.iscoroutinefunction(transition.fire):
+                raise ValueError(f"Transition \"{transition.id}\" is async, use AsyncPetriNet.run instead.")
+            if not transition.single_token:
+                raise ValueError(
+                    f"Transition \"{transition.id}\" takes more than one input token, use SyncPetriNet.step or "
+                    "StagedPetriNet.run instead."
+                )
+        workers = workers if workers is not None else (os.cpu_count() or 1)
+        lock = threading.Condition()
+        queues: list[deque[Reservation]] = [deque() for _ in range(workers)]
+        blocked: set[str] = set()  # Transitions that could not fire since the net last changed.
+        reserved_outputs: dict[str, int] = {}  # Reserved firings outputting to each place with a capacity.
+        state = {"reserved": 0, "changes": 0, "stopping": False}
+        errors: list[BaseException] = []
+
+        def commit(
+            reservation: Reservation, new_places: dict[str, Place], delta: Optional[StepDelta], latency: float
+        ) -> None:
+            transition = reservation.transition
+            for place_id, place in new_places.items():
+                petri_net.places[place_id].tokens.extend(place.tokens)
+            PetriNetOperations.release_resources(petri_net, transition, reservation.resources, latency, None)
+            ThreadedPetriNet.release_outputs(reservation, reserved_outputs)
+            if len(reservation.bounded_place_ids) > 0:
+                blocked.clear()  # Room saved in the output places that this firing did not use is free again.
+            if delta is None:
+                blocked.add(transition.id)
+                return
+            blocked.clear()
+            PetriNetOperations.update_net(petri_net, transition, {}, {})
+            state["changes"] += 1
+            if len(petri_net.delta_subscribers) > 0:
+                for subscriber in tuple(petri_net.delta_subscribers):
+                    subscriber(delta)
+            PetriNetOperations.shed_load(petri_net, PetriNetOperations.arc_index(petri_net).outgoing_place_ids.get(
+                transition.id, ()
+            ))
+
+        def steal(worker: int) -> Optional[Reservation]:
+            for offset in range(1, workers):
+                try:
+                    return queues[(worker + offset) % workers].pop()
+                except IndexError:
+                    continue
+            return None
+
+        def work(worker: int) -> None:
+            try:
+                fire_until_stopped(worker)
+            except BaseException as e:
+                with lock:
+                    errors.append(e)
+                    state["stopping"] = True
+                    lock.notify_all()
+
+        def fire_until_stopped(worker: int) -> None:
+            own = queues[worker]
+            while not state["stopping"]:
+                reservation: Optional[Reservation]
+                try:
+                    reservation = own.popleft()
+                except IndexError:
+                    reservation = steal(worker)
+                if reservation is None:
+                    with lock:
+                        while True:
+                            if state["stopping"]:
+                                return
+                            released, next_due = PetriNetOperations.release_timed_tokens(petri_net)
+                            if released:
+                                blocked.clear()
+                            reservations = ThreadedPetriNet.reserve(
+                                petri_net, transition_selection_function, blocked, batch_size, reserved_outputs
+                            )
+                            if len(reservations) > 0:
+                                break
+                            if state["reserved"] == 0 and next_due is None:
+                                state["stopping"] = True
+                                lock.notify_all()
+                                return
+                            lock.wait(None if next_due is None else max(0.0, next_due - petri_net.clock()))
+                        state["reserved"] += len(reservations)
+                    reservation = reservations[0]
+                    own.extend(reservations[1:])
+                    if len(reservations) > 1:
+                        with lock:
+                            lock.notify_all()  # Let idle workers steal the rest.
+                started = time.monotonic()
+                try:
+                    new_places, delta = ThreadedPetriNet.fire(
+                        petri_net, reservation, len(petri_net.delta_subscribers) > 0, run_checks
+                    )
+                except BaseException as e:
+                    with lock:
+                        ThreadedPetriNet.put_back(
+                            petri_net, [reservation], reserved_outputs, time.monotonic() - started, e
+                        )
+                        state["reserved"] -= 1
+                    raise
+                with lock:
+                    commit(reservation, new_places, delta, time.monotonic() - started)
+                    state["reserved"] -= 1
+                    lock.notify_all()
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with lock:
+            for own in queues:  # Put back the tokens of firings that were reserved but not started.
+                ThreadedPetriNet.put_back(petri_net, own, reserved_outputs)
+        if len(errors) > 0:
+            raise errors[0]
+        return state["changes"]
+
+
+class StagedPetriNet:
+    """Run an acyclic net stage by stage, draining each transition in bulk instead of selecting a transition per firing.
+
+    Transitions are grouped into topological stages, each transition in a stage after every transition that outputs
+    to one of its input places. A transition is fired repeatedly while it has a positive priority, checked from that
+    transition alone, so the priority functions of the other transitions are not evaluated for every token.
+    Transitions that compete for tokens, by sharing an input place directly or through other transitions, are fired
+    together at the stage of the last of them, each firing going to the one with the highest priority as with
+    SyncPetriNet.step. Passes over the stages are repeated until none fires, which lets transitions that stopped on
+    full output places or unavailable resources continue.
+    """
+
+    def stages(petri_net: PetriNet) -> Optional[tuple[tuple[str, ...], ...]]:
+        """The ids of the transitions in each topological stage, None if the net has a cycle."""
+        index = PetriNetOperations.arc_index(petri_net)
+        consumers: dict[str, list[str]] = {}
+        for transition_id in petri_net.transitions:
+            for place_id in index.incoming_place_ids.get(transition_id, ()):
+                consumers.setdefault(place_id, []).append(transition_id)
+        successors = {  # Ordered, so that the stages are the same from run to run.
+            transition_id: dict.fromkeys(
+                consumer for place_id in index.outgoing_place_ids.get(transition_id, ())
+                for consumer in consumers.get(place_id, ())
+            )
+            for transition_id in petri_net.transitions
+        }
+        predecessor_counts = {transition_id: 0 for transition_id in petri_net.transitions}
+        for following in successors.values():
+            for transition_id in following:
+                predecessor_counts[transition_id] += 1
+        stage = [transition_id for transition_id, count in predecessor_counts.items() if count == 0]
+        stages = []
+        while len(stage) > 0:
+            stages.append(tuple(stage))
+            next_stage = []
+            for transition_id in stage:
+                for successor in successors[transition_id]:
+                    predecessor_counts[successor] -= 1
+                    if predecessor_counts[successor] == 0:
+                        next_stage.append(successor)
+            stage = next_stage
+        if sum(len(stage) for stage in stages) < len(petri_net.transitions):
+            return None
+        return tuple(stages)
+
+    def competing(petri_net: PetriNet) -> dict[str, tuple[str, ...]]:
+        """The transitions that compete with each transition for input tokens, including itself."""
+        index = PetriNetOperations.arc_index(petri_net)
+        consumers: dict[str, list[str]] = {}
+        for transition_id in petri_net.transitions:
+            for place_id in index.incoming_place_ids.get(transition_id, ()):
+                consumers.setdefault(place_id, []).append(transition_id)
+        groups: dict[str, tuple[str, ...]] = {}
+        for transition_id in petri_net.transitions:
+            if transition_id in groups:
+                continue
+            group, unvisited = {transition_id}, [transition_id]
+            while len(unvisited) > 0:
+                for place_id in index.incoming_place_ids.get(unvisited.pop(), ()):
+                    for consumer in consumers[place_id]:
+                        if consumer not in group:
+                            group.add(consumer)
+                            unvisited.append(consumer)
+            ordered = tuple(member for member in petri_net.transitions if member in group)
+            for member in ordered:
+                groups[member] = ordered
+        return groups
+
+    def drain_competing(petri_net: PetriNet, transition_ids: tuple[str, ...], run_checks=True) -> int:
+        """Fire the highest priority of the competing transitions until none changes the net, returning the firings."""
+        transitions = {transition_id: petri_net.transitions[transition_id] for transition_id in transition_ids}
+        view = replace(petri_net, transitions=transitions)
+        firings = 0
+        try:
+            while SyncPetriNet.step(view, SelectTransition.using_priority_functions, run_checks, verbose=False):
+                firings += 1
+        finally:
+            for transition_id in transition_ids:
+                petri_net.transitions[transition_id] = view.transitions[transition_id]
+        return firings
+
+    def drain(petri_net: PetriNet, transition_id: str, run_checks=True) -> int:
+        """Fire the transition until it is not enabled or stops changing the net, returning the number of firings."""
+        transition = petri_net.transitions[transition_id]
+        incoming_places = PetriNetOperations.collect_incoming_places(petri_net, transition, run_checks=run_checks)
+        outgoing_places = PetriNetOperations.collect_outgoing_places(petri_net, transition, run_checks=run_checks)
+        firings = 0
+        try:
+            while (PetriNetOperations.transition_priority(petri_net, transition) or 0) > 0:
+                if transition.maximum_firings is not None and (
+                    transition.firings_count + firings >= transition.maximum_firings
+                ):
+                    raise TransitionFiringLimitExceeded(
+                        f"Transition {transition.id} has exceeded its maximum firings limit."
+                    )
+                snapshot = PetriNetOperations.snapshot_places({**incoming_places, **outgoing_places})
+                changes = TokenChanges() if len(petri_net.delta_subscribers) > 0 else None
+                resources = PetriNetOperations.acquire_resources(petri_net, transition)
+                context = _acquired_resources.set(resources)
+                changes_context = _token_changes.set(changes)
+                started, error = time.monotonic(), None
+                try:
+                    new_incoming_places, new_outgoing_places = transition.fire(incoming_places, outgoing_places)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _token_changes.reset(changes_context)
+                    _acquired_resources.reset(context)
+                    PetriNetOperations.release_resources(
+                        petri_net, transition, resources, time.monotonic() - started, error
+                    )
+                new_places = {**new_incoming_places, **new_outgoing_places}
+                if not PetriNetOperations.places_changed(snapshot, new_places):
+                    break
+                firings += 1
+                for place_id, place in new_places.items():
+                    petri_net.places[place_id] = place
+                incoming_places = {place_id: petri_net.places[place_id] for place_id in incoming_places}
+                outgoing_places = {place_id: petri_net.places[place_id] for place_id in outgoing_places}
+                if changes is not None:
+                    PetriNetOperations.publish_delta(petri_net, transition, changes, snapshot, new_places, started)
+                PetriNetOperations.shed_load(petri_net, outgoing_places)
+        finally:
+            if firings > 0:  # Count the firings with a single copy of the transition.
+                new_transition = deepcopy(transition)
+                new_transition.firings_count += firings
+                petri_net.transitions[transition_id] = new_transition
+        return firings
+
+    def run(petri_net: PetriNet, run_checks=True) -> int:
+        """Fire the transitions of an acyclic net stage by stage until none can fire, returning the firings."""
+        stages = StagedPetriNet.stages(petri_net)
+        if stages is None:
+            raise ValueError("The net has a cycle, use SyncPetriNet.step to run it.")
+        competing = StagedPetriNet.competing(petri_net)
+        positions = {transition_id: i for i, transition_id in enumerate(sum(stages, ()))}
+        last_competitors = {max(group, key=positions.__getitem__) for group in competing.values() if len(group) > 1}
+        firings = 0
+        while True:
+            released, next_due = PetriNetOperations.release_timed_tokens(petri_net)
+            pass_firings = 0
+            for stage in stages:
+                for transition_id in stage:
+                    group = competing[transition_id]
+                    if len(group) == 1:
+                        pass_firings += StagedPetriNet.drain(petri_net, transition_id, run_checks=run_checks)
+                    elif transition_id in last_competitors:
+                        pass_firings += StagedPetriNet.drain_competing(petri_net, group, run_checks=run_checks)
+            firings += pass_firings
+            if pass_firings == 0 and not released:
+                if next_due is None:
+                    return firings
+                time.sleep(max(0.0, next_due - petri_net.clock()))
+
 
 class New:
 
-    def empty_place(id: str, name: Optional[str] = None) -> Place:
+    def empty_place(
+        id: str,
+        name: Optional[str] = None,
+        capacity: Optional[int] = None,
+        shed_policy: Optional[ShedPolicy] = None,
+        maximum_tokens_in_memory: Optional[int] = None,
+        dead_letter_place: Optional[str] = None,
+    ) -> Place:
+        """With maximum_tokens_in_memory, tokens beyond it are spilled to disk, see SpillingPlaceTokens."""
         return Place(
             id=id,
             name=name if name is not None else id,
-            tokens=(),
+            tokens=PlaceTokens() if maximum_tokens_in_memory is None else SpillingPlaceTokens(
+                maximum_in_memory=maximum_tokens_in_memory
+            ),
+            capacity=capacity,
+            shed_policy=shed_policy,
+            dead_letter_place=dead_letter_place,
         )
 
     def arc_out_and_empty_place(
-        transition_id: str, place_id: str, place_name: Optional[str] = None
+        transition_id: str, place_id: str, place_name: Optional[str] = None, capacity: Optional[int] = None
     ) -> tuple[ArcOut, Place]:
-        return (ArcOut(transition_id, place_id), New.empty_place(place_id))
+        return (ArcOut(transition_id, place_id), New.empty_place(place_id, capacity=capacity))
 
     def petri_net(
         nodes_and_edges: Iterable[Union[Place, Transition, ArcIn, ArcOut]],
         existing_net: Optional[PetriNet] = None,
+        resource_pools: Optional[dict[str, ResourcePool]] = None,
+        clock: Optional[Callable[[], float]] = None,
     ) -> PetriNet:
+        """Make a net from its parts, or add them to a copy of existing_net. The clock is used for timed tokens."""
         if existing_net is None:
             places = {part.id: part for part in nodes_and_edges if isinstance(part, Place)}
             transitions = {part.id: part for part in nodes_and_edges if isinstance(part, Transition)}
             arcs_in = {part for part in nodes_and_edges if isinstance(part, ArcIn)}
             arcs_out = {part for part in nodes_and_edges if isinstance(part, ArcOut)}
+            pools = dict(resource_pools or {})
         else:
             cp = deepcopy(existing_net)
             places = {**cp.places, **{part.id: part for part in nodes_and_edges if isinstance(part, Place)}}
@@ -677,10 +3099,16 @@ class New:
             }
             arcs_in = cp.arcs_in.union({part for part in nodes_and_edges if isinstance(part, ArcIn)})
             arcs_out = cp.arcs_out.union({part for part in nodes_and_edges if isinstance(part, ArcOut)})
+            pools = {**existing_net.resource_pools, **(resource_pools or {})}
         # Check places.
         for place in places.values():
             PetriNetCheck.place(place)
             PetriNetCheck.tokens(place.tokens)
+            if place.shed_policy is not None and place.shed_policy.shed_place is not None:
+                if place.shed_policy.shed_place not in places:
+                    raise ValueError(f"Shed place \"{place.shed_policy.shed_place}\" of \"{place.id}\" not found.")
+            if place.dead_letter_place is not None and place.dead_letter_place not in places:
+                raise ValueError(f"Dead-letter place \"{place.dead_letter_place}\" of \"{place.id}\" not found.")
 
         # Check arcs.
         for arc_in in arcs_in:
@@ -693,5 +3121,12 @@ class New:
                 raise ValueError(f"ArcOut place_id \"{arc_out.place_id}\" not found in places.")
             if arc_out.transition_id not in transitions:
                 raise ValueError(f"ArcOut transition_id \"{arc_out.transition_id}\" not found in transitions.")
-
-        return PetriNet(places, transitions, arcs_in, arcs_out)
+        # Check resource pools.
+        for transition in transitions.values():
+            for pool_id in transition.resource_pool_ids:
+                if pool_id not in pools:
+                    raise ValueError(f"Resource pool \"{pool_id}\" of transition \"{transition.id}\" not found.")
+
+        if clock is None:
+            clock = existing_net.clock if existing_net is not None else time.monotonic
+        return PetriNet(places, transitions, arcs_in, arcs_out, resource_pools=pools, clock=clock)
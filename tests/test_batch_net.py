@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from helpers.batch_net import BatchPetriNet
+from petri_net import ArcIn, AsyncTransition, New, SpillingPlaceTokens, SyncTransition, Token
+
+
+def upper_case_net():
+    return New.petri_net((
+        New.empty_place("words"),
+        ArcIn("words", "upper_case"),
+        SyncTransition.flip("upper_case", lambda t: Token(t.id, t.data.upper()), maximum_firings=None, priority=1),
+        *New.arc_out_and_empty_place("upper_case", "upper_case_words"),
+    ))
+
+
+async def async_upper_case(token: Token) -> Token:
+    await asyncio.sleep(0.001)
+    return Token(token.id, token.data.upper())
+
+
+def async_upper_case_net():
+    return New.petri_net((
+        New.empty_place("words"),
+        ArcIn("words", "upper_case"),
+        AsyncTransition.flip("upper_case", async_upper_case, maximum_firings=None, priority=1),
+        *New.arc_out_and_empty_place("upper_case", "upper_case_words"),
+    ))
+
+
+def initial_markings():
+    return [{"words": (Token("0", f"case {i}"), Token("1", f"word {i}"))} for i in range(10)]
+
+
+class TestBatchPetriNet:
+
+    def test_run_across_processes_returns_a_result_per_marking(self):
+        results = dict(BatchPetriNet.run(
+            upper_case_net, initial_markings(), processes=2, chunk_size=3, result_function=BatchPetriNet.sink_marking,
+        ))
+        assert sorted(results) == list(range(10))
+        assert results[4] == {"upper_case_words": (Token("0", "CASE 4"), Token("1", "WORD 4"))}
+
+    @pytest.mark.asyncio
+    async def test_run_async_instances_on_one_event_loop(self):
+        results = {}
+        async for index, marking in BatchPetriNet.run_async(
+            async_upper_case_net, initial_markings(), maximum_concurrent_instances=4,
+        ):
+            results[index] = marking
+        assert sorted(results) == list(range(10))
+        assert results[7]["words"] == ()
+        assert set(results[7]["upper_case_words"]) == {Token("0", "CASE 7"), Token("1", "WORD 7")}
+
+    def test_with_marking_keeps_spilling_places(self):
+        net = upper_case_net()
+        net.places["words"] = New.empty_place("words", maximum_tokens_in_memory=4)
+        tokens = tuple(Token(str(i), f"word {i}") for i in range(10))
+        BatchPetriNet.with_marking(net, {"words": tokens})
+        assert isinstance(net.places["words"].tokens, SpillingPlaceTokens)
+        assert net.places["words"].tokens.spilled_count > 0
+        assert net.places["words"].tokens == tokens
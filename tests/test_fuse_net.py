@@ -0,0 +1,103 @@
+import pytest
+
+from helpers.fuse_net import FusePetriNet
+from petri_net import (
+    ArcIn, ArcOut, New, PetriNetOperations, Place, SelectToken, SelectTransition, ShedPolicy, SyncFiringFunctions,
+    SyncPetriNet, SyncTransition, Token, Transition, TransitionFiringLimitExceeded,
+)
+
+
+def word_cases_net(middle_place=None, maximum_firings=None):
+    return New.petri_net((
+        Place("words", "words", (Token("1", "ONE TWO", priority=1), Token("2", "THREE FOUR", priority=2))),
+        ArcIn("words", "lower_case"),
+        SyncTransition.flip("lower_case", lambda t: Token(t.id, t.data.lower(), t.priority), None, priority=1),
+        ArcOut("lower_case", "lower_case_words"),
+        middle_place or New.empty_place("lower_case_words"),
+        ArcIn("lower_case_words", "snake_case"),
+        SyncTransition.flip(
+            "snake_case", lambda t: Token(t.id, t.data.replace(" ", "_"), t.priority), maximum_firings, priority=1,
+        ),
+        *New.arc_out_and_empty_place("snake_case", "snake_case_words"),
+        ArcIn("snake_case_words", "reverse"),
+        SyncTransition.flip("reverse", lambda t: Token(t.id, t.data[::-1], t.priority), None, priority=1),
+        *New.arc_out_and_empty_place("reverse", "reversed_words"),
+    ))
+
+
+def run(net):
+    steps = 0
+    while SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False):
+        steps += 1
+    return steps
+
+
+class TestFusePetriNet:
+
+    def test_chain_of_flips_is_fused_and_gives_the_same_tokens(self):
+        unfused = word_cases_net()
+        assert run(unfused) == 6
+        fused = FusePetriNet.fuse(word_cases_net())
+        assert fused.chains == {"lower_case+snake_case+reverse": ("lower_case", "snake_case", "reverse")}
+        assert set(fused.net.places) == {"words", "reversed_words"}
+        assert run(fused.net) == 2
+        net = FusePetriNet.unfuse(fused)
+        assert list(net.places["reversed_words"].tokens) == list(unfused.places["reversed_words"].tokens)
+        assert set(net.places) == set(unfused.places)
+        assert net.arcs_in == unfused.arcs_in and net.arcs_out == unfused.arcs_out
+        assert {transition_id: t.firings_count for transition_id, t in net.transitions.items()} == {
+            "lower_case": 2, "snake_case": 2, "reverse": 2,
+        }
+
+    def test_places_with_limits_or_other_consumers_break_the_chain(self):
+        capacity = New.empty_place("lower_case_words", capacity=1)
+        assert FusePetriNet.chains(word_cases_net(middle_place=capacity)) == [("snake_case", "reverse")]
+        shedding = New.empty_place("lower_case_words", shed_policy=ShedPolicy(maximum_count=1))
+        assert FusePetriNet.chains(word_cases_net(middle_place=shedding)) == [("snake_case", "reverse")]
+        net = word_cases_net()
+        net.arcs_in.add(ArcIn("snake_case_words", "lower_case"))
+        net.places["lower_case_words"].tokens.add(Token("3", "waiting"))
+        assert FusePetriNet.chains(net) == []
+
+    def test_fused_transition_fires_at_most_the_fewest_remaining_firings(self):
+        fused = FusePetriNet.fuse(word_cases_net(maximum_firings=1))
+        assert fused.net.transitions["lower_case+snake_case+reverse"].maximum_firings == 1
+        assert SyncPetriNet.step(fused.net, SelectTransition.using_priority_functions, verbose=False)
+        with pytest.raises(TransitionFiringLimitExceeded):
+            SyncPetriNet.step(fused.net, SelectTransition.using_priority_functions, verbose=False)
+        assert FusePetriNet.firings_counts(fused) == {"lower_case": 1, "snake_case": 1, "reverse": 1}
+
+    def test_deltas_of_fused_firings_skip_the_flips_and_places_inside_the_chain(self):
+        fused = FusePetriNet.fuse(word_cases_net())
+        deltas = []
+        PetriNetOperations.subscribe(fused.net, deltas.append)
+        SyncPetriNet.step(fused.net, SelectTransition.using_priority_functions, verbose=False)
+        assert [delta.transition_id for delta in deltas] == ["lower_case+snake_case+reverse"]
+        assert set(deltas[0].removed) == {"words"} and set(deltas[0].added) == {"reversed_words"}
+
+    def test_transitions_with_their_own_fire_and_priority_functions_are_not_fused(self):
+        def case_change(id, transform, weight):
+            return Transition(
+                id=id,
+                name=id,
+                fire=lambda input_places, output_places: SyncFiringFunctions.move_and_transform_highest_priority_token(
+                    input_places, output_places, transform,
+                ),
+                maximum_firings=4,
+                priority_function=lambda input_places, _: SelectToken.total_count(input_places) * weight,
+            )
+
+        net = New.petri_net((
+            Place("starting_place", "All Caps", (Token("1", "ONE", priority=1), Token("2", "TWO TOO", priority=2))),
+            ArcIn("starting_place", "lower_case"),
+            case_change("lower_case", lambda t: Token(t.id, t.data.lower()), 100),
+            *New.arc_out_and_empty_place("lower_case", "middle_place"),
+            ArcIn("middle_place", "snake_case"),
+            case_change("snake_case", lambda t: Token(t.id, t.data.replace(" ", "_")), 1),
+            *New.arc_out_and_empty_place("snake_case", "final_place"),
+        ))
+        assert FusePetriNet.chains(net) == []
+        fused = FusePetriNet.fuse(net)
+        assert fused.chains == {} and set(fused.net.transitions) == {"lower_case", "snake_case"}
+        assert run(fused.net) == 4
+        assert sorted(t.data for t in FusePetriNet.unfuse(fused).places["final_place"].tokens) == ["one", "two_too"]
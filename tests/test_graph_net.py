@@ -0,0 +1,46 @@
+from helpers.graph_net import GraphNet, GraphRenderer
+from petri_net import ArcIn, New, Place, SyncPetriNet, SelectTransition, SyncTransition, Token
+
+
+def upper_case_net(word_count: int):
+    return New.petri_net((
+        Place("words", "Words", tuple(Token(str(i), f"word {i}", priority=i % 3) for i in range(word_count))),
+        ArcIn("words", "upper_case"),
+        SyncTransition.flip("upper_case", lambda t: Token(t.id, t.data.upper()), maximum_firings=None, priority=1),
+        *New.arc_out_and_empty_place("upper_case", "upper_case_words"),
+    ))
+
+
+class TestGraphNet:
+
+    def test_large_places_are_shown_as_a_count_and_the_highest_priority_tokens(self):
+        place = upper_case_net(7).places["words"]
+        assert GraphNet.place_label(place, 100, maximum_tokens_per_place=3) == (
+            "Words (7 tokens)\n2: word 2\n5: word 5\n1: word 1\n... 4 more\n"
+        )
+        assert GraphNet.place_label(place, 100, maximum_tokens_per_place=7).count("\n") == 8
+
+    def test_dot_lines_pin_nodes_to_positions(self):
+        dot = "".join(GraphNet.dot_lines(upper_case_net(1), positions={"upper_case": (72.0, 36.0)}))
+        assert '\t"upper_case" [label="upper_case" shape=box pos="72.00,36.00!"]\n' in dot
+        assert '\t"words" -> "upper_case"\n' in dot
+        assert '\t"upper_case" -> "upper_case_words"\n' in dot
+
+    def test_positions_from_plain_are_in_points(self):
+        plain = 'graph 1 3 2\nnode "upper case" 1.5 0.5 1 0.5 "Upper Case" solid box black lightgrey\nstop\n'
+        assert GraphNet.positions_from_plain(plain) == {"upper case": (108.0, 36.0)}
+
+
+class TestGraphRenderer:
+
+    def test_frames_are_written_in_the_background(self, tmp_path):
+        net = upper_case_net(20)
+        with GraphRenderer(net, tmp_path, format=None, maximum_tokens_per_place=5) as renderer:
+            renderer.submit(net, "000_before")
+            step_count = 0
+            while SyncPetriNet.step(net, SelectTransition.using_priority_functions):
+                step_count += 1
+                renderer.submit(net, f"{step_count:03}_step")
+        assert len(list(tmp_path.glob("*.gv"))) == 21
+        assert "Words (20 tokens)" in (tmp_path / "000_before.gv").read_text()
+        assert "upper_case_words (20 tokens)" in (tmp_path / "020_step.gv").read_text()
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from helpers.latency_net import LatencySummary, LatencyTracker
+from petri_net import (
+    ArcIn, ArcOut, AsyncPetriNet, AsyncTransition, New, Place, SelectTransition, SyncPetriNet, SyncTransition, Token
+)
+
+
+def split_and_upper_case_net():
+    return New.petri_net((
+        Place("sentences", "Sentences", (Token("0", "a b"),)),
+        ArcIn("sentences", "split"),
+        SyncTransition.expand(
+            "split", lambda t: tuple(Token(f"{t.id}.{i}", w) for i, w in enumerate(t.data.split())), priority=2,
+        ),
+        *New.arc_out_and_empty_place("split", "words"),
+        ArcIn("words", "upper_case"),
+        SyncTransition.flip("upper_case", lambda t: Token(t.id, t.data.upper()), maximum_firings=None, priority=1),
+        *New.arc_out_and_empty_place("upper_case", "upper_case_words"),
+    ))
+
+
+class TestLatencyTracker:
+
+    def test_dwell_times_and_expanded_children_inherit_their_parents_start(self):
+        net = split_and_upper_case_net()
+        times = iter((0.0, 1.0, 3.0, 6.0))
+        tracker = LatencyTracker(net, clock=lambda: next(times))
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions):
+            pass
+        report = tracker.report()
+        assert report.dwell["sentences"] == LatencySummary(1, 1.0, 1.0, 1.0, 1.0, 1.0)
+        assert report.dwell["words"] == LatencySummary(2, 3.5, 5.0, 5.0, 5.0, 5.0)
+        assert report.end_to_end["upper_case_words"] == LatencySummary(2, 4.5, 6.0, 6.0, 6.0, 6.0)
+        assert [place_id for place_id, _ in report.slowest_places(1)] == ["words"]
+
+    def test_tokens_sharing_an_id_are_timed_separately(self):
+        net = New.petri_net((
+            Place("in", "In", (Token("2", "b", priority=2),)),
+            ArcIn("in", "move"),
+            SyncTransition.flip("move", lambda t: t, priority=2),
+            ArcOut("move", "words"),
+            Place("words", "Words", (Token("2", "a", priority=1),)),
+            ArcIn("words", "take"),
+            SyncTransition.flip("take", lambda t: t, maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("take", "out"),
+        ))
+        times = iter((0.0, 1.0, 3.0, 6.0))
+        tracker = LatencyTracker(net, clock=lambda: next(times))
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False):
+            pass
+        assert [t.data for t in net.places["out"].tokens] == ["b", "a"]
+        assert tracker.report().dwell["words"] == LatencySummary(2, 4.0, 6.0, 6.0, 6.0, 6.0)
+
+    def test_tokens_read_back_from_a_spilled_place_are_still_timed(self):
+        net = New.petri_net((
+            Place("in", "In", tuple(Token(str(i), i) for i in range(20))),
+            ArcIn("in", "fill"),
+            SyncTransition.flip("fill", lambda t: t, maximum_firings=None, priority=2),
+            ArcOut("fill", "spilled"),
+            New.empty_place("spilled", maximum_tokens_in_memory=4),
+            ArcIn("spilled", "drain"),
+            SyncTransition.flip("drain", lambda t: t, maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("drain", "out"),
+        ))
+        tracker = LatencyTracker(net)
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False):
+            pass
+        assert net.places["spilled"].tokens.spilled_count == 0
+        assert tracker.report().dwell["spilled"].count == 20
+        assert tracker.timestamps["spilled"] == {} and tracker.keys_by_token["spilled"] == {}
+
+    @pytest.mark.asyncio
+    async def test_async_dwell_ends_when_the_firing_takes_the_token(self):
+        async def slow_upper_case(token: Token) -> Token:
+            await asyncio.sleep(0.05)
+            return Token(token.id, token.data.upper())
+
+        net = New.petri_net((
+            Place("words", "Words", (Token("0", "a"),)),
+            ArcIn("words", "upper_case"),
+            AsyncTransition.flip("upper_case", slow_upper_case, priority=1),
+            *New.arc_out_and_empty_place("upper_case", "upper_case_words"),
+        ))
+        tracker = LatencyTracker(net)
+        await AsyncPetriNet.run(net, SelectTransition.using_priority_functions)
+        report = tracker.report()
+        assert report.dwell["words"].maximum < 0.04
+        assert report.end_to_end["upper_case_words"].maximum >= 0.05
@@ -0,0 +1,58 @@
+import sys
+
+from helpers.memory_net import MemoryMonitor, estimate_size
+from petri_net import ArcIn, New, Place, SelectTransition, SyncPetriNet, SyncTransition, Token
+
+
+def padding_net(token_count: int):
+    return New.petri_net((
+        Place("small", "Small", tuple(Token(str(i), "x") for i in range(token_count))),
+        ArcIn("small", "pad"),
+        SyncTransition.flip("pad", lambda t: Token(t.id, t.data * 10_000), maximum_firings=None, priority=1),
+        *New.arc_out_and_empty_place("pad", "large"),
+    ))
+
+
+class TestMemoryMonitor:
+
+    def test_estimate_size_follows_containers(self):
+        data = {"words": ["a" * 100, "b" * 100]}
+        assert estimate_size(data) > 2 * sys.getsizeof("a" * 100)
+
+    def test_counts_peaks_and_sampled_sizes(self):
+        net = padding_net(10)
+        monitor = MemoryMonitor(net, sample_every=3)
+        for _ in range(4):
+            SyncPetriNet.step(net, SelectTransition.using_priority_functions)
+        report = monitor.report()
+        assert (report.places["small"].count, report.places["small"].peak_count) == (6, 10)
+        assert (report.places["large"].count, report.places["large"].sampled_tokens) == (4, 2)
+        assert report.places["large"].mean_token_bytes > 10_000
+        assert [place_id for place_id, _ in report.top_places(1)] == ["large"]
+        monitor.close()
+        SyncPetriNet.step(net, SelectTransition.using_priority_functions)
+        assert monitor.report().places["large"].count == 4
+
+    def test_tokens_added_after_the_monitor_is_attached(self):
+        net = padding_net(0)
+        monitor = MemoryMonitor(net)
+        assert monitor.report().places["small"].count == 0
+        net.places["small"].tokens.extend(Token(str(i), "x") for i in range(3))
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False):
+            pass
+        report = monitor.report()
+        assert (report.places["small"].count, report.places["large"].count) == (0, 3)
+        assert len(net.places["large"].tokens) == 3
+
+    def test_traced_fire_allocations(self):
+        net = padding_net(3)
+        fire = net.transitions["pad"].fire
+        monitor = MemoryMonitor(net, trace_allocations=True)
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions):
+            pass
+        allocations = monitor.report().transitions["pad"]
+        assert allocations.firings == 3
+        assert allocations.peak_bytes >= 10_000
+        assert allocations.retained_bytes >= 3 * 10_000
+        monitor.close()
+        assert net.transitions["pad"].fire is fire
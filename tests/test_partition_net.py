@@ -0,0 +1,80 @@
+import socket
+
+from helpers.partition_net import PartitionPetriNet, SocketTransport
+from petri_net import ArcIn, New, Place, SelectTransition, SpillingPlaceTokens, SyncPetriNet, SyncTransition, Token
+
+
+def words_net():
+    return New.petri_net((
+        Place(id="sentences", name="Sentences", tokens=(Token("0", "one two three four five six seven eight"),)),
+        ArcIn("sentences", "split"),
+        SyncTransition.expand(
+            "split",
+            lambda t: tuple(Token(str(i), word) for i, word in enumerate(t.data.split(" "))),
+            maximum_firings=None,
+            priority=1,
+        ),
+        *New.arc_out_and_empty_place("split", "words"),
+        ArcIn("words", "route"),
+        SyncTransition.fork(
+            "route",
+            lambda t: t,
+            lambda t: ("short",) if len(t.data) <= 3 else ("long",),
+            maximum_firings=None,
+            priority=2,
+        ),
+        *New.arc_out_and_empty_place("route", "short"),
+        *New.arc_out_and_empty_place("route", "long"),
+        ArcIn("short", "upper_case"),
+        SyncTransition.flip("upper_case", lambda t: Token(t.id, t.data.upper()), maximum_firings=None, priority=3),
+        ArcIn("long", "title_case"),
+        SyncTransition.flip("title_case", lambda t: Token(t.id, t.data.title()), maximum_firings=None, priority=3),
+        *New.arc_out_and_empty_place("upper_case", "done"),
+        New.arc_out_and_empty_place("title_case", "done")[0],
+    ))
+
+
+def spilling_words_net():
+    net = words_net()
+    net.places["words"] = New.empty_place("words", maximum_tokens_in_memory=2)
+    net.places["done"] = New.empty_place("done", maximum_tokens_in_memory=2)
+    return net
+
+
+def free_address() -> tuple[str, int]:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()
+
+
+class TestPartitionPetriNet:
+
+    def test_places_are_owned_by_the_partition_of_their_consumers(self):
+        net = words_net()
+        partitioning = PartitionPetriNet.partition(net, 2)
+        for arc in net.arcs_in:
+            assert partitioning.place_partitions[arc.place_id] == partitioning.transition_partitions[arc.transition_id]
+        assert set(partitioning.transition_partitions.values()) == {0, 1}
+        assert len(PartitionPetriNet.cross_partition_arcs(net, partitioning)) <= 2
+
+    def test_run_gives_the_same_final_marking_as_a_single_process(self):
+        sequential = words_net()
+        while SyncPetriNet.step(sequential, SelectTransition.using_priority_functions, verbose=False):
+            pass
+        partitioned = PartitionPetriNet.run(words_net, partitions=2, batch_size=2, timeout=10)
+        for place_id, place in sequential.places.items():
+            assert sorted(place.tokens, key=repr) == sorted(partitioned.places[place_id].tokens, key=repr)
+        assert partitioned.transitions["upper_case"].firings_count == 3
+
+    def test_run_over_sockets(self):
+        transport = SocketTransport([free_address() for _ in range(3)])
+        partitioned = PartitionPetriNet.run(words_net, partitions=2, transport=transport, timeout=10)
+        assert sorted(t.data for t in partitioned.places["done"].tokens) == sorted([
+            "ONE", "TWO", "Three", "Four", "Five", "SIX", "Seven", "Eight",
+        ])
+
+    def test_spilling_places_keep_their_containers(self):
+        partitioned = PartitionPetriNet.run(spilling_words_net, partitions=2, batch_size=2, timeout=10)
+        assert isinstance(partitioned.places["done"].tokens, SpillingPlaceTokens)
+        assert partitioned.places["done"].tokens.spilled_count > 0
+        assert len(partitioned.places["done"].tokens) == 8
@@ -1,9 +1,34 @@
+import asyncio
+import random
+import time
+from dataclasses import replace
+
+import pytest
+
 from petri_net import (
-    AddTokens, PetriNetOperations, RemoveToken, SelectTransition, SyncFiringFunctions, Token, Place,
-    Transition, ArcIn, ArcOut, PetriNet
+    AcquiredResources, AdaptiveConcurrencyLimit, AddTokens, TransitionFiringLimitExceeded, AsyncFiringFunctions,
+    AsyncPetriNet, AsyncTransition, ConcurrencyLimit, KeyedJoin, ConnectionPool, DeltaStream, Hedge, Lanes,
+    StepDelta, SingleFlight, TokenBucket, TransformCache, CountPriorityFunction, New, PetriNetOperations,
+    PlaceTokens, RemoveToken, SelectToken, SelectTransition, SyncFiringFunctions, ShedPolicy, SpillingPlaceTokens,
+    StagedPetriNet, SyncPetriNet, SyncTransition, ThreadedPetriNet, Token, Place, Transition,
+    TransitionPriorityFunction, ArcIn, ArcOut, PetriNet,
 )
 
 
+class TestToken:
+
+    def test_token_is_slotted(self):
+        token = Token("1", "ONE", 2)
+        assert not hasattr(token, "__dict__")
+        assert (token.id, token.data, token.priority) == ("1", "ONE", 2)
+
+    def test_token_with_unhashable_data_can_be_hashed(self):
+        token = Token("1", {"word": "ONE"})
+        assert hash(token) == hash(Token("1", {"word": "TWO"}))
+        assert token == Token("1", {"word": "ONE"})
+        assert token != Token("1", {"word": "TWO"})
+
+
 class TestPetriNetOperations:
 
     def net_01():
@@ -50,6 +75,25 @@ class TestPetriNetOperations:
         outgoing_places = PetriNetOperations.collect_outgoing_places(net, transition)
         assert outgoing_places == {"p2": net.places["p2"]}
 
+    def test_transition_priorities_from_token_counts_and_custom_functions(self):
+        net = TestPetriNetOperations.net_01()
+        net.transitions["t0"].priority_function = TransitionPriorityFunction.constant_if_any_input_tokens(7)
+        net.transitions["t1"].priority_function = lambda input_places, _: 10 * len(input_places)
+        assert isinstance(net.transitions["t0"].priority_function, CountPriorityFunction)
+        assert PetriNetOperations.transition_priorities(net) == {"t0": 7, "t1": 20}
+        net.transitions["t1"].priority_function = TransitionPriorityFunction.equal_to_input_token_count()
+        assert PetriNetOperations.transition_priorities(net) == {"t0": 7, "t1": 2}
+
+    def test_arc_index_is_rebuilt_when_arcs_change(self):
+        net = TestPetriNetOperations.net_01()
+        net.arcs_in = set(net.arcs_in)
+        assert tuple(PetriNetOperations.collect_incoming_places(net, net.transitions["t0"])) == ("p0",)
+        net.arcs_in.add(ArcIn(place_id="p2", transition_id="t0"))
+        assert tuple(PetriNetOperations.collect_incoming_places(net, net.transitions["t0"])) == ("p0", "p2")
+        net.arcs_in.discard(ArcIn(place_id="p0", transition_id="t0"))
+        net.arcs_in.add(ArcIn(place_id="p1", transition_id="t0"))
+        assert tuple(PetriNetOperations.collect_incoming_places(net, net.transitions["t0"])) == ("p1", "p2")
+
 
 class TestAddTokens:
 
@@ -112,6 +156,32 @@ class TestRemoveToken:
         result = RemoveToken.with_highest_priority(input_places)
         assert result == expected
 
+    def test_with_highest_priority_removes_only_one_of_several_equal_tokens(self):
+        token = Token(id="1", data="ONE", priority=1)
+        input_places = {"p": Place(id="p", name="P", tokens=(token, Token(id="1", data="ONE", priority=1), token))}
+        removed, result = RemoveToken.with_highest_priority(input_places)
+        assert removed is token
+        assert result["p"].tokens == (token, token)
+        assert len(result["p"].tokens.with_id("1")) == 2
+
+
+class TestPlaceTokens:
+
+    def test_remove_by_handle_keeps_other_tokens_in_order(self):
+        t0, t1, t2 = Token("a", 0), Token("b", 1), Token("a", 2)
+        tokens = PlaceTokens((t0, t1))
+        handle = tokens.add(t2)
+        assert tokens.remove(tokens.handles_with_id("b")[0]) is t1
+        assert tokens == (t0, t2)
+        assert tokens.remove(handle) is t2
+        assert tokens == (t0,)
+
+    def test_lookup_by_token_id(self):
+        place = Place(id="p", name="P", tokens=(Token("a", 0), Token("b", 1), Token("a", 2)))
+        assert tuple(t.data for t in place.tokens.with_id("a")) == (0, 2)
+        assert place.tokens.with_id("missing") == ()
+        assert SelectToken.with_id({"p": place}, "b") == (Token("b", 1),)
+
 
 class TestSelectTransition:
 
@@ -373,3 +443,1076 @@ class TestSyncFiringFunctions:
         )
         assert result_input_place_4 == expected_input_place_4
         assert result_output_places_4 == expected_output_places_4
+
+
+class TestPlaceCapacity:
+
+    def net_with_bounded_buffer():
+        return New.petri_net((
+            Place(id="source", name="Source", tokens=tuple(Token(id=str(i), data=i) for i in range(3))),
+            ArcIn("source", "produce"),
+            SyncTransition.flip("produce", lambda t: t, maximum_firings=None, priority=10),
+            *New.arc_out_and_empty_place("produce", "buffer", capacity=1),
+            ArcIn("buffer", "consume"),
+            SyncTransition.flip("consume", lambda t: t, maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("consume", "sink"),
+        ))
+
+    def test_transition_with_full_output_place_is_not_selected(self):
+        net = TestPlaceCapacity.net_with_bounded_buffer()
+        assert SelectTransition.using_priority_functions(net).id == "produce"
+        assert SyncPetriNet.step(net, SelectTransition.using_priority_functions)
+        assert len(net.places["buffer"].tokens) == 1
+        assert PetriNetOperations.transition_priorities(net)["produce"] == 0
+        assert SelectTransition.using_priority_functions(net).id == "consume"
+
+    def test_blocked_transition_resumes_once_output_place_is_drained(self):
+        net = TestPlaceCapacity.net_with_bounded_buffer()
+        fired = []
+        while True:
+            transition = SelectTransition.using_priority_functions(net)
+            if transition is None:
+                break
+            fired.append(transition.id)
+            assert len(net.places["buffer"].tokens) <= 1
+            SyncPetriNet.step(net, SelectTransition.using_priority_functions)
+        assert fired == ["produce", "consume"] * 3
+        assert len(net.places["sink"].tokens) == 3
+
+    @pytest.mark.asyncio
+    async def test_async_run_counts_firings_in_flight_against_output_capacity(self):
+        async def transform(token: Token) -> Token:
+            await asyncio.sleep(0.001)
+            return token
+
+        net = New.petri_net((
+            Place(id="in", name="In", tokens=tuple(Token(str(i), i) for i in range(50))),
+            ArcIn("in", "call"),
+            AsyncTransition.flip("call", transform, maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("call", "out", capacity=2),
+        ))
+        assert await AsyncPetriNet.run(net, SelectTransition.using_priority_functions) == 2
+        assert len(net.places["out"].tokens) == 2
+        assert len(net.places["in"].tokens) == 48
+
+
+class TestResourcePools:
+
+    def net_with_async_flip(tokens: int, resource_pools=None, **flip_arguments):
+        calls = {"in_flight": 0, "most_in_flight": 0}
+
+        async def transform(token: Token) -> Token:
+            calls["in_flight"] += 1
+            calls["most_in_flight"] = max(calls["most_in_flight"], calls["in_flight"])
+            await asyncio.sleep(0.005)
+            calls["in_flight"] -= 1
+            return token
+
+        net = New.petri_net(
+            (
+                Place(id="in", name="In", tokens=tuple(Token(str(i), i) for i in range(tokens))),
+                ArcIn("in", "call"),
+                AsyncTransition.flip(
+                    "call", transform, maximum_firings=None, priority=1, resource_pools=tuple(resource_pools or ()),
+                    **flip_arguments,
+                ),
+                *New.arc_out_and_empty_place("call", "out"),
+            ),
+            resource_pools=resource_pools,
+        )
+        return net, calls
+
+    @pytest.mark.asyncio
+    async def test_run_respects_maximum_concurrency(self):
+        net, calls = TestResourcePools.net_with_async_flip(10, maximum_concurrency=3)
+        assert await AsyncPetriNet.run(net, SelectTransition.using_priority_functions) == 10
+        assert calls["most_in_flight"] == 3
+        assert len(net.places["out"].tokens) == 10
+        assert net.transitions["call"].firings_count == 10
+        assert net.firings_in_flight == {}
+
+    @pytest.mark.asyncio
+    async def test_shared_connection_pool_limits_connections(self):
+        connections = []
+
+        async def lookup(token: Token) -> Token:
+            connection = AcquiredResources.get("db")
+            await asyncio.sleep(0.001)
+            return Token(token.id, id(connection))
+
+        net = New.petri_net(
+            (
+                Place(id="in", name="In", tokens=tuple(Token(str(i), i) for i in range(8))),
+                ArcIn("in", "lookup"),
+                AsyncTransition.flip("lookup", lookup, maximum_firings=None, priority=1, resource_pools=("db",)),
+                *New.arc_out_and_empty_place("lookup", "out"),
+            ),
+            resource_pools={"db": ConnectionPool(lambda: connections.append(object()) or connections[-1], size=2)},
+        )
+        await AsyncPetriNet.run(net, SelectTransition.using_priority_functions)
+        assert len(connections) == 2
+        assert {t.data for t in net.places["out"].tokens} == {id(connection) for connection in connections}
+
+    @pytest.mark.asyncio
+    async def test_run_waits_for_rate_limit(self):
+        net, _ = TestResourcePools.net_with_async_flip(4, resource_pools={"api": TokenBucket(rate=200, burst=1)})
+        started = time.monotonic()
+        assert await AsyncPetriNet.run(net, SelectTransition.using_priority_functions) == 4
+        assert time.monotonic() - started >= 3 / 200
+
+    def test_token_bucket_refills_over_time(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+        bucket.acquire()
+        bucket.acquire()
+        assert not bucket.available()
+        assert bucket.seconds_until_available() == 0.5
+        now[0] = 0.5
+        assert bucket.available()
+
+    def test_shared_concurrency_limit_blocks_transitions(self):
+        limit = ConcurrencyLimit(1)
+        net, _ = TestResourcePools.net_with_async_flip(2, resource_pools={"backend": limit})
+        assert SelectTransition.using_priority_functions(net).id == "call"
+        limit.acquire()
+        assert SelectTransition.using_priority_functions(net) is None
+
+    @pytest.mark.asyncio
+    async def test_failed_async_transform_puts_token_back(self):
+        token = Token("1", "ONE")
+        input_places = {"in": Place(id="in", name="In", tokens=(token,))}
+
+        async def fail(token: Token) -> Token:
+            raise RuntimeError("backend unavailable")
+
+        with pytest.raises(RuntimeError):
+            await AsyncFiringFunctions.route_and_transform_highest_priority_token(
+                input_places, {"out": Place(id="out", name="Out", tokens=())}, fail, fail,
+            )
+        assert input_places["in"].tokens == (token,)
+
+
+class TestTransformCache:
+
+    def test_flip_reuses_cached_result_for_equal_keys(self):
+        calls = []
+
+        def lookup(token: Token) -> Token:
+            calls.append(token.data)
+            return Token(token.id, token.data.upper())
+
+        cache = TransformCache(key_function=lambda data: data)
+        net = New.petri_net((
+            Place(id="in", name="In", tokens=(Token("0", "a"), Token("1", "b"), Token("2", "a"))),
+            ArcIn("in", "lookup"),
+            SyncTransition.flip("lookup", lookup, maximum_firings=None, priority=1, cache=cache),
+            *New.arc_out_and_empty_place("lookup", "out"),
+        ))
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False):
+            pass
+        assert calls == ["a", "b"]
+        assert net.places["out"].tokens == (Token("0", "A"), Token("1", "B"), Token("2", "A"))
+        assert cache.statistics() == {"hits": 1, "disk_hits": 0, "misses": 2, "evictions": 0, "size": 2}
+
+    def test_cached_result_takes_the_priority_of_the_incoming_token(self):
+        cache = TransformCache(key_function=lambda data: data)
+        cached = cache.cached(lambda token: Token(token.id, token.data.upper(), token.priority))
+        assert cached(Token("0", "a", priority=1)).priority == 1
+        assert cached(Token("1", "a", priority=9)) == Token("1", "A", priority=9)
+        assert cache.hits == 1
+
+    @pytest.mark.asyncio
+    async def test_missed_result_keeps_the_priority_and_times_set_by_the_transform(self):
+        async def retry_later(token: Token) -> Token:
+            return Token(token.id, token.data, priority=5, not_before=60.0)
+
+        cached = TransformCache(key_function=lambda data: data).cached_async(retry_later)
+        assert await cached(Token("0", "a", priority=1)) == Token("0", "a", priority=5, not_before=60.0)
+        assert await cached(Token("1", "a", priority=1)) == Token("1", "a", priority=1)
+
+    def test_least_recently_used_and_expired_results_are_evicted(self):
+        now = [0.0]
+        cache = TransformCache(key_function=lambda data: data, maximum_size=2, time_to_live=10, clock=lambda: now[0])
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == (True, 1)
+        cache.put("c", 3)
+        assert cache.get("b") == (False, None)
+        now[0] = 11
+        assert cache.get("a") == (False, None)
+        assert cache.evictions == 2
+
+    def test_disk_tier_survives_a_new_cache(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        TransformCache(key_function=lambda data: data, path=path).put("a", Token("0", "A"))
+        cache = TransformCache(key_function=lambda data: data, path=path)
+        cached = cache.cached(lambda token: Token(token.id, "not cached"))
+        assert cached(Token("5", "a")) == Token("5", "A")
+        assert cache.disk_hits == 1
+
+    def test_cache_can_be_shared_by_worker_threads(self, tmp_path):
+        cache = TransformCache(key_function=lambda data: data, path=str(tmp_path / "cache.sqlite"))
+        net = New.petri_net((
+            Place(id="in", name="In", tokens=tuple(Token(str(i), "ab"[i % 2]) for i in range(40))),
+            ArcIn("in", "lookup"),
+            SyncTransition.flip(
+                "lookup", lambda t: Token(t.id, t.data.upper()), maximum_firings=None, priority=1, cache=cache,
+            ),
+            *New.arc_out_and_empty_place("lookup", "out"),
+        ))
+        assert ThreadedPetriNet.run(net, workers=4, batch_size=2) == 40
+        assert sorted(token.data for token in net.places["out"].tokens) == ["A"] * 20 + ["B"] * 20
+        assert cache.hits + cache.misses == 40
+
+
+class TestSingleFlight:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_firings_with_equal_keys_share_one_call(self):
+        calls = []
+
+        async def lookup(token: Token) -> Token:
+            calls.append(token.data)
+            await asyncio.sleep(0.01)
+            return Token(token.id, token.data.upper())
+
+        single_flight = SingleFlight(key_function=lambda data: data)
+        net = New.petri_net((
+            Place(id="in", name="In", tokens=tuple(Token(str(i), word) for i, word in enumerate("aaaba"))),
+            ArcIn("in", "lookup"),
+            AsyncTransition.flip("lookup", lookup, maximum_firings=None, priority=1, single_flight=single_flight),
+            *New.arc_out_and_empty_place("lookup", "out"),
+        ))
+        await AsyncPetriNet.run(net, SelectTransition.using_priority_functions)
+        assert calls == ["a", "b"]
+        assert (single_flight.calls, single_flight.coalesced_calls) == (2, 3)
+        assert sorted((t.id, t.data) for t in net.places["out"].tokens) == [
+            ("0", "A"), ("1", "A"), ("2", "A"), ("3", "B"), ("4", "A"),
+        ]
+        assert single_flight.in_flight == {}
+
+    @pytest.mark.asyncio
+    async def test_shared_call_is_kept_while_any_token_waits(self):
+        started = asyncio.Event()
+
+        async def lookup(token: Token) -> Token:
+            started.set()
+            await asyncio.sleep(0.01)
+            return token
+
+        coalesced = SingleFlight(key_function=lambda data: data).coalesced(lookup)
+        first = asyncio.ensure_future(coalesced(Token("0", "a")))
+        second = asyncio.ensure_future(coalesced(Token("1", "a")))
+        await started.wait()
+        first.cancel()
+        assert await second == Token("1", "a")
+
+    @pytest.mark.asyncio
+    async def test_coalesced_results_take_the_priority_of_each_token(self):
+        async def lookup(token: Token) -> Token:
+            await asyncio.sleep(0.01)
+            return Token(token.id, token.data.upper(), token.priority)
+
+        coalesced = SingleFlight(key_function=lambda data: data).coalesced(lookup)
+        results = await asyncio.gather(coalesced(Token("0", "a", priority=1)), coalesced(Token("1", "a", priority=9)))
+        assert results == [Token("0", "A", priority=1), Token("1", "A", priority=9)]
+
+    @pytest.mark.asyncio
+    async def test_result_of_the_token_that_started_the_call_is_kept(self):
+        async def retry_later(token: Token) -> Token:
+            await asyncio.sleep(0.01)
+            return Token(token.id, token.data, priority=5, not_before=60.0)
+
+        coalesced = SingleFlight(key_function=lambda data: data).coalesced(retry_later)
+        results = await asyncio.gather(coalesced(Token("0", "a", priority=1)), coalesced(Token("1", "a", priority=1)))
+        assert results == [Token("0", "a", priority=5, not_before=60.0), Token("1", "a", priority=1)]
+
+
+class TestTimeoutsAndHedging:
+
+    @pytest.mark.asyncio
+    async def test_slow_transforms_move_their_token_to_the_timeout_place(self):
+        async def lookup(token: Token) -> Token:
+            await asyncio.sleep(1.0 if token.data == "slow" else 0.0)
+            return Token(token.id, token.data.upper())
+
+        net = New.petri_net((
+            Place(id="in", name="In", tokens=(Token("0", "fast"), Token("1", "slow"))),
+            ArcIn("in", "lookup"),
+            AsyncTransition.flip(
+                "lookup", lookup, maximum_firings=None, priority=1, timeout=0.05, timeout_place="timed_out",
+            ),
+            *New.arc_out_and_empty_place("lookup", "out"),
+            *New.arc_out_and_empty_place("lookup", "timed_out"),
+        ))
+        await AsyncPetriNet.run(net, SelectTransition.using_priority_functions)
+        assert net.places["out"].tokens == (Token("0", "FAST"),)
+        assert net.places["timed_out"].tokens == (Token("1", "slow"),)
+
+    @pytest.mark.asyncio
+    async def test_timeout_without_a_timeout_place_restores_the_token(self):
+        async def lookup(token: Token) -> Token:
+            await asyncio.sleep(1.0)
+            return token
+
+        net = New.petri_net((
+            Place(id="in", name="In", tokens=(Token("0", "slow"),)),
+            ArcIn("in", "lookup"),
+            AsyncTransition.flip("lookup", lookup, priority=1, timeout=0.01),
+            *New.arc_out_and_empty_place("lookup", "out"),
+        ))
+        with pytest.raises(asyncio.TimeoutError):
+            await AsyncPetriNet.step(net, SelectTransition.using_priority_functions)
+        assert net.places["in"].tokens == (Token("0", "slow"),)
+
+    @pytest.mark.asyncio
+    async def test_hedged_attempt_wins_over_a_straggler(self):
+        attempts = []
+
+        async def lookup(token: Token) -> Token:
+            attempts.append(token.id)
+            await asyncio.sleep(1.0 if len(attempts) == 1 else 0.0)
+            return Token(token.id, len(attempts))
+
+        hedge = Hedge(minimum_samples=1, delay=0.01)
+        result = await asyncio.wait_for(hedge.hedged(lookup)(Token("0", None)), 0.5)
+        assert result == Token("0", 2)
+        assert (hedge.calls, hedge.hedged_calls, hedge.hedge_wins) == (1, 1, 1)
+        assert len(hedge.latencies) == 1
+
+    def test_threshold_is_a_percentile_of_recent_latencies(self):
+        hedge = Hedge(percentile=0.9, minimum_samples=5, delay=2.0)
+        assert hedge.threshold() == 2.0
+        hedge.latencies.extend(i / 100 for i in range(1, 11))
+        assert hedge.threshold() == 0.10
+
+
+class TestStepDeltas:
+
+    def upper_case_net(self, words: tuple[str, ...]) -> PetriNet:
+        return New.petri_net((
+            Place("words", "Words", tuple(Token(str(i), word) for i, word in enumerate(words))),
+            ArcIn("words", "upper_case"),
+            SyncTransition.flip("upper_case", lambda t: Token(t.id, t.data.upper()), maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("upper_case", "upper_case_words"),
+        ))
+
+    def test_sync_steps_publish_the_tokens_moved(self):
+        net = self.upper_case_net(("a", "b"))
+        deltas = []
+        PetriNetOperations.subscribe(net, deltas.append)
+        SyncPetriNet.step(net, SelectTransition.using_priority_functions)
+        assert deltas == [StepDelta(
+            "upper_case", removed={"words": (Token("0", "a"),)}, added={"upper_case_words": (Token("0", "A"),)},
+        )]
+        PetriNetOperations.unsubscribe(net, deltas.append)
+        SyncPetriNet.step(net, SelectTransition.using_priority_functions)
+        assert len(deltas) == 1
+
+    def test_fire_functions_that_replace_places_are_diffed(self):
+        def replace_places(input_places, output_places):
+            token = input_places["words"].tokens[0]
+            return (
+                {"words": Place("words", "Words", input_places["words"].tokens[1:])},
+                {"upper_case_words": Place("upper_case_words", "Upper", (Token(token.id, token.data.upper()),))},
+            )
+
+        net = self.upper_case_net(("a", "b"))
+        net.transitions["upper_case"].fire = replace_places
+        stream = DeltaStream(net)
+        SyncPetriNet.step(net, SelectTransition.using_priority_functions)
+        assert [(d.removed, d.added) for d in stream] == [
+            ({"words": (Token("0", "a"),)}, {"upper_case_words": (Token("0", "A"),)}),
+        ]
+        assert list(stream) == []
+
+    @pytest.mark.asyncio
+    async def test_concurrent_firings_publish_their_own_deltas(self):
+        async def upper_case(token: Token) -> Token:
+            await asyncio.sleep(0.01 if token.id == "0" else 0)
+            return Token(token.id, token.data.upper())
+
+        net = New.petri_net((
+            Place("words", "Words", (Token("0", "a"), Token("1", "b"))),
+            ArcIn("words", "upper_case"),
+            AsyncTransition.flip("upper_case", upper_case, maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("upper_case", "upper_case_words"),
+        ))
+        stream = DeltaStream(net)
+        await AsyncPetriNet.run(net, SelectTransition.using_priority_functions, maximum_concurrent_firings=2)
+        deltas = list(stream)
+        assert [d.added for d in deltas] == [
+            {"upper_case_words": (Token("1", "B"),)}, {"upper_case_words": (Token("0", "A"),)},
+        ]
+        assert [d.removed for d in deltas] == [{"words": (Token("1", "b"),)}, {"words": (Token("0", "a"),)}]
+
+
+class TestAdaptiveConcurrencyLimit:
+
+    def fire(self, pool: AdaptiveConcurrencyLimit, latency: float, error=None) -> None:
+        """Fill the pool and release every firing with the same latency."""
+        resources = [pool.acquire() for _ in range(pool.limit)]
+        for resource in resources:
+            pool.release(resource, latency, error)
+
+    def test_aimd_grows_when_saturated_and_backs_off_on_errors_and_slow_firings(self):
+        pool = AdaptiveConcurrencyLimit(initial_limit=4, algorithm="aimd", latency_threshold=0.5)
+        for _ in range(8):
+            self.fire(pool, latency=0.1)
+        assert pool.limit > 4
+        limit = pool.limit
+        pool.release(pool.acquire(), 0.1, RuntimeError("backend overloaded"))
+        assert pool.limit < limit
+        limit = pool.limit
+        self.fire(pool, latency=1.0)
+        assert pool.limit < limit
+
+    def test_aimd_does_not_grow_when_underused(self):
+        pool = AdaptiveConcurrencyLimit(initial_limit=8, algorithm="aimd")
+        for _ in range(100):
+            pool.release(pool.acquire(), 0.1, None)
+        assert pool.limit == 8
+
+    def test_gradient_shrinks_as_latency_rises_and_respects_bounds(self):
+        pool = AdaptiveConcurrencyLimit(initial_limit=10, minimum_limit=2, maximum_limit=20, algorithm="gradient")
+        for _ in range(20):
+            self.fire(pool, latency=0.1)
+        assert pool.limit == 20
+        for _ in range(20):
+            self.fire(pool, latency=1.0)
+        assert pool.limit == 2
+
+    def test_cancelled_firings_do_not_change_the_limit(self):
+        pool = AdaptiveConcurrencyLimit(initial_limit=4)
+        pool.release(pool.acquire(), 0.1, asyncio.CancelledError())
+        assert pool.limit == 4
+
+    @pytest.mark.asyncio
+    async def test_limits_are_exposed_as_metrics(self):
+        async def lookup(token: Token) -> Token:
+            await asyncio.sleep(0.001)
+            return token
+
+        net = New.petri_net((
+            Place("in", "In", tuple(Token(str(i), i) for i in range(20))),
+            ArcIn("in", "lookup"),
+            AsyncTransition.flip("lookup", lookup, maximum_firings=None, priority=1, resource_pools=("backend",)),
+            *New.arc_out_and_empty_place("lookup", "out"),
+        ), resource_pools={"backend": AdaptiveConcurrencyLimit(initial_limit=2)})
+        await AsyncPetriNet.run(net, SelectTransition.using_priority_functions)
+        metrics = PetriNetOperations.resource_metrics(net)["backend"]
+        assert metrics["in_use"] == 0 and metrics["successes"] == 20
+        assert metrics["limit"] >= 2
+
+
+class TestLoadShedding:
+
+    def test_lowest_priority_newest_tokens_are_shed_past_the_count(self):
+        place = Place("in", "In", (
+            Token("a", 1, priority=1), Token("b", 2, priority=3), Token("c", 3, priority=1), Token("d", 4, priority=2),
+        ))
+        policy = ShedPolicy(maximum_count=2)
+        assert [place.tokens.get(handle).id for handle, _ in policy.select(place.tokens)] == ["c", "a"]
+        assert policy.shed_counts == {"count": 2}
+
+    def test_protected_tokens_are_never_shed(self):
+        place = Place("in", "In", tuple(Token(str(i), i, priority=5) for i in range(4)))
+        assert ShedPolicy(maximum_count=1, protected_priority=5).select(place.tokens) == []
+
+    def test_tokens_past_the_maximum_age_are_shed(self):
+        now = [0.0]
+        policy = ShedPolicy(maximum_age=10.0, clock=lambda: now[0])
+        place = Place("in", "In", (Token("old", 1),))
+        assert policy.select(place.tokens) == []
+        now[0] = 5.0
+        place.tokens.add(Token("new", 2))
+        assert policy.select(place.tokens) == []
+        now[0] = 12.0
+        shed = policy.select(place.tokens)
+        assert [(place.tokens.get(handle).id, reason) for handle, reason in shed] == [("old", "age")]
+
+    def test_ages_restart_when_the_place_is_given_a_new_container(self):
+        now = [0.0]
+        policy = ShedPolicy(maximum_age=10.0, clock=lambda: now[0])
+        place = Place("in", "In", tuple(Token(str(i), i) for i in range(3)))
+        assert policy.select(place.tokens) == []
+        now[0] = 12.0
+        place.tokens = (Token("fresh", 0),)
+        assert policy.select(place.tokens) == []
+        now[0] = 23.0
+        assert [place.tokens.get(handle).id for handle, _ in policy.select(place.tokens)] == ["fresh"]
+
+    def test_bytes_limit_uses_the_sampled_token_size(self):
+        place = Place("in", "In", tuple(Token(str(i), "x" * 1000) for i in range(10)))
+        policy = ShedPolicy(maximum_bytes=5000, size_function=lambda t: len(t.data))
+        assert len(policy.select(place.tokens)) == 5
+        assert policy.shed_counts == {"bytes": 5}
+
+    def test_firings_shed_output_tokens_to_the_shed_place(self):
+        net = New.petri_net((
+            Place("in", "In", tuple(Token(str(i), i, priority=i % 2) for i in range(6))),
+            ArcIn("in", "copy"),
+            SyncTransition.flip("copy", lambda t: t, maximum_firings=None, priority=1),
+            ArcOut("copy", "out"),
+            New.empty_place("out", shed_policy=ShedPolicy(maximum_count=2, shed_place="shed")),
+            New.empty_place("shed"),
+        ))
+        stream = DeltaStream(net)
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions):
+            pass
+        assert {t.priority for t in net.places["out"].tokens} == {1}
+        assert len(net.places["shed"].tokens) == 4
+        assert PetriNetOperations.shed_counts(net) == {"out": {"count": 4}}
+        assert sum(1 for delta in stream if delta.transition_id is None) == 4
+
+    def test_shed_place_must_exist(self):
+        with pytest.raises(ValueError):
+            New.petri_net((New.empty_place("out", shed_policy=ShedPolicy(maximum_count=1, shed_place="shed")),))
+
+
+class TestThreadedPetriNet:
+
+    def word_net(self, sentence_count: int, maximum_upper_case_firings=None) -> PetriNet:
+        return New.petri_net((
+            Place("sentences", "Sentences", tuple(
+                Token(str(i), f"the {i} quick brown fox", priority=i % 3) for i in range(sentence_count)
+            )),
+            ArcIn("sentences", "split"),
+            SyncTransition.expand(
+                "split",
+                lambda t: tuple(Token(f"{t.id}.{i}", w, t.priority) for i, w in enumerate(t.data.split())),
+                maximum_firings=None,
+                priority=1,
+            ),
+            *New.arc_out_and_empty_place("split", "words"),
+            ArcIn("words", "upper_case"),
+            SyncTransition.flip(
+                "upper_case",
+                lambda t: replace(t, data=t.data.upper()),
+                maximum_firings=maximum_upper_case_firings,
+                priority=2,
+            ),
+            *New.arc_out_and_empty_place("upper_case", "upper_case_words"),
+            ArcIn("upper_case_words", "by_length"),
+            SyncTransition.fork(
+                "by_length", lambda t: t, lambda t: ("long",) if len(t.data) > 3 else ("short",),
+                maximum_firings=None, priority=3,
+            ),
+            *New.arc_out_and_empty_place("by_length", "long"),
+            *New.arc_out_and_empty_place("by_length", "short"),
+        ))
+
+    def sorted_marking(self, net: PetriNet) -> dict[str, list[Token]]:
+        return {place_id: sorted(place.tokens, key=lambda t: t.id) for place_id, place in net.places.items()}
+
+    def test_final_marking_matches_sequential_firing(self):
+        sequential = self.word_net(20)
+        while SyncPetriNet.step(sequential, SelectTransition.using_priority_functions, verbose=False):
+            pass
+        threaded = self.word_net(20)
+        changes = ThreadedPetriNet.run(threaded, workers=4, batch_size=3)
+        assert changes == 20 + 100 + 100
+        assert self.sorted_marking(threaded) == self.sorted_marking(sequential)
+        assert threaded.transitions["upper_case"].firings_count == 100
+        assert threaded.firings_in_flight == {}
+
+    def test_maximum_firings_are_respected(self):
+        net = self.word_net(4, maximum_upper_case_firings=7)
+        ThreadedPetriNet.run(net, workers=3)
+        assert len(net.places["words"].tokens) == 20 - 7
+        assert len(net.places["long"].tokens) + len(net.places["short"].tokens) == 7
+
+    def test_errors_are_raised_and_tokens_put_back(self):
+        def fail_on_fox(token: Token) -> Token:
+            if token.data == "fox":
+                raise RuntimeError("no foxes")
+            return token
+
+        net = New.petri_net((
+            Place("words", "Words", tuple(Token(str(i), w) for i, w in enumerate(["a", "fox", "b", "c"]))),
+            ArcIn("words", "check"),
+            SyncTransition.flip("check", fail_on_fox, maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("check", "checked"),
+        ))
+        with pytest.raises(RuntimeError):
+            ThreadedPetriNet.run(net, workers=2)
+        assert len(net.places["words"].tokens) + len(net.places["checked"].tokens) == 4
+        assert "fox" in {t.data for t in net.places["words"].tokens}
+
+    def test_errors_from_priority_functions_are_raised_and_tokens_put_back(self):
+        calls = [0]
+
+        def priority_function(input_places, _) -> int:
+            calls[0] += 1
+            if calls[0] > 20:
+                raise RuntimeError("priority failed")
+            return SelectToken.total_count(input_places)
+
+        net = New.petri_net((
+            Place("src", "Source", tuple(Token(str(i), i) for i in range(50))),
+            ArcIn("src", "move"),
+            SyncTransition.flip("move", lambda t: t, maximum_firings=None, priority_function=priority_function),
+            *New.arc_out_and_empty_place("move", "out"),
+        ))
+        with pytest.raises(RuntimeError):
+            ThreadedPetriNet.run(net, workers=2, batch_size=4)
+        assert len(net.places["src"].tokens) + len(net.places["out"].tokens) == 50
+        assert net.firings_in_flight == {}
+
+    def test_reserved_firings_do_not_overfill_bounded_places(self):
+        net = New.petri_net((
+            Place("src", "Source", tuple(Token(str(i), i) for i in range(10))),
+            ArcIn("src", "move"),
+            SyncTransition.flip("move", lambda t: t, maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("move", "out", capacity=2),
+        ))
+        assert ThreadedPetriNet.run(net, workers=2, batch_size=4) == 2
+        assert len(net.places["out"].tokens) == 2
+        assert len(net.places["src"].tokens) == 8
+
+    def test_async_transitions_are_rejected(self):
+        async def identity(token: Token) -> Token:
+            return token
+
+        net = New.petri_net((
+            New.empty_place("in"), ArcIn("in", "a"), AsyncTransition.flip("a", identity, priority=1),
+        ))
+        with pytest.raises(ValueError):
+            ThreadedPetriNet.run(net)
+
+    def test_joins_are_rejected_and_leave_the_tokens_in_place(self):
+        net = New.petri_net((
+            Place(id="req", name="Requests", tokens=(Token("0", 1),)),
+            Place(id="resp", name="Responses", tokens=(Token("1", 1),)),
+            ArcIn("req", "pair"),
+            ArcIn("resp", "pair"),
+            SyncTransition.join("pair", ("req", "resp"), lambda data: data, lambda tokens: tokens[0], priority=1),
+            *New.arc_out_and_empty_place("pair", "answered"),
+        ))
+        with pytest.raises(ValueError):
+            ThreadedPetriNet.run(net, workers=2)
+        assert len(net.places["req"].tokens) == 1 and len(net.places["resp"].tokens) == 1
+        assert len(net.places["answered"].tokens) == 0
+        assert SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False)
+        assert len(net.places["answered"].tokens) == 1
+
+
+class TestStagedPetriNet:
+
+    def branching_net(self, capacity=None, maximum_firings=None) -> PetriNet:
+        return New.petri_net((
+            Place("sentences", "Sentences", (Token("0", "one, two, another two, three"), Token("1", "four, five"))),
+            ArcIn("sentences", "split"),
+            SyncTransition.expand(
+                "split",
+                lambda t: tuple(Token(f"{t.id}.{i}", w, priority=i) for i, w in enumerate(t.data.split(", "))),
+                maximum_firings=None,
+                priority=1,
+            ),
+            ArcOut("split", "words"),
+            New.empty_place("words", capacity=capacity),
+            ArcIn("words", "by_length"),
+            SyncTransition.fork(
+                "by_length", lambda t: t, lambda t: ("long",) if len(t.data) > 4 else ("short",),
+                maximum_firings=maximum_firings, priority=2,
+            ),
+            *New.arc_out_and_empty_place("by_length", "long"),
+            *New.arc_out_and_empty_place("by_length", "short"),
+            ArcIn("long", "upper_case"),
+            ArcIn("short", "upper_case"),
+            SyncTransition.flip(
+                "upper_case", lambda t: Token(t.id, t.data.upper(), t.priority), maximum_firings=None, priority=3,
+            ),
+            *New.arc_out_and_empty_place("upper_case", "upper_case_words"),
+            ArcIn("upper_case_words", "low"),
+            SyncTransition.flip("low", lambda t: t, maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("low", "low_priority_words"),
+            ArcIn("upper_case_words", "high"),
+            SyncTransition.flip("high", lambda t: t, maximum_firings=None, priority=5),
+            *New.arc_out_and_empty_place("high", "high_priority_words"),
+        ))
+
+    def test_stages_are_topological(self):
+        assert StagedPetriNet.stages(self.branching_net()) == (
+            ("split",), ("by_length",), ("upper_case",), ("low", "high"),
+        )
+
+    def test_cycles_are_detected(self):
+        net = New.petri_net((
+            New.empty_place("a"), New.empty_place("b"),
+            ArcIn("a", "forward"), SyncTransition.flip("forward", lambda t: t, priority=1), ArcOut("forward", "b"),
+            ArcIn("b", "back"), SyncTransition.flip("back", lambda t: t, priority=1), ArcOut("back", "a"),
+        ))
+        assert StagedPetriNet.stages(net) is None
+        with pytest.raises(ValueError):
+            StagedPetriNet.run(net)
+
+    @pytest.mark.parametrize("capacity", [None, 2])
+    def test_final_marking_matches_priority_driven_stepping(self, capacity):
+        sequential = self.branching_net(capacity)
+        sequential_firings = 0
+        while SyncPetriNet.step(sequential, SelectTransition.using_priority_functions, verbose=False):
+            sequential_firings += 1
+        staged = self.branching_net(capacity)
+        assert StagedPetriNet.run(staged) == sequential_firings == 20
+        for place_id, place in sequential.places.items():
+            assert sorted(staged.places[place_id].tokens, key=repr) == sorted(place.tokens, key=repr)
+        assert staged.transitions["by_length"].firings_count == 6
+        assert (staged.transitions["low"].firings_count, staged.transitions["high"].firings_count) == (0, 6)
+
+    def test_maximum_firings_are_exceeded_as_when_stepping(self):
+        with pytest.raises(TransitionFiringLimitExceeded):
+            StagedPetriNet.run(self.branching_net(maximum_firings=3))
+
+
+class TestKeyedLanes:
+
+    def lanes_net(self, tokens, lanes, maximum_concurrency=None):
+        processed, active = [], []
+
+        async def process(token: Token) -> Token:
+            active.append(token.data[0])
+            processed.append((token.id, len(active)))
+            await asyncio.sleep(0.01)
+            active.remove(token.data[0])
+            return token
+
+        net = New.petri_net((
+            Place(id="in", name="In", tokens=tokens),
+            ArcIn("in", "process"),
+            AsyncTransition.flip(
+                "process", process, maximum_firings=None, priority=1, maximum_concurrency=maximum_concurrency,
+                lanes=lanes,
+            ),
+            *New.arc_out_and_empty_place("process", "out"),
+        ))
+        return net, processed
+
+    @pytest.mark.asyncio
+    async def test_each_key_is_processed_in_order_while_keys_run_concurrently(self):
+        tokens = tuple(Token(str(i), ("ab"[i % 2], i)) for i in range(6))
+        net, processed = self.lanes_net(tokens, Lanes(lambda data: data[0]))
+        await AsyncPetriNet.run(net, SelectTransition.using_priority_functions)
+        assert [id for id, _ in processed] == ["0", "1", "2", "3", "4", "5"]
+        assert max(concurrent for _, concurrent in processed) == 2
+        for key in "ab":
+            assert [t.data[1] for t in net.places["out"].tokens if t.data[0] == key] == sorted(
+                t.data[1] for t in tokens if t.data[0] == key
+            )
+
+    @pytest.mark.asyncio
+    async def test_maximum_concurrency_limits_the_active_lanes(self):
+        tokens = tuple(Token(str(i), ("abcd"[i % 4], i)) for i in range(8))
+        net, processed = self.lanes_net(tokens, Lanes(lambda data: data[0]), maximum_concurrency=2)
+        await AsyncPetriNet.run(net, SelectTransition.using_priority_functions)
+        assert len(net.places["out"].tokens) == 8
+        assert max(concurrent for _, concurrent in processed) == 2
+
+    @pytest.mark.asyncio
+    async def test_tokens_within_a_lane_follow_priority_or_fifo_order(self):
+        tokens = (Token("0", ("a", 0), priority=1), Token("1", ("a", 1), priority=3), Token("2", ("a", 2), priority=2))
+        by_priority, processed_by_priority = self.lanes_net(tokens, Lanes(lambda data: data[0]))
+        await AsyncPetriNet.run(by_priority, SelectTransition.using_priority_functions)
+        assert [id for id, _ in processed_by_priority] == ["1", "2", "0"]
+        in_order, processed_in_order = self.lanes_net(tokens, Lanes(lambda data: data[0], order="fifo"))
+        await AsyncPetriNet.run(in_order, SelectTransition.using_priority_functions)
+        assert [id for id, _ in processed_in_order] == ["0", "1", "2"]
+
+    def test_unknown_order_is_rejected(self):
+        with pytest.raises(ValueError):
+            Lanes(lambda data: data, order="random")
+
+
+class TestKeyedJoin:
+
+    def join_net(self, requests, responses, extra_nodes=(), **join_options):
+        return New.petri_net((
+            Place(id="requests", name="Requests", tokens=requests),
+            Place(id="responses", name="Responses", tokens=responses),
+            ArcIn("requests", "pair"),
+            ArcIn("responses", "pair"),
+            SyncTransition.join(
+                "pair", ("requests", "responses"), lambda data: data["request_id"],
+                lambda tokens: Token(tokens[0].id, (tokens[0].data["query"], tokens[1].data["answer"])),
+                maximum_firings=None, priority=1, **join_options,
+            ),
+            *New.arc_out_and_empty_place("pair", "answered"),
+            *extra_nodes,
+        ))
+
+    def test_tokens_are_paired_by_key_across_places(self):
+        net = self.join_net(
+            (Token("0", {"request_id": 1, "query": "a"}), Token("1", {"request_id": 2, "query": "b"})),
+            (Token("2", {"request_id": 2, "answer": "B"}), Token("3", {"request_id": 3, "answer": "C"})),
+        )
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False):
+            pass
+        assert net.places["answered"].tokens == (Token("1", ("b", "B")),)
+        assert [t.id for t in net.places["requests"].tokens] == ["0"]
+        assert [t.id for t in net.places["responses"].tokens] == ["3"]
+        net.places["responses"].tokens.add(Token("4", {"request_id": 1, "answer": "A"}))
+        assert SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False)
+        assert net.places["answered"].tokens == (Token("1", ("b", "B")), Token("0", ("a", "A")))
+
+    def test_duplicate_keys_are_joined_oldest_first(self):
+        net = self.join_net(
+            (Token("0", {"request_id": 1, "query": "a"}), Token("1", {"request_id": 1, "query": "b"})),
+            (Token("2", {"request_id": 1, "answer": "A"}),),
+        )
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False):
+            pass
+        assert net.places["answered"].tokens == (Token("0", ("a", "A")),)
+        assert [t.id for t in net.places["requests"].tokens] == ["1"]
+
+    def test_tokens_taken_by_other_transitions_are_not_matched(self):
+        net = self.join_net((Token("0", {"request_id": 1, "query": "a"}),), ())
+        assert PetriNetOperations.transition_priorities(net)["pair"] == 0
+        RemoveToken.by_handle(net.places, "requests", net.places["requests"].tokens.handles_with_id("0")[0])
+        net.places["responses"].tokens.add(Token("1", {"request_id": 1, "answer": "A"}))
+        assert not SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False)
+        assert net.places["answered"].tokens == ()
+
+    def test_unmatched_tokens_expire_to_the_expired_place(self):
+        now = [0.0]
+        net = self.join_net(
+            (Token("0", {"request_id": 1, "query": "a"}),), (), timeout=5.0, expired_place="expired",
+            clock=lambda: now[0], extra_nodes=New.arc_out_and_empty_place("pair", "expired"),
+        )
+        assert not SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False)
+        now[0] = 6.0
+        net.places["requests"].tokens.add(Token("1", {"request_id": 2, "query": "b"}))
+        assert SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False)
+        assert net.places["expired"].tokens == (Token("0", {"request_id": 1, "query": "a"}),)
+        assert [t.id for t in net.places["requests"].tokens] == ["1"]
+        assert net.places["answered"].tokens == ()
+
+    def test_a_join_needs_two_places(self):
+        with pytest.raises(ValueError):
+            KeyedJoin(lambda data: data, ("requests",))
+
+
+class TestStreamingExpand:
+
+    def streaming_net(self, pages, events, capacity=None, consume=True):
+        async def fetch(token: Token):
+            for page in range(pages):
+                await asyncio.sleep(0.001)
+                events.append(("yield", page))
+                yield Token(f"{token.id}.{page}", page)
+
+        async def process(token: Token) -> Token:
+            events.append(("process", token.data))
+            await asyncio.sleep(0.005)
+            return token
+
+        consumer = (
+            ArcIn("items", "process"),
+            AsyncTransition.flip("process", process, maximum_firings=None, priority=1, maximum_concurrency=1),
+            *New.arc_out_and_empty_place("process", "processed"),
+        )
+        return New.petri_net((
+            Place(id="queries", name="Queries", tokens=(Token("q", "query"),)),
+            ArcIn("queries", "fetch"),
+            AsyncTransition.expand("fetch", fetch, priority=1),
+            ArcOut("fetch", "items"),
+            New.empty_place("items", capacity=capacity),
+            *(consumer if consume else ()),
+        ))
+
+    @pytest.mark.asyncio
+    async def test_children_are_processed_while_the_generator_runs(self):
+        events = []
+        net = self.streaming_net(5, events)
+        await AsyncPetriNet.run(net, SelectTransition.using_priority_functions)
+        assert len(net.places["processed"].tokens) == 5
+        assert net.transitions["fetch"].firings_count == 1
+        assert events.index(("process", 0)) < events.index(("yield", 4))
+
+    @pytest.mark.asyncio
+    async def test_a_full_output_place_pauses_the_generator(self):
+        events = []
+        net = self.streaming_net(10, events, capacity=2)
+        await asyncio.wait_for(AsyncPetriNet.run(net, SelectTransition.using_priority_functions), 5)
+        assert sorted(token.data for token in net.places["processed"].tokens) == list(range(10))
+        for i, (kind, _) in enumerate(events):
+            if kind == "yield":  # The generator only resumes once the items place has space.
+                waiting = sum(1 for kind, _ in events[:i] if kind == "yield") - sum(
+                    1 for kind, _ in events[:i] if kind == "process"
+                )
+                assert waiting < 2
+
+    @pytest.mark.asyncio
+    async def test_a_full_place_without_consumers_does_not_stall_the_run(self):
+        net = self.streaming_net(3, [], capacity=1, consume=False)
+        await asyncio.wait_for(AsyncPetriNet.run(net, SelectTransition.using_priority_functions), 5)
+        assert [token.data for token in net.places["items"].tokens] == [0, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_stepping_adds_the_streamed_children(self):
+        net = self.streaming_net(3, [], consume=False)
+        assert await AsyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False)
+        assert [token.id for token in net.places["items"].tokens] == ["q.0", "q.1", "q.2"]
+        assert net.places["queries"].tokens == ()
+
+    @pytest.mark.asyncio
+    async def test_a_generator_failing_after_yielding_does_not_expand_its_token_again(self):
+        async def fetch(token: Token):
+            yield Token("a", "a")
+            yield Token("b", "b")
+            raise RuntimeError("connection lost")
+
+        net = New.petri_net((
+            Place(id="queries", name="Queries", tokens=(Token("q", "query"),)),
+            ArcIn("queries", "fetch"),
+            AsyncTransition.expand("fetch", fetch, priority=1),
+            *New.arc_out_and_empty_place("fetch", "items"),
+        ))
+        with pytest.raises(RuntimeError):
+            await AsyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False)
+        assert not await AsyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False)
+        assert [token.id for token in net.places["items"].tokens] == ["a", "b"]
+        assert net.places["queries"].tokens == ()
+
+    def test_streaming_expand_cannot_be_cached(self):
+        async def fetch(token: Token):
+            yield token
+
+        with pytest.raises(ValueError):
+            AsyncTransition.expand("fetch", fetch, priority=1, cache=TransformCache(lambda data: data))
+
+
+class TestSpillingPlaceTokens:
+
+    def test_behaves_as_place_tokens_while_spilling(self):
+        rng = random.Random(3)
+        plain, spilling = PlaceTokens(), SpillingPlaceTokens(maximum_in_memory=8, batch_size=3)
+        for step in range(600):
+            if rng.random() < 0.55 or len(plain) == 0:
+                token = Token(str(rng.randrange(20)), step, priority=rng.randrange(4))
+                assert plain.add(token) == spilling.add(token)
+            elif rng.random() < 0.8:
+                handle = plain.highest_priority()[1]
+                assert spilling.highest_priority() == plain.highest_priority()
+                assert spilling.remove(handle) == plain.remove(handle)
+            else:
+                handle = rng.choice([handle for handle, _ in plain.items()])
+                assert spilling.remove(handle) == plain.remove(handle)
+            assert len(spilling) - spilling.spilled_count <= 8
+        assert spilling.spilled_count > 0
+        assert spilling == plain
+        assert list(spilling.items()) == list(plain.items())
+        assert list(spilling.in_priority_order()) == list(plain.in_priority_order())
+        assert list(reversed(spilling)) == list(reversed(plain))
+        assert spilling.with_id("7") == plain.with_id("7")
+        assert spilling.newest_handle() == plain.newest_handle()
+        assert spilling.items_after(500) == plain.items_after(500)
+
+    def test_clear_empties_memory_and_file_and_keeps_handles_increasing(self):
+        spilling = SpillingPlaceTokens(maximum_in_memory=4, batch_size=2)
+        spilling.extend(Token(str(i), i) for i in range(10))
+        assert spilling.spilled_count > 0
+        spilling.clear()
+        assert len(spilling) == 0 and spilling.spilled_count == 0 and tuple(spilling) == ()
+        assert spilling.add(Token("new", 0)) == 10
+        assert tuple(spilling) == (Token("new", 0),)
+
+    def test_a_spilling_place_drains_in_the_same_order(self):
+        def drained(place: Place) -> tuple[Token, ...]:
+            net = New.petri_net((
+                place,
+                ArcIn(place.id, "move"),
+                SyncTransition.flip("move", lambda token: token, maximum_firings=None, priority=1),
+                *New.arc_out_and_empty_place("move", "out"),
+            ))
+            while SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False):
+                pass
+            return tuple(net.places["out"].tokens)
+
+        tokens = tuple(Token(str(i), i, priority=i % 3) for i in range(300))
+        spilling = New.empty_place("in", maximum_tokens_in_memory=20)
+        spilling.tokens.extend(tokens)
+        assert len(spilling.tokens) == 300 and spilling.tokens.spilled_count >= 280
+        assert drained(spilling) == drained(Place(id="in", name="in", tokens=tokens))
+        assert len(spilling.tokens) == 0 and spilling.tokens.spilled_count == 0
+
+    def test_spilling_places_can_be_used_by_worker_threads(self):
+        source = New.empty_place("src", maximum_tokens_in_memory=10)
+        source.tokens.extend(Token(str(i), i) for i in range(100))
+        net = New.petri_net((
+            source,
+            ArcIn("src", "move"),
+            SyncTransition.flip("move", lambda token: token, maximum_firings=None, priority=1),
+            ArcOut("move", "out"),
+            New.empty_place("out", maximum_tokens_in_memory=10),
+        ))
+        assert ThreadedPetriNet.run(net, workers=3, batch_size=4) == 100
+        assert sorted(token.data for token in net.places["out"].tokens) == list(range(100))
+        assert net.places["out"].tokens.spilled_count > 0
+
+
+class TestTimedTokens:
+
+    def timed_net(self, tokens, clock):
+        return New.petri_net((
+            Place(id="in", name="In", tokens=tokens, dead_letter_place="dead_letters"),
+            ArcIn("in", "move"),
+            SyncTransition.flip("move", lambda token: token, maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("move", "out"),
+            New.empty_place("dead_letters"),
+        ), clock=clock)
+
+    def test_tokens_are_held_back_until_they_are_due(self):
+        now = [0.0]
+        net = self.timed_net((Token("0", "later", not_before=10.0), Token("1", "now")), lambda: now[0])
+        while SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False):
+            pass
+        assert net.places["out"].tokens == (Token("1", "now"),)
+        assert net.places["in"].tokens.pending() == (Token("0", "later"),)
+        assert PetriNetOperations.release_timed_tokens(net) == (False, 10.0)
+        now[0] = 10.0
+        assert SyncPetriNet.step(net, SelectTransition.using_priority_functions, verbose=False)
+        assert net.places["out"].tokens == (Token("1", "now"), Token("0", "later"))
+        assert net.places["out"].tokens[1].not_before is None
+
+    def test_expired_tokens_are_moved_to_the_dead_letter_place(self):
+        now = [0.0]
+        net = self.timed_net((
+            Token("0", "held", not_before=5.0, expires_at=3.0), Token("1", "waiting", expires_at=2.0),
+        ), lambda: now[0])
+        net.transitions["move"].priority_function = lambda input_places, output_places: 0
+        assert PetriNetOperations.release_timed_tokens(net) == (False, 2.0)
+        now[0] = 5.0
+        deltas = []
+        PetriNetOperations.subscribe(net, deltas.append)
+        assert PetriNetOperations.release_timed_tokens(net) == (True, None)
+        assert net.places["in"].tokens == ()
+        assert set(net.places["dead_letters"].tokens) == {Token("0", "held"), Token("1", "waiting")}
+        assert all(token.expires_at is None for token in net.places["dead_letters"].tokens)
+        assert len(deltas) == 1 and deltas[0].transition_id is None
+
+    @pytest.mark.asyncio
+    async def test_run_sleeps_until_a_retry_is_due(self):
+        clock_reads = []
+
+        def clock() -> float:
+            clock_reads.append(None)
+            return time.monotonic()
+
+        async def attempt(token: Token) -> Token:
+            return Token(token.id, token.data + 1, not_before=time.monotonic() + 0.02 if token.data < 2 else None)
+
+        async def route(token: Token) -> tuple[str, ...]:
+            return ("done",) if token.data == 3 else ("in",)
+
+        net = New.petri_net((
+            Place(id="in", name="In", tokens=(Token("0", 0),)),
+            ArcIn("in", "attempt"),
+            AsyncTransition.fork("attempt", attempt, route, maximum_firings=None, priority=1),
+            ArcOut("attempt", "in"),
+            *New.arc_out_and_empty_place("attempt", "done"),
+        ), clock=clock)
+        started = time.monotonic()
+        assert await AsyncPetriNet.run(net, SelectTransition.using_priority_functions) == 3
+        assert time.monotonic() - started >= 0.04
+        assert net.places["done"].tokens == (Token("0", 3),)
+        assert len(clock_reads) < 30  # Woken for each due token rather than polling.
@@ -0,0 +1,62 @@
+import pytest
+
+from helpers.simulate_net import ServiceTime, Simulation, TransitionModel
+from petri_net import ArcIn, New, SyncTransition
+
+
+def identity(token):
+    return token
+
+
+def queue_net(capacity=None):
+    return New.petri_net((
+        New.empty_place("requests", capacity=capacity),
+        ArcIn("requests", "serve"),
+        SyncTransition.flip("serve", identity, maximum_firings=None, priority=1),
+        *New.arc_out_and_empty_place("serve", "served"),
+    ))
+
+
+class TestSimulation:
+
+    def test_single_server_queue_matches_queueing_theory(self):
+        models = {"serve": TransitionModel(ServiceTime.exponential(1.0))}
+        report = Simulation(queue_net(), models, "requests", arrival_rate=0.5, seed=3).run(40_000)
+        # For an M/M/1 queue with utilization 0.5 the mean time in the system is 2 and 0.5 tokens are waiting.
+        assert report.transitions["serve"].utilization == pytest.approx(0.5, abs=0.03)
+        assert report.latency_mean == pytest.approx(2.0, rel=0.1)
+        assert report.places["requests"].mean_queue_length == pytest.approx(0.5, rel=0.15)
+        assert report.throughput == pytest.approx(0.5, rel=0.05)
+        assert set(report.latency_percentiles) == {0.5, 0.95, 0.99}
+
+    def test_fork_routing_probabilities_and_expanded_children(self):
+        net = New.petri_net((
+            New.empty_place("requests"),
+            ArcIn("requests", "route"),
+            SyncTransition.fork("route", identity, lambda t: ("cached",), maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("route", "cached"),
+            *New.arc_out_and_empty_place("route", "uncached"),
+            ArcIn("uncached", "fetch"),
+            SyncTransition.expand("fetch", lambda t: (t,), maximum_firings=None, priority=1),
+            *New.arc_out_and_empty_place("fetch", "fetched"),
+        ))
+        models = {
+            "route": TransitionModel(ServiceTime.constant(0.0), routing={"cached": 0.75, "uncached": 0.25}),
+            "fetch": TransitionModel(ServiceTime.constant(0.1), children=lambda rng: 2, servers=4),
+        }
+        report = Simulation(net, models, "requests", arrival_rate=10, seed=5).run(1_000)
+        fetched_fraction = report.transitions["fetch"].firings / report.transitions["route"].firings
+        assert fetched_fraction == pytest.approx(0.25, abs=0.02)
+        assert report.completed == report.transitions["route"].firings + report.transitions["fetch"].firings
+        assert report.transitions["fetch"].utilization == pytest.approx(10 * 0.25 * 0.1 / 4, rel=0.1)
+
+    def test_arrivals_to_a_full_place_are_rejected(self):
+        models = {"serve": TransitionModel(ServiceTime.constant(1.0))}
+        report = Simulation(queue_net(capacity=2), models, "requests", arrival_rate=10, seed=1).run(100)
+        assert report.rejected > 0
+        assert report.places["requests"].maximum_queue_length == 2
+        assert report.transitions["serve"].utilization == pytest.approx(1.0, abs=0.02)
+
+    def test_every_transition_needs_a_model(self):
+        with pytest.raises(ValueError):
+            Simulation(queue_net(), {}, "requests", arrival_rate=1.0)